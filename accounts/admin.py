@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Document, Question, Answer, Lesson, UserAnswer, LessonAttempt, GuestSession, StripePayment
+from .models import User, Document, Question, Answer, Lesson, UserAnswer, LessonAttempt, GuestSession, StripePayment, GenerationJob, QuizCacheEntry, ProviderFile, DocumentChunk, GenerationRun, AIConcurrencyTicket
+from .generation_runs import summarize_generation_runs
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
@@ -76,10 +77,13 @@ class UserAdmin(BaseUserAdmin):
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('title', 'user', 'get_user_role', 'file_type', 'created_at')
-    list_filter = ('file_type', 'created_at', 'user__is_premium')
+    list_display = ('title', 'user', 'get_user_role', 'file_type', 'page_count', 'estimated_tokens', 'created_at')
+    list_filter = ('file_type', 'created_at', 'user__is_premium', 'has_text')
     search_fields = ('title', 'user__email', 'user__username')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = (
+        'created_at', 'updated_at', 'text_extracted_at', 'text_token_count',
+        'size_bytes', 'page_count', 'image_count', 'estimated_tokens', 'has_text', 'profiled_at'
+    )
     ordering = ('-created_at',)
     
     def get_user_role(self, obj):
@@ -97,7 +101,7 @@ class DocumentAdmin(admin.ModelAdmin):
 @admin.register(Question)
 class QuestionAdmin(admin.ModelAdmin):
     list_display = ('question_text', 'document', 'lesson', 'question_type', 'difficulty', 'created_at')
-    list_filter = ('question_type', 'difficulty', 'created_at', 'document__user')
+    list_filter = ('question_type', 'difficulty', 'in_pool', 'retired', 'created_at', 'document__user')
     search_fields = ('question_text', 'document__title', 'document__user__email')
     readonly_fields = ('created_at',)
     ordering = ('-created_at',)
@@ -251,6 +255,70 @@ class StripePaymentAdmin(admin.ModelAdmin):
     is_successful_display.allow_tags = True
     is_successful_display.admin_order_field = 'is_successful'
 
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'title', 'user', 'guest_session', 'kind', 'status', 'priority', 'question_count', 'pool_extra', 'attempts', 'worker_id', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind', 'created_at')
+    search_fields = ('title', 'user__email', 'worker_id')
+    readonly_fields = ('created_at', 'started_at', 'heartbeat_at', 'not_before', 'finished_at', 'attempts', 'worker_id')
+    ordering = ('-created_at',)
+
+@admin.register(QuizCacheEntry)
+class QuizCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('file_hash', 'question_count', 'difficulty', 'education_level', 'hit_count', 'size_bytes', 'created_at', 'last_hit_at')
+    list_filter = ('difficulty', 'created_at')
+    search_fields = ('file_hash', 'cache_key')
+    readonly_fields = ('cache_key', 'file_hash', 'size_bytes', 'hit_count', 'created_at', 'last_hit_at')
+    ordering = ('-last_hit_at',)
+
+@admin.register(ProviderFile)
+class ProviderFileAdmin(admin.ModelAdmin):
+    list_display = ('file_id', 'content_hash', 'status', 'size_bytes', 'created_at', 'last_used_at', 'expires_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('file_id', 'content_hash')
+    readonly_fields = ('created_at', 'last_used_at')
+    ordering = ('-last_used_at',)
+
+@admin.register(DocumentChunk)
+class DocumentChunkAdmin(admin.ModelAdmin):
+    list_display = ('document', 'position', 'label', 'token_count')
+    search_fields = ('document__title', 'label')
+    ordering = ('document', 'position')
+
+@admin.register(AIConcurrencyTicket)
+class AIConcurrencyTicketAdmin(admin.ModelAdmin):
+    list_display = ('id', 'lane', 'status', 'slot', 'priority', 'job', 'holder', 'created_at', 'expires_at')
+    list_filter = ('status', 'lane')
+    readonly_fields = ('lane', 'priority', 'status', 'slot', 'job', 'holder', 'created_at', 'expires_at')
+    ordering = ('status', 'priority', 'created_at')
+
+@admin.register(GenerationRun)
+class GenerationRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_at', 'user', 'user_role', 'mode', 'model', 'route', 'outcome', 'question_count', 'questions_generated', 'prompt_tokens', 'cached_tokens', 'completion_tokens', 'cost_eur', 'queue_ms', 'total_ms', 'error_class')
+    list_filter = ('outcome', 'user_role', 'mode', 'model', 'route', 'created_at')
+    search_fields = ('user__email', 'document__title', 'error_class')
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at',)
+    # Agrégats par jour et par rôle sous la liste (respectent les filtres actifs)
+    change_list_template = 'admin/accounts/generationrun/change_list.html'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        try:
+            queryset = response.context_data['cl'].queryset
+        except (AttributeError, KeyError):
+            # Redirection ou erreur de filtre : pas de liste à agréger
+            return response
+        response.context_data['summary_by_day'] = summarize_generation_runs(queryset, 'day')[:30]
+        response.context_data['summary_by_role'] = summarize_generation_runs(queryset, 'user_role')
+        return response
+
 # Configuration du site admin
 admin.site.site_header = "Administration Révisia"
 admin.site.site_title = "Révisia Admin"
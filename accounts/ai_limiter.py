@@ -0,0 +1,232 @@
+"""
+Limiteur global des générations IA, partagé par tous les processus et hôtes via
+la base : au plus AI_CONCURRENCY_LIMIT générations interrogent le modèle en même
+temps. Chaque génération admise occupe un numéro de place unique, et un numéro
+unique dans sa voie si celle-ci est plafonnée (les contraintes d'unicité rendent
+l'admission atomique, sans verrou). Les demandes en attente sont
+admises par voie (premium, puis gratuit, puis invité, puis remplissages en
+arrière-plan) puis par ancienneté ; les voies gratuite et invitée sont plafonnées
+(AI_CONCURRENCY_FREE_MAX / AI_CONCURRENCY_GUEST_MAX) pour garder des places aux
+comptes payants pendant les pics.
+"""
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import AIConcurrencyTicket, GenerationJob
+
+logger = logging.getLogger(__name__)
+
+LANE_PRIORITIES = {'premium': 0, 'free': 1, 'guest': 2}
+# Les remplissages de réserve passent après toutes les demandes interactives
+BACKGROUND_PRIORITY_OFFSET = len(LANE_PRIORITIES)
+
+class AIQueueTimeoutError(Exception):
+    """Aucune place libérée dans le délai AI_CONCURRENCY_MAX_WAIT_SECONDS"""
+
+    def __init__(self, waited_seconds):
+        self.waited_seconds = waited_seconds
+        super().__init__(f"Service de génération saturé, aucune place libre après {waited_seconds:.0f}s")
+
+def get_lane(user=None):
+    return user.get_user_role() if user else 'guest'
+
+def get_priority(lane, background=False):
+    return LANE_PRIORITIES.get(lane, LANE_PRIORITIES['guest']) + (BACKGROUND_PRIORITY_OFFSET if background else 0)
+
+def get_lane_limit(lane):
+    limit = settings.AI_CONCURRENCY_LIMIT
+    lane_limits = {'free': settings.AI_CONCURRENCY_FREE_MAX, 'guest': settings.AI_CONCURRENCY_GUEST_MAX}
+    return min(limit, lane_limits.get(lane, limit))
+
+def is_enabled():
+    return settings.AI_CONCURRENCY_LIMIT > 0
+
+class AISlot:
+    """
+    Place dans le limiteur pour une génération. `wait()` produit la position dans
+    la file tant que la place n'est pas accordée (pour l'afficher au client) ;
+    `with AISlot(...)` attend sans rien produire. `release()` libère la place.
+    Tant qu'elle est occupée, un thread prolonge son bail (AI_CONCURRENCY_LEASE_SECONDS) :
+    seule la place d'un processus tué expire, quelle que soit la durée de l'appel.
+    """
+
+    def __init__(self, lane, job=None, background=False):
+        self.lane = lane
+        self.priority = get_priority(lane, background)
+        self.job = job
+        self.ticket = None
+        self.waited_seconds = 0.0
+        self._renewal_stop = None
+
+    def __enter__(self):
+        for position in self.wait():
+            pass
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
+
+    def wait(self):
+        if not is_enabled():
+            return
+        started = time.monotonic()
+        self._request()
+        last_position = None
+        try:
+            while not self._try_admit():
+                waited = time.monotonic() - started
+                if waited > settings.AI_CONCURRENCY_MAX_WAIT_SECONDS:
+                    raise AIQueueTimeoutError(waited)
+                position = self.position()
+                if position != last_position:
+                    logger.info(f"⏳ Génération en attente d'une place IA ({self.lane}, position {position})")
+                    last_position = position
+                # Produit à chaque tour : sert aussi de keep-alive pour le streaming
+                yield position
+                time.sleep(settings.AI_CONCURRENCY_POLL_SECONDS)
+                self._keep_alive()
+        except BaseException:
+            self.release()
+            raise
+        finally:
+            self.waited_seconds = time.monotonic() - started
+
+    def release(self):
+        if self._renewal_stop is not None:
+            self._renewal_stop.set()
+            self._renewal_stop = None
+        if self.ticket is not None:
+            AIConcurrencyTicket.objects.filter(id=self.ticket.id).delete()
+            self.ticket = None
+
+    def position(self):
+        """Position dans la file (1 = prochaine admise), 0 si la place est accordée"""
+        if self.ticket is None or self.ticket.status == 'active':
+            return 0
+        return _waiting_before(self.ticket).count() + 1
+
+    def _request(self):
+        self.ticket = AIConcurrencyTicket.objects.create(
+            lane=self.lane,
+            priority=self.priority,
+            job=self.job,
+            holder=f"{socket.gethostname()}:{os.getpid()}"[:100],
+            expires_at=timezone.now() + timedelta(seconds=_waiting_lease_seconds())
+        )
+
+    def _keep_alive(self):
+        """Prolonge la demande en attente ; la recrée si elle a été purgée entre-temps"""
+        updated = AIConcurrencyTicket.objects.filter(id=self.ticket.id, status='waiting').update(
+            expires_at=timezone.now() + timedelta(seconds=_waiting_lease_seconds())
+        )
+        if not updated:
+            self._request()
+
+    def _try_admit(self):
+        now = timezone.now()
+        # Purger les demandes des processus tués (place occupée ou attente abandonnée)
+        AIConcurrencyTicket.objects.filter(expires_at__lt=now).delete()
+
+        limit = settings.AI_CONCURRENCY_LIMIT
+        active = list(AIConcurrencyTicket.objects.filter(status='active').values_list('lane', 'slot', 'lane_slot'))
+        free_slots = limit - len(active)
+        if free_slots <= 0:
+            return False
+        active_by_lane = {}
+        for lane, _, _ in active:
+            active_by_lane[lane] = active_by_lane.get(lane, 0) + 1
+        full_lanes = [lane for lane in LANE_PRIORITIES if active_by_lane.get(lane, 0) >= get_lane_limit(lane)]
+        if self.lane in full_lanes:
+            return False
+        # Les demandes mieux placées et admissibles passent d'abord
+        if _waiting_before(self.ticket).exclude(lane__in=full_lanes).count() >= free_slots:
+            return False
+
+        used = {slot for _, slot, _ in active}
+        lane_slot = None
+        if get_lane_limit(self.lane) < limit:
+            used_lane_slots = {used_lane_slot for lane, _, used_lane_slot in active if lane == self.lane}
+            lane_slot = min(set(range(get_lane_limit(self.lane))) - used_lane_slots)
+        for slot in range(limit):
+            if slot in used:
+                continue
+            try:
+                with transaction.atomic():
+                    admitted = AIConcurrencyTicket.objects.filter(id=self.ticket.id, status='waiting').update(
+                        status='active',
+                        slot=slot,
+                        lane_slot=lane_slot,
+                        expires_at=now + timedelta(seconds=settings.AI_CONCURRENCY_LEASE_SECONDS)
+                    )
+            except IntegrityError:
+                # Place (ou place de la voie) prise au même instant par un autre processus
+                continue
+            if not admitted:
+                self._request()
+                return False
+            self.ticket.status, self.ticket.slot = 'active', slot
+            self._start_lease_renewal()
+            return True
+        return False
+
+    def _start_lease_renewal(self):
+        self._renewal_stop = threading.Event()
+        threading.Thread(
+            target=_renew_lease,
+            args=(self.ticket.id, self._renewal_stop),
+            name=f'ai-slot-{self.ticket.id}',
+            daemon=True
+        ).start()
+
+def _renew_lease(ticket_id, stop):
+    """Prolonge le bail d'une place occupée jusqu'à sa libération"""
+    lease = settings.AI_CONCURRENCY_LEASE_SECONDS
+    try:
+        while not stop.wait(max(1, lease / 3)):
+            renewed = AIConcurrencyTicket.objects.filter(id=ticket_id, status='active').update(
+                expires_at=timezone.now() + timedelta(seconds=lease)
+            )
+            if not renewed:
+                return
+    except Exception as e:
+        logger.warning(f"⚠️ Impossible de prolonger la place IA {ticket_id}: {e}")
+    finally:
+        # Le thread a ouvert sa propre connexion
+        connection.close()
+
+def _waiting_lease_seconds():
+    return max(30, settings.AI_CONCURRENCY_POLL_SECONDS * 20)
+
+def _waiting_before(ticket):
+    """Demandes en attente admises avant `ticket` (priorité, puis ancienneté)"""
+    return AIConcurrencyTicket.objects.filter(status='waiting').filter(
+        Q(priority__lt=ticket.priority)
+        | Q(priority=ticket.priority, created_at__lt=ticket.created_at)
+        | Q(priority=ticket.priority, created_at=ticket.created_at, id__lt=ticket.id)
+    )
+
+def get_job_queue_position(job):
+    """
+    Position d'un job dans la file : parmi les jobs en attente de worker (même
+    ordre que claim_next_job), ou dans le limiteur s'il attend une place IA.
+    None quand le job n'attend pas.
+    """
+    if job.status == 'queued':
+        return GenerationJob.objects.filter(status='queued').filter(
+            Q(priority__lt=job.priority)
+            | Q(priority=job.priority, created_at__lt=job.created_at)
+            | Q(priority=job.priority, created_at=job.created_at, id__lt=job.id)
+        ).count() + 1
+    if job.status == 'running':
+        ticket = AIConcurrencyTicket.objects.filter(job=job, status='waiting').first()
+        if ticket is not None:
+            return _waiting_before(ticket).count() + 1
+    return None
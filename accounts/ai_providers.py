@@ -0,0 +1,497 @@
+"""
+Fournisseurs IA interchangeables (OpenAI, rejeu local de réponses enregistrées)
+avec reprise sur erreur (backoff exponentiel + jitter, Retry-After) et
+disjoncteur partagé qui échoue immédiatement quand l'API est dégradée
+"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from types import SimpleNamespace
+import openai
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Erreurs transitoires : retentées et comptées par le disjoncteur
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+REPLAY_QUESTION_COUNT_PATTERN = re.compile(r'Génère exactement (\d+) questions')
+
+class CircuitOpenError(Exception):
+    """Le disjoncteur est ouvert : l'appel est refusé sans contacter le fournisseur"""
+
+    def __init__(self, provider_name, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Fournisseur IA {provider_name} indisponible, nouvel essai possible dans {retry_after:.0f}s")
+
+class CircuitBreaker:
+    """
+    Disjoncteur stocké dans le cache Django, donc partagé entre les workers
+    dès que le cache l'est (Redis, base de données...).
+    Fermé : les appels passent et les échecs transitoires sont comptés sur une
+    fenêtre glissante. Ouvert (seuil atteint) : les appels échouent
+    immédiatement pendant `cooldown_seconds`. Ensuite un seul appel d'essai
+    est autorisé : son succès referme le disjoncteur, son échec le rouvre.
+    """
+
+    def __init__(self, name, failure_threshold=None, window_seconds=None, cooldown_seconds=None):
+        self.name = name
+        self.failure_threshold = failure_threshold if failure_threshold is not None else settings.AI_CIRCUIT_FAILURE_THRESHOLD
+        self.window_seconds = window_seconds if window_seconds is not None else settings.AI_CIRCUIT_WINDOW_SECONDS
+        self.cooldown_seconds = cooldown_seconds if cooldown_seconds is not None else settings.AI_CIRCUIT_COOLDOWN_SECONDS
+        self.failures_key = f'ai_circuit:{name}:failures'
+        self.open_until_key = f'ai_circuit:{name}:open_until'
+        self.probe_key = f'ai_circuit:{name}:probe'
+
+    def before_call(self):
+        """Lève CircuitOpenError si l'appel ne doit pas être tenté"""
+        open_until = cache.get(self.open_until_key)
+        if open_until is None:
+            return
+        remaining = open_until - time.time()
+        if remaining > 0:
+            raise CircuitOpenError(self.name, remaining)
+        # Période de refroidissement écoulée : un seul appel d'essai à la fois
+        if not cache.add(self.probe_key, 1, timeout=self.cooldown_seconds):
+            raise CircuitOpenError(self.name, self.cooldown_seconds)
+
+    def record_success(self):
+        state = cache.get_many([self.failures_key, self.open_until_key])
+        if not state:
+            return
+        if self.open_until_key in state:
+            logger.info(f"✅ Disjoncteur {self.name} refermé")
+        cache.delete_many([self.failures_key, self.open_until_key, self.probe_key])
+
+    def record_failure(self):
+        if cache.get(self.open_until_key) is not None:
+            # Échec de l'appel d'essai : rouvrir
+            self._open()
+            return
+        cache.add(self.failures_key, 0, timeout=self.window_seconds)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            cache.set(self.failures_key, 1, timeout=self.window_seconds)
+            failures = 1
+        if failures >= self.failure_threshold:
+            self._open()
+
+    def state(self):
+        open_until = cache.get(self.open_until_key)
+        if open_until is None:
+            return 'closed'
+        return 'open' if open_until > time.time() else 'half_open'
+
+    def _open(self):
+        logger.error(f"🚨 Disjoncteur {self.name} ouvert pour {self.cooldown_seconds}s")
+        # Conserver l'état au-delà du refroidissement pour détecter la phase d'essai
+        cache.set(self.open_until_key, time.time() + self.cooldown_seconds, timeout=self.cooldown_seconds + self.window_seconds)
+        cache.delete_many([self.failures_key, self.probe_key])
+
+def get_retry_after(error):
+    """Délai demandé par le fournisseur (en-têtes retry-after-ms / retry-after), en secondes"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def compute_backoff(attempt, base_delay, max_delay, retry_after=None):
+    """Délai avant la tentative suivante : Retry-After s'il est fourni, sinon backoff exponentiel avec jitter complet"""
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+def get_stream_positions(args, kwargs):
+    """
+    Position de départ des fichiers passés à un appel (ex. `files.create(file=...)`),
+    pour les rembobiner avant un nouvel essai. None si l'un d'eux ne peut pas
+    être relu (flux non rembobinable) : l'appel ne doit alors pas être retenté.
+    """
+    positions = []
+    for argument in list(args) + list(kwargs.values()):
+        # Fichier seul ou tuple (nom, fichier[, type]) comme l'accepte le SDK OpenAI
+        for value in (argument if isinstance(argument, tuple) else (argument,)):
+            if not hasattr(value, 'read'):
+                continue
+            seekable = getattr(value, 'seekable', None)
+            if seekable is None or not seekable():
+                return None
+            positions.append((value, value.tell()))
+    return positions
+
+def call_with_retry(breaker, label, func, *args, **kwargs):
+    """
+    Appelle `func` à travers le disjoncteur en retentant les erreurs transitoires.
+    Les fichiers passés en argument sont rembobinés avant chaque nouvel essai ;
+    un appel qui lit un flux non rembobinable n'est pas retenté.
+    """
+    attempts = max(1, settings.AI_RETRY_MAX_ATTEMPTS)
+    streams = get_stream_positions(args, kwargs)
+    if streams is None:
+        attempts = 1
+    for attempt in range(1, attempts + 1):
+        breaker.before_call()
+        if attempt > 1:
+            for stream, position in streams:
+                stream.seek(position)
+        try:
+            result = func(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            breaker.record_failure()
+            if attempt == attempts:
+                raise
+            delay = compute_backoff(attempt, settings.AI_RETRY_BASE_DELAY, settings.AI_RETRY_MAX_DELAY, get_retry_after(e))
+            logger.warning(f"🔁 {label} en échec ({type(e).__name__}), nouvel essai {attempt + 1}/{attempts} dans {delay:.1f}s")
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+class ResilientProxy:
+    """
+    Enveloppe un client de type OpenAI (client.files, client.chat.completions...) :
+    tout appel de méthode passe par call_with_retry
+    """
+
+    def __init__(self, target, breaker, label):
+        self._target = target
+        self._breaker = breaker
+        self._label = label
+
+    def __getattr__(self, name):
+        return ResilientProxy(getattr(self._target, name), self._breaker, f"{self._label}.{name}")
+
+    def __call__(self, *args, **kwargs):
+        return call_with_retry(self._breaker, self._label, self._target, *args, **kwargs)
+
+class BaseProvider:
+    """
+    Interface des fournisseurs : même forme que le client OpenAI
+    (`files.create/delete/list`, `chat.completions.create`) pour que le
+    service et le cache de fichiers fonctionnent avec n'importe lequel
+    """
+    name = ''
+
+    def __init__(self, **options):
+        self.breaker = CircuitBreaker(self.name)
+        self.raw_client = self.build_client(**options)
+        self.files = ResilientProxy(self.raw_client.files, self.breaker, f'{self.name}.files')
+        self.chat = ResilientProxy(self.raw_client.chat, self.breaker, f'{self.name}.chat')
+
+    def build_client(self, **options):
+        raise NotImplementedError
+
+    def close(self):
+        """Ferme les connexions du client (sans effet pour les clients sans réseau)"""
+        close = getattr(self.raw_client, 'close', None)
+        if close is not None:
+            close()
+
+class OpenAIProvider(BaseProvider):
+    name = 'openai'
+
+    def build_client(self, base_url=None, api_key=None):
+        # Les reprises sont gérées ici (backoff + disjoncteur), pas par le SDK
+        client = openai.OpenAI(
+            api_key=api_key or settings.OPENAI_API_KEY,
+            base_url=base_url or settings.OPENAI_BASE_URL or None,
+            max_retries=0,
+            http_client=build_http_client()
+        )
+        if settings.AI_RECORD_DIR:
+            return RecordingClient(client, settings.AI_RECORD_DIR)
+        return client
+
+class ReplayProvider(BaseProvider):
+    """
+    Fournisseur local déterministe : rejoue les réponses enregistrées dans
+    AI_REPLAY_DIR (voir AI_RECORD_DIR), sinon synthétise des questions à
+    partir de l'empreinte de la requête. Aucun appel réseau.
+    """
+    name = 'replay'
+
+    def build_client(self):
+        return ReplayClient(settings.AI_REPLAY_DIR, settings.AI_REPLAY_LATENCY_MS / 1000)
+
+PROVIDERS = {
+    OpenAIProvider.name: OpenAIProvider,
+    ReplayProvider.name: ReplayProvider,
+}
+
+# Fournisseurs partagés par tous les threads du processus (créés à la première demande)
+_shared_providers = {}
+_shared_providers_pid = os.getpid()
+_shared_providers_lock = threading.Lock()
+
+def get_ai_provider(name=None):
+    """
+    Fournisseur configuré (AI_PROVIDER), partagé dans le processus : son pool
+    de connexions HTTP keep-alive est réutilisé d'une génération à l'autre
+    """
+    global _shared_providers_pid
+    name = name or settings.AI_PROVIDER
+    if name not in PROVIDERS:
+        raise ValueError(f"Fournisseur IA inconnu: {name} (disponibles: {', '.join(PROVIDERS)})")
+
+    with _shared_providers_lock:
+        # Processus enfant (fork) : ne jamais réutiliser les sockets du parent
+        if _shared_providers_pid != os.getpid():
+            _shared_providers.clear()
+            _shared_providers_pid = os.getpid()
+        if name not in _shared_providers:
+            _shared_providers[name] = PROVIDERS[name]()
+        return _shared_providers[name]
+
+def reset_ai_providers(close=True):
+    """Oublie les fournisseurs partagés (ex. changement de configuration)"""
+    with _shared_providers_lock:
+        providers = list(_shared_providers.values())
+        _shared_providers.clear()
+    if close:
+        for provider in providers:
+            provider.close()
+
+def _reset_after_fork():
+    # Les connexions héritées du parent ne doivent pas être fermées ni réutilisées ici
+    global _shared_providers_lock, _shared_providers_pid
+    _shared_providers.clear()
+    _shared_providers_pid = os.getpid()
+    _shared_providers_lock = threading.Lock()
+    _connection_stats_lock_reset()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+class ConnectionStats:
+    """Compteurs des requêtes HTTP et des connexions ouvertes (le reste est réutilisé)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def record_connection(self):
+        with self.lock:
+            self.new_connections += 1
+
+    def snapshot(self):
+        with self.lock:
+            reused = max(0, self.requests - self.new_connections)
+            return {
+                'requests': self.requests,
+                'new_connections': self.new_connections,
+                'reused_connections': reused,
+                'reuse_rate': reused / self.requests if self.requests else 0,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.new_connections = 0
+
+connection_stats = ConnectionStats()
+
+def _connection_stats_lock_reset():
+    connection_stats.lock = threading.Lock()
+    connection_stats.reset()
+
+def get_connection_stats():
+    """Requêtes HTTP vers le fournisseur et connexions ouvertes/réutilisées dans ce processus"""
+    return connection_stats.snapshot()
+
+def _trace_connections(request):
+    """Hook httpx : compte les requêtes et, via l'extension `trace`, les nouvelles connexions"""
+    connection_stats.record_request()
+    previous = request.extensions.get('trace')
+
+    def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.started':
+            connection_stats.record_connection()
+        if previous is not None:
+            previous(event_name, info)
+
+    request.extensions['trace'] = trace
+
+def build_http_client():
+    """Client HTTP keep-alive aux limites et délais configurables (AI_HTTP_*)"""
+    limits = type(openai.DEFAULT_CONNECTION_LIMITS)(
+        max_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.AI_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.AI_HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = openai.Timeout(settings.AI_HTTP_TIMEOUT, connect=settings.AI_HTTP_CONNECT_TIMEOUT)
+    return openai.DefaultHttpxClient(limits=limits, timeout=timeout, event_hooks={'request': [_trace_connections]})
+
+def request_fingerprint(kwargs):
+    """
+    Empreinte d'une requête chat : modèle, paramètres et texte des messages.
+    Les fichiers et images sont ignorés (leur ID change d'un upload à l'autre).
+    """
+    messages = []
+    for message in kwargs.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, list):
+            content = [part.get('text', part.get('type')) for part in content]
+        messages.append([message.get('role'), content])
+    payload = {
+        'model': kwargs.get('model'),
+        'max_tokens': kwargs.get('max_tokens'),
+        'temperature': kwargs.get('temperature'),
+        'messages': messages,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def build_completion(content, finish_reason='stop', usage=None):
+    """Réponse au format chat.completions du SDK OpenAI"""
+    usage = usage or {}
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)],
+        usage=SimpleNamespace(
+            prompt_tokens=usage.get('prompt_tokens', 0),
+            completion_tokens=usage.get('completion_tokens', 0),
+            total_tokens=usage.get('total_tokens', 0),
+            prompt_tokens_details=SimpleNamespace(cached_tokens=usage.get('cached_tokens', 0)),
+        )
+    )
+
+def iter_completion_chunks(content, finish_reason='stop', chunk_size=24, usage=None):
+    """
+    Découpe une réponse en morceaux au format du streaming chat.completions.
+    Avec `usage`, un dernier morceau sans choix porte l'usage (stream_options include_usage).
+    """
+    for start in range(0, len(content), chunk_size):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[start:start + chunk_size]), finish_reason=None)], usage=None)
+    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason=finish_reason)], usage=None)
+    if usage is not None:
+        yield SimpleNamespace(choices=[], usage=build_completion('', usage=usage).usage)
+
+class ReplayClient:
+    """Client local imitant client.files et client.chat.completions"""
+
+    def __init__(self, replay_dir='', latency=0.0):
+        self.files = ReplayFiles()
+        self.chat = SimpleNamespace(completions=ReplayCompletions(replay_dir, latency))
+
+class ReplayFiles:
+    def __init__(self):
+        self.files = {}
+
+    def create(self, file, purpose):
+        filename, file = file[:2] if isinstance(file, tuple) else (os.path.basename(getattr(file, 'name', 'upload')), file)
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: file.read(64 * 1024), b''):
+            sha256.update(chunk)
+        file_id = f'file-replay-{sha256.hexdigest()[:24]}'
+        self.files[file_id] = SimpleNamespace(id=file_id, created_at=int(time.time()), purpose=purpose, filename=filename)
+        return self.files[file_id]
+
+    def delete(self, file_id):
+        self.files.pop(file_id, None)
+
+    def list(self, purpose=None):
+        return [f for f in self.files.values() if purpose is None or f.purpose == purpose]
+
+class ReplayCompletions:
+    def __init__(self, replay_dir, latency):
+        self.replay_dir = replay_dir
+        self.latency = latency
+
+    def create(self, stream=False, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        fingerprint = request_fingerprint(kwargs)
+        recorded = self._load(fingerprint)
+        if recorded is None:
+            recorded = {'content': self._synthesize(fingerprint, kwargs), 'finish_reason': 'stop'}
+        if stream:
+            include_usage = (kwargs.get('stream_options') or {}).get('include_usage')
+            return iter_completion_chunks(recorded['content'], recorded.get('finish_reason', 'stop'), usage=recorded.get('usage', {}) if include_usage else None)
+        return build_completion(recorded['content'], recorded.get('finish_reason', 'stop'), recorded.get('usage'))
+
+    def _load(self, fingerprint):
+        if not self.replay_dir:
+            return None
+        path = os.path.join(self.replay_dir, f'{fingerprint}.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _synthesize(self, fingerprint, kwargs):
+        """Questions déterministes (mêmes pour une même requête) au format attendu"""
+        prompt = json.dumps(kwargs.get('messages', []), ensure_ascii=False)
+        match = REPLAY_QUESTION_COUNT_PATTERN.search(prompt)
+        count = int(match.group(1)) if match else 5
+        rng = random.Random(fingerprint)
+        questions = []
+        for index in range(count):
+            correct = rng.randrange(4)
+            questions.append({
+                "question_text": f"Question de rejeu {fingerprint[:8]}-{index + 1} : quelle proposition est exacte ?",
+                "difficulty": rng.choice(['easy', 'medium', 'hard']),
+                "answers": [
+                    {"text": f"Proposition {letter}", "is_correct": position == correct}
+                    for position, letter in enumerate('ABCD')
+                ]
+            })
+        return json.dumps({"questions": questions}, ensure_ascii=False)
+
+class RecordingClient:
+    """Enveloppe du client OpenAI qui enregistre chaque réponse chat (non streamée) pour le rejeu"""
+
+    def __init__(self, client, record_dir):
+        self.files = client.files
+        self.chat = SimpleNamespace(completions=RecordingCompletions(client.chat.completions, record_dir))
+
+class RecordingCompletions:
+    def __init__(self, completions, record_dir):
+        self.completions = completions
+        self.record_dir = record_dir
+
+    def create(self, **kwargs):
+        response = self.completions.create(**kwargs)
+        if kwargs.get('stream'):
+            return response
+        try:
+            os.makedirs(self.record_dir, exist_ok=True)
+            usage = getattr(response, 'usage', None)
+            details = getattr(usage, 'prompt_tokens_details', None)
+            record = {
+                'content': response.choices[0].message.content,
+                'finish_reason': response.choices[0].finish_reason,
+                'usage': {
+                    'prompt_tokens': getattr(usage, 'prompt_tokens', 0),
+                    'completion_tokens': getattr(usage, 'completion_tokens', 0),
+                    'total_tokens': getattr(usage, 'total_tokens', 0),
+                    'cached_tokens': getattr(details, 'cached_tokens', 0) or 0,
+                },
+            }
+            with open(os.path.join(self.record_dir, f'{request_fingerprint(kwargs)}.json'), 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+        except Exception as e:
+            logger.warning(f"⚠️ Impossible d'enregistrer la réponse pour le rejeu: {e}")
+        return response
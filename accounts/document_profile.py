@@ -0,0 +1,88 @@
+"""
+Profil d'un document, calculé une fois à l'upload à partir des contrôles préalables
+(voir accounts.preflight) : taille, pages, tokens estimés, images. Il sert à
+estimer la part du prompt occupée par le document, et donc à refuser les documents
+trop lourds pour le rôle du demandeur et à router la génération (voir accounts.model_routing).
+"""
+import os
+import logging
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from .ingestion import IMAGE_EXTENSIONS
+from .extraction import can_extract_text, get_token_budget
+from .images import estimate_image_tokens
+from .pdf_pages import get_page_range, get_selected_pages, has_page_range, is_pdf
+from .preflight import PreflightError, inspect_upload
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FIELDS = ['size_bytes', 'page_count', 'image_count', 'estimated_tokens', 'has_text', 'profiled_at']
+
+def build_profile(file, inspection):
+    """Champs du profil (Document) d'après l'inspection préalable du fichier reçu"""
+    extension = inspection['extension']
+    if extension in IMAGE_EXTENSIONS:
+        size = inspection.get('image_size')
+        estimated_tokens = estimate_image_tokens(*size) if size else 0
+    elif extension == '.pdf' and inspection['has_text'] is False:
+        # PDF scanné : chaque page est lue comme une image
+        estimated_tokens = (inspection['page_count'] or 0) * settings.AI_SCANNED_PAGE_TOKENS
+    elif inspection.get('text_tokens') is not None:
+        estimated_tokens = inspection['text_tokens']
+    else:
+        estimated_tokens = (file.size + 3) // 4
+    return {
+        'size_bytes': file.size,
+        'page_count': inspection.get('page_count'),
+        'image_count': inspection.get('image_count') or 0,
+        'estimated_tokens': estimated_tokens,
+        'has_text': inspection.get('has_text'),
+        'profiled_at': timezone.now(),
+    }
+
+def ensure_profile(document):
+    """Calcule et enregistre le profil d'un document qui n'en a pas encore (documents antérieurs)"""
+    if document.profiled_at is not None or not document.file:
+        return document
+    with open(document.file.path, 'rb') as handle:
+        file = File(handle, name=os.path.basename(document.file.name))
+        try:
+            profile = build_profile(file, inspect_upload(file))
+        except PreflightError as e:
+            logger.warning(f"⚠️ Profil partiel pour {document.title} ({e.code})")
+            profile = {'size_bytes': file.size, 'estimated_tokens': (file.size + 3) // 4, 'profiled_at': timezone.now()}
+    for field, value in profile.items():
+        setattr(document, field, value)
+    if document.pk:
+        document.save(update_fields=list(profile))
+    return document
+
+def get_prompt_tokens(document, question_count):
+    """
+    Tokens estimés de la partie document du prompt pour `question_count` questions :
+    extraits de texte dans leur budget, sinon pages réellement envoyées (plage
+    demandée ou échantillon d'un PDF long), sinon le document entier
+    """
+    ensure_profile(document)
+    tokens = document.estimated_tokens
+    page_count = document.page_count
+    if has_page_range(document) and page_count:
+        start, end = get_page_range(document, page_count)
+        tokens = tokens * (end - start + 1) // page_count
+
+    if settings.AI_TEXT_EXTRACTION_ENABLED and document.has_text and can_extract_text(document.file.name):
+        return min(tokens, get_token_budget(question_count))
+    if is_pdf(document.file.name) and page_count and not has_page_range(document):
+        pages, _ = get_selected_pages(document, page_count)
+        if pages is not None:
+            tokens = tokens * len(pages) // page_count
+    return tokens
+
+def get_role_token_limit(user_role):
+    """Tokens de document au plus par génération pour ce rôle (0 = sans limite)"""
+    return {
+        'guest': settings.DOCUMENT_MAX_PROMPT_TOKENS_GUEST,
+        'free': settings.DOCUMENT_MAX_PROMPT_TOKENS_FREE,
+        'premium': settings.DOCUMENT_MAX_PROMPT_TOKENS_PREMIUM,
+    }.get(user_role, settings.DOCUMENT_MAX_PROMPT_TOKENS_GUEST)
@@ -0,0 +1,275 @@
+"""
+Extraction locale du texte des documents (PDF, DOCX, PPTX, TXT, MD) et
+sélection d'extraits dans un budget de tokens avant l'appel au modèle : les
+passages visés par les instructions personnalisées (voir accounts.retrieval),
+sinon des extraits répartis sur tout le document
+"""
+import os
+import re
+import logging
+import zipfile
+import xml.etree.ElementTree as ET
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import DocumentChunk
+from .pdf_pages import has_page_range
+from .retrieval import compute_terms, retrieve_chunks
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    PdfReader = None
+
+TEXT_EXTENSIONS = ['.txt', '.md']
+EXTRACTABLE_EXTENSIONS = ['.pdf', '.docx', '.pptx'] + TEXT_EXTENSIONS
+
+# Taille maximale d'un extrait (les pages ou sections plus longues sont redécoupées)
+MAX_CHUNK_TOKENS = 800
+
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DRAWING_NAMESPACE = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+SLIDE_NAME_PATTERN = re.compile(r'^ppt/slides/slide(\d+)\.xml$')
+MARKDOWN_HEADING_PATTERN = re.compile(r'^#{1,6}\s+\S', re.MULTILINE)
+WHITESPACE_PATTERN = re.compile(r'[ \t\r\f\v]+')
+
+def estimate_tokens(text):
+    """Estimation grossière du nombre de tokens (~4 caractères par token)"""
+    return (len(text) + 3) // 4
+
+def can_extract_text(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.pdf' and PdfReader is None:
+        return False
+    return extension in EXTRACTABLE_EXTENSIONS
+
+def extract_sections(file_path, page_range=None):
+    """
+    Retourne la liste des sections (label, texte) du document : une par page
+    pour les PDF (limitées à `page_range` = (début, fin) si fourni), par
+    diapositive pour les PPTX, par titre pour DOCX/Markdown
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.pdf':
+        sections = _extract_pdf(file_path, page_range)
+    elif extension == '.docx':
+        sections = _extract_docx(file_path)
+    elif extension == '.pptx':
+        sections = _extract_pptx(file_path)
+    elif extension in TEXT_EXTENSIONS:
+        sections = _extract_plain_text(file_path)
+    else:
+        return []
+    cleaned = [(label, _clean_text(text)) for label, text in sections]
+    return [(label, text) for label, text in cleaned if text]
+
+def split_into_chunks(sections, max_tokens=MAX_CHUNK_TOKENS):
+    """Redécoupe les sections trop longues par paragraphes, en extraits d'au plus `max_tokens`"""
+    chunks = []
+    for label, text in sections:
+        if estimate_tokens(text) <= max_tokens:
+            chunks.append((label, text))
+            continue
+
+        parts = []
+        current = ''
+        for paragraph in _split_paragraphs(text, max_tokens):
+            if current and estimate_tokens(current) + estimate_tokens(paragraph) > max_tokens:
+                parts.append(current)
+                current = ''
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+        if current:
+            parts.append(current)
+
+        for index, part in enumerate(parts, start=1):
+            chunks.append((f"{label} ({index}/{len(parts)})", part))
+    return chunks
+
+def extract_document_chunks(document):
+    """
+    Extrait le texte du document et l'enregistre sous forme de DocumentChunk.
+    Retourne la liste des extraits (vide si le format n'est pas pris en charge
+    ou si le document ne contient pas de texte, ex. PDF scanné).
+    """
+    file_path = document.file.path
+    chunks = []
+    if can_extract_text(file_path):
+        try:
+            chunks = split_into_chunks(extract_sections(file_path, get_requested_page_range(document)))
+        except Exception as e:
+            logger.warning(f"⚠️ Extraction du texte impossible pour {document.title}: {e}")
+            chunks = []
+
+    with transaction.atomic():
+        DocumentChunk.objects.filter(document=document).delete()
+        objects = DocumentChunk.objects.bulk_create([
+            DocumentChunk(
+                document=document,
+                position=position,
+                label=label[:100],
+                text=text,
+                token_count=estimate_tokens(text),
+                terms=compute_terms(label, text)
+            )
+            for position, (label, text) in enumerate(chunks)
+        ])
+        document.text_extracted_at = timezone.now()
+        document.text_token_count = sum(chunk.token_count for chunk in objects)
+        document.save(update_fields=['text_extracted_at', 'text_token_count'])
+
+    logger.info(f"📑 {len(objects)} extrait(s) de texte ({document.text_token_count} tokens estimés) pour {document.title}")
+    return objects
+
+def get_requested_page_range(document):
+    """Plage de pages demandée à l'upload (PDF), ou None pour tout le document"""
+    if not has_page_range(document):
+        return None
+    return document.page_start, document.page_end
+
+def get_document_chunks(document):
+    """Extraits enregistrés du document, extraits à la première demande"""
+    if document.text_extracted_at is None:
+        return extract_document_chunks(document)
+    return list(DocumentChunk.objects.filter(document=document).order_by('position'))
+
+def get_token_budget(question_count):
+    """Budget de tokens du texte envoyé, proportionnel au nombre de questions demandées"""
+    budget = question_count * settings.AI_TEXT_TOKENS_PER_QUESTION
+    return max(settings.AI_TEXT_MIN_TOKENS, min(budget, settings.AI_TEXT_MAX_TOKENS))
+
+def select_chunks(chunks, token_budget):
+    """
+    Sélectionne des extraits répartis uniformément sur le document sans
+    dépasser `token_budget`. Les extraits sont renvoyés dans l'ordre du document.
+    """
+    total = sum(chunk.token_count for chunk in chunks)
+    if total <= token_budget:
+        return list(chunks)
+
+    # Nombre d'extraits visé d'après leur taille moyenne, pris à pas régulier
+    average = max(1, total / len(chunks))
+    target = max(1, min(len(chunks), int(token_budget / average)))
+    stride = len(chunks) / target
+    preferred = [int(index * stride + stride / 2) for index in range(target)]
+    # Compléter avec les autres extraits, du plus éloigné de la sélection au plus proche
+    preferred_set = set(preferred)
+    remaining = [index for index in range(len(chunks)) if index not in preferred_set]
+    remaining.sort(key=lambda index: -min(abs(index - chosen) for chosen in preferred))
+
+    selected = set()
+    used = 0
+    for index in preferred + remaining:
+        cost = chunks[index].token_count
+        if used + cost > token_budget:
+            continue
+        selected.add(index)
+        used += cost
+
+    return [chunks[index] for index in sorted(selected)]
+
+def build_document_text(chunks):
+    """Texte envoyé au modèle, chaque extrait précédé de son repère"""
+    return '\n\n'.join(f"[{chunk.label}]\n{chunk.text}" for chunk in chunks)
+
+def get_prompt_text(document, question_count, instructions=''):
+    """
+    Texte du document à placer dans le prompt pour `question_count` questions,
+    ou None si le texte n'a pas pu être extrait (le fichier est alors envoyé tel quel).
+    Avec des `instructions`, seuls les extraits qui y correspondent le mieux sont retenus.
+    """
+    if not settings.AI_TEXT_EXTRACTION_ENABLED:
+        return None
+
+    chunks = get_document_chunks(document)
+    if not chunks:
+        return None
+
+    budget = get_token_budget(question_count)
+    selected = None
+    if settings.AI_RETRIEVAL_ENABLED and instructions and instructions.strip():
+        selected = retrieve_chunks(chunks, instructions, budget)
+        if selected is not None:
+            logger.info(f"🔎 {len(selected)}/{len(chunks)} extraits retenus d'après les instructions ({sum(c.token_count for c in selected)}/{document.text_token_count} tokens, budget {budget})")
+            return build_document_text(selected)
+    selected = select_chunks(chunks, budget)
+    logger.info(f"✂️ {len(selected)}/{len(chunks)} extraits sélectionnés ({sum(c.token_count for c in selected)}/{document.text_token_count} tokens, budget {budget})")
+    return build_document_text(selected)
+
+def _clean_text(text):
+    lines = [WHITESPACE_PATTERN.sub(' ', line).strip() for line in text.splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+def _split_paragraphs(text, max_tokens):
+    """Paragraphes du texte, les paragraphes trop longs étant coupés tous les `max_tokens`"""
+    max_chars = max_tokens * 4
+    for paragraph in re.split(r'\n\s*\n', text):
+        if len(paragraph) <= max_chars:
+            yield paragraph
+            continue
+        for start in range(0, len(paragraph), max_chars):
+            yield paragraph[start:start + max_chars]
+
+def _extract_pdf(file_path, page_range=None):
+    reader = PdfReader(file_path)
+    start, end = page_range or (None, None)
+    for number in range(start or 1, min(end or len(reader.pages), len(reader.pages)) + 1):
+        yield f"Page {number}", reader.pages[number - 1].extract_text() or ''
+
+def _extract_docx(file_path):
+    """Paragraphes de word/document.xml regroupés par titre (styles Heading/Titre)"""
+    sections = []
+    title = None
+    paragraphs = []
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open('word/document.xml') as xml_file:
+            for _, element in ET.iterparse(xml_file):
+                if element.tag != f'{WORD_NAMESPACE}p':
+                    continue
+                text = ''.join(node.text or '' for node in element.iter(f'{WORD_NAMESPACE}t')).strip()
+                style = element.find(f'{WORD_NAMESPACE}pPr/{WORD_NAMESPACE}pStyle')
+                style_name = style.get(f'{WORD_NAMESPACE}val', '') if style is not None else ''
+                element.clear()
+                if not text:
+                    continue
+                if style_name.lower().startswith(('heading', 'titre', 'title')):
+                    if paragraphs:
+                        sections.append((title, '\n\n'.join(paragraphs)))
+                    title, paragraphs = text, [text]
+                else:
+                    paragraphs.append(text)
+    if paragraphs:
+        sections.append((title, '\n\n'.join(paragraphs)))
+    return [(f"Section {index}" + (f" - {title}" if title else ''), text) for index, (title, text) in enumerate(sections, start=1)]
+
+def _extract_pptx(file_path):
+    """Texte de chaque diapositive, dans l'ordre de leur numéro"""
+    with zipfile.ZipFile(file_path) as archive:
+        slides = []
+        for name in archive.namelist():
+            match = SLIDE_NAME_PATTERN.match(name)
+            if match:
+                slides.append((int(match.group(1)), name))
+        sections = []
+        for number, name in sorted(slides):
+            root = ET.fromstring(archive.read(name))
+            lines = []
+            for paragraph in root.iter(f'{DRAWING_NAMESPACE}p'):
+                line = ''.join(node.text or '' for node in paragraph.iter(f'{DRAWING_NAMESPACE}t'))
+                if line.strip():
+                    lines.append(line)
+            sections.append((f"Diapositive {number}", '\n'.join(lines)))
+    return sections
+
+def _extract_plain_text(file_path):
+    """Fichiers texte : une section par titre Markdown, sinon le texte entier"""
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    starts = [match.start() for match in MARKDOWN_HEADING_PATTERN.finditer(text)]
+    if not starts:
+        return [("Texte", text)]
+    if starts[0] > 0:
+        starts.insert(0, 0)
+    bounds = starts + [len(text)]
+    return [(f"Section {index}", text[bounds[index - 1]:bounds[index]]) for index in range(1, len(bounds))]
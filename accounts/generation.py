@@ -0,0 +1,278 @@
+"""
+Pipeline de génération des questions IA pour un document
+"""
+import os
+import time
+import logging
+from django.db.models import F
+from .models import Question, Answer, Lesson
+from .provider_files import ProviderFileCache
+from .ingestion import compute_file_hash
+from .extraction import get_prompt_text
+from .pdf_pages import get_provider_file, get_source_hash
+from .document_profile import get_prompt_tokens
+from .model_routing import route_generation
+from .quiz_cache import get_cached_questions, store_cached_questions
+from .generation_runs import GenerationRunTracker
+from .ai_limiter import AISlot, get_lane
+from .question_pool import build_refill_instructions
+from .offline_questions import generate_offline_questions, get_degraded_reason, is_unavailable_error
+from .similarity import build_question_index, compute_signature, pack_signature
+from ai_service import OpenAIService
+
+logger = logging.getLogger(__name__)
+
+def create_ai_questions(document, question_count=5, difficulty='medium', question_types='["qcm"]', education_level='', instructions='', job=None, pool_extra=0, refill=False):
+    """
+    Crée des questions avec l'IA OpenAI. `pool_extra` questions sont générées
+    en plus et gardées dans la réserve du document ; avec `refill`, toutes les
+    questions vont dans la réserve (sans passer par le cache des quiz).
+    """
+
+    total_count = question_count + pool_extra
+    run = GenerationRunTracker(document, total_count, mode='job', job=job)
+    questions_data = []
+    outcome = 'success'
+    try:
+        # Vérifier que le fichier existe
+        if not document.file or not os.path.exists(document.file.path):
+            raise Exception(f"Fichier non trouvé: {document.file.path if document.file else 'Aucun fichier'}")
+
+        # Réutiliser un quiz déjà généré pour ce fichier et ces paramètres
+        file_hash = get_source_hash(document, document.content_hash or compute_file_hash(document.file.path))
+        questions_data = None if refill else get_cached_questions(file_hash, total_count, difficulty, education_level, instructions)
+
+        # Mode dégradé (fournisseur indisponible, file trop longue) : questions construites localement
+        if questions_data is None and not refill:
+            questions_data = get_degraded_questions(document, question_count, difficulty, instructions, get_degraded_reason(get_lane(document.user), document))
+            if questions_data is not None:
+                outcome = 'degraded'
+
+        if questions_data is None:
+            started = time.monotonic()
+            document_text = get_prompt_text(document, total_count, instructions)
+            # Sans texte extrait, le PDF est réduit aux pages sélectionnées avant l'upload
+            file_path, provider_hash = (document.file.path, file_hash) if document_text else get_provider_file(document, file_hash)
+            # Taille du document dans le prompt (profil) : le routage en déduit le modèle et la taille des lots
+            prompt_tokens = get_prompt_tokens(document, total_count)
+            route = route_generation(prompt_tokens, total_count, get_lane(document.user))
+            run.route = route.label
+            run.time_stage('extraction_ms', started)
+
+            try:
+                # Attendre une place dans le limiteur global des appels IA (premium d'abord)
+                with AISlot(get_lane(document.user), job=job, background=refill) as slot:
+                    run.stages['queue_ms'] = int(slot.waited_seconds * 1000)
+
+                    # Utiliser le service OpenAI avec le chemin du fichier
+                    ai_service = run.ai_service = OpenAIService(file_cache=ProviderFileCache(), model=route.model, temperature=route.temperature)
+                    questions_data = ai_service.generate_questions_from_document(
+                        file_path=file_path,
+                        document_title=document.title,
+                        question_count=total_count,
+                        difficulty=difficulty,
+                        education_level=education_level,
+                        instructions=build_refill_instructions(document, instructions) if refill else instructions,
+                        content_hash=provider_hash,
+                        document_text=document_text,
+                        # Les quasi-doublons des questions existantes du document ou de l'utilisateur sont remplacés
+                        duplicate_index=build_question_index(document),
+                        shard_size=route.shard_size
+                    )
+            except Exception as e:
+                # Disjoncteur ouvert ou attente trop longue : le générateur local plutôt qu'un échec
+                if refill or not is_unavailable_error(e):
+                    raise
+                questions_data = get_degraded_questions(document, question_count, difficulty, instructions, 'unavailable')
+                if questions_data is None:
+                    raise
+                outcome = 'degraded'
+            else:
+                # Un quiz incomplet n'est pas resservi : la prochaine demande retente la génération
+                if len(questions_data) < total_count:
+                    outcome = 'partial'
+                elif not refill:
+                    store_cached_questions(file_hash, total_count, difficulty, education_level, instructions, questions_data)
+        elif outcome != 'degraded':
+            outcome = 'cache_hit'
+
+        started = time.monotonic()
+        if refill:
+            save_generated_questions(document, questions_data, in_pool=True)
+        else:
+            # Les questions demandées d'abord, le surplus dans la réserve du document
+            save_generated_questions(document, questions_data[:question_count])
+            save_generated_questions(document, questions_data[question_count:], in_pool=True)
+        run.time_stage('save_ms', started)
+
+        run.record(len(questions_data), outcome)
+        return True
+
+    except Exception as e:
+        logger.exception(f"❌ Erreur lors de la génération IA pour {document.title}: {e}")
+        run.record(0, 'failed', e)
+        raise Exception(f"Impossible de générer les questions avec l'IA: {e}")
+
+def get_degraded_questions(document, question_count, difficulty, instructions, reason):
+    """Questions du générateur local quand `reason` (mode dégradé) est donné ; None si aucune n'a pu être construite"""
+    if not reason:
+        return None
+    questions = generate_offline_questions(document, question_count, difficulty, instructions)
+    if not questions:
+        logger.warning(f"⚠️ Mode dégradé ({reason}) impossible pour {document.title} : pas de texte exploitable")
+        return None
+    logger.warning(f"🧰 Mode dégradé ({reason}) : {len(questions)} question(s) construite(s) localement pour {document.title}")
+    return questions
+
+def save_generated_questions(document, questions_data, in_pool=False):
+    """Crée les questions et réponses en base à partir du format du service IA"""
+    for q_data in questions_data:
+        save_generated_question(document, q_data, in_pool=in_pool)
+
+def save_generated_question(document, q_data, lesson=None, in_pool=False):
+    """Crée une question (et ses réponses) au format du service IA"""
+    question = Question.objects.create(
+        document=document,
+        lesson=lesson,
+        in_pool=in_pool,
+        question_text=q_data['question_text'],
+        signature=pack_signature(compute_signature(q_data['question_text'])),
+        question_type='qcm',
+        difficulty=q_data['difficulty']
+    )
+
+    # Créer les réponses
+    Answer.objects.bulk_create([
+        Answer(
+            question=question,
+            answer_text=answer_data['text'],
+            is_correct=answer_data['is_correct']
+        )
+        for answer_data in q_data['answers']
+    ])
+    return question
+
+def stream_ai_questions(job, lesson, slot=None, degraded=None):
+    """
+    Génère les questions d'un job en streaming : chaque question est enregistrée
+    dans la leçon dès sa réception puis renvoyée (générateur de Question).
+    L'appelant a déjà obtenu `slot` dans le limiteur des appels IA, sauf en mode
+    dégradé (`degraded` donne la raison) : les questions sont alors construites localement.
+    """
+    document = job.document
+    if not document.file or not os.path.exists(document.file.path):
+        raise Exception(f"Fichier non trouvé: {document.file.path if document.file else 'Aucun fichier'}")
+
+    run = GenerationRunTracker(document, job.question_count, mode='stream', job=job)
+    if slot is not None:
+        run.stages['queue_ms'] = int(slot.waited_seconds * 1000)
+    file_hash = get_source_hash(document, document.content_hash or compute_file_hash(document.file.path))
+    cached = get_cached_questions(file_hash, job.question_count, job.difficulty, job.education_level, job.instructions)
+    offline = None
+    if cached is None:
+        offline = get_degraded_questions(document, job.question_count, job.difficulty, job.instructions, degraded)
+    if cached is not None:
+        source = iter(cached)
+    elif offline is not None:
+        source = iter(offline)
+    else:
+        started = time.monotonic()
+        document_text = get_prompt_text(document, job.question_count, job.instructions)
+        file_path, provider_hash = (document.file.path, file_hash) if document_text else get_provider_file(document, file_hash)
+        prompt_tokens = get_prompt_tokens(document, job.question_count)
+        route = route_generation(prompt_tokens, job.question_count, get_lane(document.user))
+        run.route = route.label
+        run.time_stage('extraction_ms', started)
+
+        ai_service = run.ai_service = OpenAIService(file_cache=ProviderFileCache(), model=route.model, temperature=route.temperature)
+        source = ai_service.stream_questions_from_document(
+            file_path=file_path,
+            document_title=document.title,
+            question_count=job.question_count,
+            difficulty=job.difficulty,
+            education_level=job.education_level,
+            instructions=job.instructions,
+            content_hash=provider_hash,
+            document_text=document_text,
+            duplicate_index=build_question_index(document)
+        )
+
+    produced = []
+    error = None
+    outcome = 'cache_hit' if cached is not None else 'degraded' if offline is not None else 'success'
+    try:
+        try:
+            for q_data in source:
+                produced.append(q_data)
+                yield save_streamed_question(document, lesson, q_data, run)
+                if len(produced) >= job.question_count:
+                    break
+        except Exception as e:
+            # Fournisseur indisponible avant la première question : le générateur local plutôt qu'un échec
+            if produced or not is_unavailable_error(e):
+                raise
+            offline = get_degraded_questions(document, job.question_count, job.difficulty, job.instructions, 'unavailable')
+            if offline is None:
+                raise
+            outcome = 'degraded'
+            for q_data in offline:
+                produced.append(q_data)
+                yield save_streamed_question(document, lesson, q_data, run)
+    except GeneratorExit:
+        outcome = 'cancelled'
+        raise
+    except Exception as e:
+        outcome, error = 'failed', e
+        raise
+    finally:
+        # Interrompre la réponse du modèle si le client se déconnecte ou si le compte est atteint
+        if hasattr(source, 'close'):
+            source.close()
+        if outcome in ('success', 'cache_hit') and len(produced) < job.question_count:
+            outcome = 'partial'
+        run.record(len(produced), outcome, error)
+
+    # Ne mettre en cache que les quiz complets générés par le modèle
+    if cached is None and outcome != 'degraded' and len(produced) == job.question_count:
+        store_cached_questions(file_hash, job.question_count, job.difficulty, job.education_level, job.instructions, produced)
+
+def save_streamed_question(document, lesson, q_data, run):
+    """Enregistre une question reçue en streaming dans la leçon"""
+    started = time.monotonic()
+    question = save_generated_question(document, q_data, lesson=lesson)
+    Lesson.objects.filter(id=lesson.id).update(total_questions=F('total_questions') + 1)
+    run.time_stage('save_ms', started)
+    return question
+
+def create_lesson_for_document(document, title, user=None, guest_session=None):
+    """
+    Crée la leçon associée à un document généré et décompte le quota du demandeur
+    """
+    lesson = Lesson.objects.create(
+        user=user,
+        document=document,
+        title=title,
+        difficulty='medium'
+    )
+
+    increment_generation_quota(user, guest_session)
+
+    # Associer les questions générées à la leçon (la réserve du document reste à part)
+    questions = Question.objects.filter(document=document, lesson__isnull=True, in_pool=False, retired=False)
+    lesson.total_questions = questions.count()
+    lesson.save()
+
+    # Mettre à jour les questions pour les associer à la leçon
+    questions.update(lesson=lesson)
+
+    return lesson
+
+def increment_generation_quota(user=None, guest_session=None):
+    """Décompte un quiz généré du quota du demandeur"""
+    # Incrémenter le compteur de quiz pour les utilisateurs connectés
+    if user:
+        user.increment_quiz_count()
+    elif guest_session:
+        # Incrémenter l'utilisation pour les invités
+        from .guest_utils import increment_guest_usage
+        increment_guest_usage(guest_session)
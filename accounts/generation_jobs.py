@@ -0,0 +1,223 @@
+"""
+File d'attente des générations IA (jobs persistés en base, exécutés par
+`python manage.py run_generation_worker`)
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import GenerationJob
+from .ai_limiter import get_lane, get_priority
+
+logger = logging.getLogger(__name__)
+
+# Jobs exécutés dans la requête d'upload en streaming (pas par un worker)
+STREAM_WORKER_ID = 'stream'
+
+def enqueue_generation_job(document, title, user=None, guest_session=None, question_count=5, difficulty='medium', question_types='["qcm"]', education_level='', instructions='', kind='lesson', pool_extra=0):
+    """
+    Crée un job de génération en attente pour un document déjà enregistré.
+    `kind='pool_refill'` remplit seulement la réserve de questions du document
+    (voir accounts.question_pool) ; `pool_extra` questions sont générées en plus
+    pour cette réserve. Les jobs premium sont pris en charge en premier, les
+    remplissages en dernier (voir accounts.ai_limiter).
+    """
+    job = GenerationJob.objects.create(
+        document=document,
+        user=user,
+        guest_session=guest_session,
+        title=title,
+        question_count=question_count,
+        difficulty=difficulty,
+        question_types=question_types,
+        education_level=education_level or '',
+        instructions=instructions or '',
+        kind=kind,
+        pool_extra=pool_extra,
+        priority=get_priority(get_lane(user), background=kind == 'pool_refill'),
+    )
+    logger.info(f"📥 Job de génération {job.id} ({kind}) mis en file pour le document {document.id}")
+    return job
+
+def claim_next_job(worker_id):
+    """
+    Réserve le prochain job en attente pour ce worker (priorité de la voie, puis ancienneté).
+    Sur PostgreSQL on verrouille la ligne avec SKIP LOCKED pour que plusieurs
+    workers puissent réserver en parallèle sans se bloquer ; sur SQLite (pas de
+    verrou de ligne) on fait un compare-and-swap sur le statut.
+    Les jobs en attente de nouvelle tentative (`not_before` dans le futur) sont ignorés.
+    Retourne le job réservé ou None si la file est vide.
+    """
+    now = timezone.now()
+    ready = Q(not_before__isnull=True) | Q(not_before__lte=now)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = (
+                GenerationJob.objects.select_for_update(skip_locked=True)
+                .filter(ready, status='queued')
+                .order_by('priority', 'created_at')
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = 'running'
+            job.worker_id = worker_id
+            job.started_at = now
+            job.heartbeat_at = now
+            job.attempts += 1
+            job.save(update_fields=['status', 'worker_id', 'started_at', 'heartbeat_at', 'attempts'])
+            return job
+
+    # Fallback sans verrou de ligne : seul l'UPDATE qui voit encore 'queued' gagne
+    candidate_ids = list(
+        GenerationJob.objects.filter(ready, status='queued')
+        .order_by('priority', 'created_at')
+        .values_list('id', flat=True)[:10]
+    )
+    for job_id in candidate_ids:
+        claimed = GenerationJob.objects.filter(id=job_id, status='queued').update(
+            status='running',
+            worker_id=worker_id,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return GenerationJob.objects.get(id=job_id)
+    return None
+
+def get_retry_delay(attempts):
+    """Délai avant la tentative suivante : GENERATION_JOB_RETRY_DELAY_SECONDS doublé à chaque échec"""
+    return settings.GENERATION_JOB_RETRY_DELAY_SECONDS * 2 ** max(0, attempts - 1)
+
+def record_heartbeat(worker_prefix=None, job=None):
+    """
+    Signe de vie des jobs en cours : ceux des workers dont l'identifiant commence
+    par `worker_prefix`, ou le seul `job` donné
+    """
+    jobs = GenerationJob.objects.filter(status='running')
+    jobs = jobs.filter(id=job.id) if job is not None else jobs.filter(worker_id__startswith=worker_prefix)
+    return jobs.update(heartbeat_at=timezone.now())
+
+def requeue_stale_jobs():
+    """
+    Remet en file les jobs 'running' abandonnés (worker tué en cours de génération) :
+    sans signe de vie depuis GENERATION_JOB_STALE_SECONDS (voir record_heartbeat).
+    Un job qui a déjà épuisé ses GENERATION_JOB_MAX_ATTEMPTS tentatives, ou dont la
+    requête en streaming a été interrompue, est marqué en échec au lieu d'être relancé.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.GENERATION_JOB_STALE_SECONDS)
+    stale = GenerationJob.objects.filter(status='running').filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    count = stale.filter(attempts__lt=settings.GENERATION_JOB_MAX_ATTEMPTS).exclude(worker_id=STREAM_WORKER_ID).update(
+        status='queued',
+        worker_id='',
+        heartbeat_at=None,
+    )
+    if count:
+        logger.warning(f"♻️ {count} job(s) de génération bloqué(s) remis en file")
+
+    for job in stale.select_related('document', 'lesson'):
+        # UPDATE conditionnel : le job a pu donner signe de vie entre-temps
+        if not stale.filter(id=job.id).update(status='failed', error="Génération interrompue (worker arrêté)", finished_at=timezone.now()):
+            continue
+        logger.error(f"❌ Job {job.id} abandonné après {job.attempts} tentative(s)")
+        if job.kind == 'pool_refill' or job.document is None:
+            continue
+        # Garder les questions déjà envoyées par un streaming interrompu, sinon ne rien laisser derrière
+        if job.lesson is not None:
+            if job.lesson.questions.exists():
+                continue
+            job.lesson.delete()
+        job.document.delete()
+    return count
+
+def run_generation_job(job):
+    """Exécute un job réservé : génération IA, création de la leçon, mise à jour du statut"""
+    from .generation import create_ai_questions, create_lesson_for_document
+    from .question_pool import schedule_pool_refill
+
+    document = job.document
+    if document is None:
+        _mark_failed(job, "Document introuvable")
+        return job
+
+    logger.info(f"⚙️ Exécution du job {job.id} (tentative {job.attempts}) pour le document {document.id}")
+    refill = job.kind == 'pool_refill'
+
+    try:
+        create_ai_questions(
+            document,
+            job.question_count,
+            job.difficulty,
+            job.question_types,
+            job.education_level,
+            job.instructions,
+            job=job,
+            pool_extra=job.pool_extra,
+            refill=refill
+        )
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de la génération des questions (job {job.id}): {e}")
+        if job.attempts < settings.GENERATION_JOB_MAX_ATTEMPTS:
+            # Nettoyer les questions partielles avant de retenter (un remplissage
+            # ne touche pas aux questions déjà attribuées du document)
+            if not refill:
+                document.questions.all().delete()
+            # Nouvelle tentative différée : une panne du fournisseur n'est pas retentée aussitôt
+            delay = get_retry_delay(job.attempts)
+            job.status = 'queued'
+            job.worker_id = ''
+            job.error = str(e)
+            job.not_before = timezone.now() + timedelta(seconds=delay)
+            job.save(update_fields=['status', 'worker_id', 'error', 'not_before'])
+            logger.warning(f"🔁 Job {job.id} remis en file, nouvelle tentative dans {delay}s")
+            return job
+        _mark_failed(job, str(e))
+        # Supprimer le document en cas d'erreur définitive
+        if not refill:
+            document.delete()
+        return job
+
+    if refill:
+        job.status = 'done'
+        job.error = ''
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        logger.info(f"✅ Job {job.id} terminé, réserve du document {document.id} remplie")
+        return job
+
+    lesson = create_lesson_for_document(
+        document,
+        job.title,
+        user=job.user,
+        guest_session=job.guest_session
+    )
+
+    job.status = 'done'
+    job.lesson = lesson
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'lesson', 'error', 'finished_at'])
+    logger.info(f"✅ Job {job.id} terminé, leçon {lesson.id} créée")
+
+    schedule_pool_refill(document)
+    return job
+
+def process_next_job(worker_id):
+    """Réserve et exécute un job. Retourne True si un job a été traité."""
+    job = claim_next_job(worker_id)
+    if job is None:
+        return False
+    run_generation_job(job)
+    return True
+
+def _mark_failed(job, error):
+    job.status = 'failed'
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
@@ -0,0 +1,155 @@
+"""
+Mesures des générations de questions (GenerationRun) : tokens, coût estimé,
+latences par étape et issue, agrégées dans l'admin par jour et par rôle
+"""
+import json
+import time
+import logging
+from decimal import Decimal
+from functools import lru_cache
+from django.conf import settings
+from django.db.models import Avg, Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from .models import GenerationRun
+
+logger = logging.getLogger(__name__)
+
+PRICE_KEYS = ('input', 'cached_input', 'output')
+
+class GenerationRunTracker:
+    """Chronomètre les étapes d'une génération puis enregistre son GenerationRun"""
+
+    def __init__(self, document, question_count, mode='job', job=None):
+        self.document = document
+        self.question_count = question_count
+        self.mode = mode
+        self.job = job
+        self.started = time.monotonic()
+        self.stages = {}
+        self.ai_service = None
+        # Règle de routage appliquée (voir accounts.model_routing)
+        self.route = ''
+
+    def time_stage(self, name, started):
+        """Ajoute la durée écoulée depuis `started` à l'étape `name` (en ms)"""
+        self.stages[name] = self.stages.get(name, 0) + int((time.monotonic() - started) * 1000)
+
+    def record(self, questions_generated, outcome, error=None):
+        """Enregistre le GenerationRun ; une erreur de mesure ne doit jamais faire échouer la génération"""
+        try:
+            return GenerationRun.objects.create(**self._build_fields(questions_generated, outcome, error))
+        except Exception as e:
+            logger.warning(f"⚠️ Impossible d'enregistrer les mesures de génération: {e}")
+            return None
+
+    def _build_fields(self, questions_generated, outcome, error):
+        document = self.document
+        user = document.user if document else None
+        usage = self.ai_service.usage if self.ai_service else {}
+        first_token_seconds = usage.get('first_token_seconds')
+        fields = {
+            'document': document,
+            'user': user,
+            'guest_session': document.guest_session if document else None,
+            'job': self.job,
+            'user_role': user.get_user_role() if user else 'guest',
+            'mode': self.mode,
+            'model': usage.get('model', '') if usage.get('calls') else '',
+            'route': self.route,
+            'api_calls': usage.get('calls', 0),
+            'prompt_tokens': usage.get('prompt_tokens', 0),
+            'cached_tokens': usage.get('cached_tokens', 0),
+            'completion_tokens': usage.get('completion_tokens', 0),
+            'file_size_bytes': get_file_size(document),
+            'question_count': self.question_count,
+            'questions_generated': questions_generated,
+            'outcome': outcome,
+            'error_class': get_error_class(error),
+            'queue_ms': self.stages.get('queue_ms', 0),
+            'extraction_ms': self.stages.get('extraction_ms', 0),
+            'upload_ms': int(usage.get('upload_seconds', 0) * 1000),
+            'generation_ms': int(usage.get('latency_seconds', 0) * 1000),
+            'first_token_ms': int(first_token_seconds * 1000) if first_token_seconds is not None else None,
+            'save_ms': self.stages.get('save_ms', 0),
+            'total_ms': int((time.monotonic() - self.started) * 1000),
+        }
+        fields['cost_eur'] = estimate_cost(fields['prompt_tokens'], fields['cached_tokens'], fields['completion_tokens'], fields['model'])
+        return fields
+
+def estimate_cost(prompt_tokens, cached_tokens, completion_tokens, model=''):
+    """Coût estimé en euros d'après les tarifs du modèle (les tokens en cache sont facturés à part)"""
+    prices = get_model_prices(model)
+    cost = (
+        (prompt_tokens - cached_tokens) * prices['input']
+        + cached_tokens * prices['cached_input']
+        + completion_tokens * prices['output']
+    ) / 1_000_000
+    return Decimal(str(round(cost, 6)))
+
+def get_model_prices(model):
+    """Tarifs du modèle en euros par million de tokens (AI_MODEL_PRICES), sinon AI_PRICE_*"""
+    prices = _parse_model_prices(settings.AI_MODEL_PRICES) if settings.AI_MODEL_PRICES else {}
+    if model in prices:
+        return prices[model]
+    return {
+        'input': settings.AI_PRICE_INPUT_EUR_PER_MTOK,
+        'cached_input': settings.AI_PRICE_CACHED_INPUT_EUR_PER_MTOK,
+        'output': settings.AI_PRICE_OUTPUT_EUR_PER_MTOK,
+    }
+
+@lru_cache(maxsize=4)
+def _parse_model_prices(raw):
+    try:
+        table = json.loads(raw)
+        if not isinstance(table, dict):
+            raise ValueError("la table doit associer chaque modèle à ses tarifs")
+        prices = {}
+        for model, tariff in table.items():
+            if not isinstance(tariff, dict) or 'input' not in tariff or 'output' not in tariff:
+                raise ValueError(f"tarifs 'input' et 'output' requis pour {model}")
+            # Sans tarif dédié, les tokens en cache sont comptés au prix normal
+            tariff = {'cached_input': tariff['input'], **tariff}
+            prices[model] = {key: float(tariff[key]) for key in PRICE_KEYS}
+    except (TypeError, ValueError) as e:
+        logger.error(f"❌ AI_MODEL_PRICES invalide, tarifs AI_PRICE_* utilisés: {e}")
+        return {}
+    return prices
+
+def get_error_class(error):
+    """Classe de l'erreur d'origine (les erreurs sont reformulées pour l'utilisateur en cours de route)"""
+    if error is None:
+        return ''
+    while error.__cause__ or error.__context__:
+        error = error.__cause__ or error.__context__
+    return type(error).__name__
+
+def get_file_size(document):
+    if not document or not document.file:
+        return 0
+    try:
+        return document.file.size
+    except (OSError, ValueError):
+        return 0
+
+def summarize_generation_runs(queryset, group_by):
+    """Agrégats des générations groupées par `group_by` ('day' ou un champ, ex. 'user_role')"""
+    if group_by == 'day':
+        queryset = queryset.annotate(day=TruncDate('created_at'))
+    return list(
+        queryset.values(group_by)
+        .annotate(
+            runs=Count('id'),
+            failures=Count('id', filter=Q(outcome='failed')),
+            cache_hits=Count('id', filter=Q(outcome='cache_hit')),
+            degraded=Count('id', filter=Q(outcome='degraded')),
+            questions=Sum('questions_generated'),
+            prompt_tokens=Sum('prompt_tokens'),
+            cached_tokens=Sum('cached_tokens'),
+            completion_tokens=Sum('completion_tokens'),
+            cost_eur=Sum('cost_eur'),
+            avg_queue_ms=Avg('queue_ms'),
+            avg_total_ms=Avg('total_ms'),
+            max_total_ms=Max('total_ms'),
+        )
+        .order_by(f'-{group_by}' if group_by == 'day' else group_by)
+    )
@@ -65,7 +65,7 @@ def check_guest_limits(request, session_id=None):
         
         # Vérifier si la session peut créer un document
         if not session.can_create_document():
-            if session.is_blocked:
+            if session.is_blocked or session.get_pending_quiz_count():
                 return False, session, {
                     'error': 'Limite d\'utilisation atteinte',
                     'details': 'Vous avez déjà utilisé votre quota gratuit. Inscrivez-vous pour créer plus de quiz et sauvegarder vos résultats.',
@@ -0,0 +1,178 @@
+"""
+Préparation des images pour le modèle de vision : orientation EXIF appliquée,
+réduction à la résolution utile du modèle, métadonnées supprimées et
+recompression (JPEG pour les photos, PNG pour les captures et schémas). Le traitement tourne dans un pool de threads dès l'upload ;
+l'image préparée est stockée à côté du blob d'origine (même hash de contenu).
+"""
+import os
+import math
+import logging
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    Image = None
+
+# Versions préparées possibles, à côté du fichier d'origine : suffixe -> (format Pillow, type MIME)
+PREPARED_FORMATS = {
+    '.vision.jpg': ('JPEG', 'image/jpeg'),
+    '.vision.png': ('PNG', 'image/png'),
+    '.vision.gif': ('GIF', 'image/gif'),
+}
+EXIF_ORIENTATION = 0x0112
+# Sources sans perte (captures d'écran, schémas) : le JPEG y dégrade le texte et grossit le fichier
+LOSSLESS_SOURCE_FORMATS = ('PNG', 'GIF')
+# Métadonnées que la version préparée ne recopie pas
+METADATA_KEYS = ('exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp', 'comment')
+
+# Pool de préparation partagé par le processus (recréé après un fork)
+_executor = None
+_executor_pid = None
+_pending = {}
+_lock = threading.Lock()
+
+def is_enabled():
+    return Image is not None and settings.AI_IMAGE_PREPROCESSING_ENABLED
+
+def get_prepared_paths(file_path):
+    stem = os.path.splitext(file_path)[0]
+    return [stem + suffix for suffix in PREPARED_FORMATS]
+
+def find_prepared_image(file_path):
+    """Chemin de la version préparée existante, ou None"""
+    for prepared_path in get_prepared_paths(file_path):
+        if os.path.exists(prepared_path):
+            return prepared_path
+    return None
+
+def get_target_size(width, height):
+    """
+    Dimensions utiles pour le modèle de vision : l'image tient dans un carré de
+    AI_IMAGE_MAX_LONG_SIDE puis son petit côté est ramené à AI_IMAGE_MAX_SHORT_SIDE.
+    Une image déjà plus petite n'est jamais agrandie.
+    """
+    scale = min(
+        1.0,
+        settings.AI_IMAGE_MAX_LONG_SIDE / max(width, height),
+        settings.AI_IMAGE_MAX_SHORT_SIDE / min(width, height),
+    )
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def estimate_image_tokens(width, height):
+    """Tokens facturés pour une image en détail élevé (tuiles de 512 px après réduction)"""
+    width, height = get_target_size(width, height)
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def prepare_image(file_path):
+    """
+    Écrit la version préparée de l'image (si absente) et retourne son chemin,
+    ou None si l'image ne peut pas être traitée (l'original est alors envoyé).
+    """
+    prepared_path = find_prepared_image(file_path)
+    if prepared_path:
+        return prepared_path
+
+    try:
+        with Image.open(file_path) as image:
+            source_format = image.format
+            lossless = source_format in LOSSLESS_SOURCE_FORMATS
+            exif = image.getexif()
+            rotated = exif.get(EXIF_ORIENTATION, 1) != 1
+            has_metadata = bool(exif) or bool(getattr(image, 'text', None)) or any(key in image.info for key in METADATA_KEYS)
+            prepared_path = os.path.splitext(file_path)[0] + ('.vision.png' if lossless else '.vision.jpg')
+            # Première image seulement pour les GIF/WebP animés
+            image.seek(0)
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                # Fond blanc sous les zones transparentes
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            target_size = get_target_size(*image.size)
+            resized = target_size != image.size
+            if resized:
+                # Capture à peu de couleurs : moyenne par zone (moins de teintes intermédiaires que
+                # LANCZOS) puis palette, pour que le PNG réduit reste plus léger que l'original
+                if lossless and image.getcolors(256) is not None:
+                    image = image.resize(target_size, Image.BOX).quantize(256)
+                else:
+                    image = image.resize(target_size, Image.LANCZOS)
+
+            # Écriture atomique : un lecteur concurrent ne voit jamais un fichier partiel.
+            # Aucune métadonnée (EXIF, ICC, GPS) n'est recopiée.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(prepared_path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as tmp_file:
+                    if lossless:
+                        image.save(tmp_file, 'PNG', optimize=True)
+                    else:
+                        image.save(tmp_file, 'JPEG', quality=settings.AI_IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+                if lossless and not (rotated or resized or has_metadata) and os.path.getsize(tmp_path) >= os.path.getsize(file_path):
+                    # Capture déjà compacte, à la bonne taille et sans métadonnées : l'original est plus léger
+                    prepared_path = os.path.splitext(file_path)[0] + '.vision.' + source_format.lower()
+                    shutil.copyfile(file_path, tmp_path)
+                os.replace(tmp_path, prepared_path)
+                # Blob libéré pendant la préparation (voir release_document_file, qui supprime
+                # l'original puis ses dérivés) : ne pas laisser de copie orpheline
+                if not os.path.exists(file_path):
+                    os.remove(prepared_path)
+                    return None
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    except Exception as e:
+        logger.warning(f"⚠️ Préparation de l'image impossible, envoi de l'original: {e}")
+        return None
+
+    logger.info(f"🖼️ Image préparée: {os.path.getsize(file_path)} → {os.path.getsize(prepared_path)} octets ({os.path.basename(prepared_path)})")
+    return prepared_path
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=settings.AI_IMAGE_WORKERS, thread_name_prefix='image-prep')
+        _executor_pid = os.getpid()
+        _pending.clear()
+    return _executor
+
+def schedule_image_preparation(file_path):
+    """Lance la préparation en arrière-plan (appelé à l'upload) et retourne le Future, ou None"""
+    if not is_enabled():
+        return None
+    with _lock:
+        future = _pending.get(file_path)
+        if future is None:
+            future = _get_executor().submit(prepare_image, file_path)
+            _pending[file_path] = future
+            future.add_done_callback(lambda done: _forget(file_path, done))
+        return future
+
+def _forget(file_path, future):
+    with _lock:
+        if _pending.get(file_path) is future:
+            del _pending[file_path]
+
+def get_vision_image(file_path, mime_type):
+    """
+    Image à envoyer au modèle : (chemin, type MIME) de la version préparée,
+    en attendant la préparation lancée à l'upload si elle est en cours.
+    """
+    if not is_enabled():
+        return file_path, mime_type
+    prepared_path = find_prepared_image(file_path)
+    if prepared_path is None:
+        prepared_path = schedule_image_preparation(file_path).result()
+    if prepared_path is None:
+        return file_path, mime_type
+    return prepared_path, PREPARED_FORMATS['.vision.' + prepared_path.rsplit('.', 1)[1]][1]
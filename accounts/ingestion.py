@@ -0,0 +1,72 @@
+"""
+Lecture des fichiers uploadés par blocs (hash, encodage des images) à mémoire bornée
+"""
+import os
+import base64
+import hashlib
+
+# Taille des blocs lus sur disque (multiple de 3 pour un encodage base64 sans padding intermédiaire)
+CHUNK_SIZE = 3 * 256 * 1024
+
+MIME_TYPES = {
+    '.pdf': 'application/pdf',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.txt': 'text/plain',
+    '.md': 'text/markdown',
+    '.json': 'application/json',
+    '.csv': 'text/csv',
+    '.xml': 'application/xml',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+# Extensions transmises comme fichier (upload), les autres comme image (data URL)
+DOCUMENT_EXTENSIONS = ['.pdf', '.txt', '.md', '.json', '.csv', '.xml', '.docx', '.pptx', '.xlsx']
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+
+def get_mime_type(file_path):
+    """Type MIME déduit de l'extension du fichier"""
+    extension = os.path.splitext(file_path)[1].lower()
+    return MIME_TYPES.get(extension, 'application/octet-stream')
+
+def is_image(file_path):
+    return os.path.splitext(file_path)[1].lower() in IMAGE_EXTENSIONS
+
+def iter_file_chunks(file_path, chunk_size=CHUNK_SIZE):
+    """Itère sur le contenu d'un fichier par blocs de `chunk_size` octets"""
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+
+def compute_file_hash(file_path, chunk_size=CHUNK_SIZE):
+    """Calcule le SHA-256 d'un fichier par blocs"""
+    sha256 = hashlib.sha256()
+    for chunk in iter_file_chunks(file_path, chunk_size):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+def build_image_data_url(file_path, mime_type=None):
+    """
+    Construit la data URL base64 d'une image en encodant le fichier par blocs.
+    Le résultat est écrit directement dans un tampon pré-alloué à sa taille
+    finale : pas de copie intermédiaire du fichier brut en mémoire.
+    """
+    mime_type = mime_type or get_mime_type(file_path)
+    prefix = f"data:{mime_type};base64,".encode('ascii')
+    file_size = os.path.getsize(file_path)
+    encoded_size = 4 * ((file_size + 2) // 3)
+
+    buffer = bytearray(len(prefix) + encoded_size)
+    buffer[:len(prefix)] = prefix
+    position = len(prefix)
+    for chunk in iter_file_chunks(file_path):
+        encoded = base64.b64encode(chunk)
+        buffer[position:position + len(encoded)] = encoded
+        position += len(encoded)
+
+    return buffer.decode('ascii')
@@ -0,0 +1,140 @@
+"""
+Commande Django pour comparer la latence par génération avec un client IA
+créé à chaque génération et avec le client partagé du processus, contre un
+faux serveur OpenAI local
+Usage: python manage.py benchmark_ai_client [--generations 30] [--connect-latency-ms 60]
+"""
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from accounts.ai_providers import OpenAIProvider, get_connection_stats
+from ai_service import OpenAIService
+
+class Command(BaseCommand):
+    help = 'Mesure la latence par génération (upload, génération, suppression) avec et sans réutilisation des connexions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generations', type=int, default=30, help='Nombre de générations par scénario')
+        parser.add_argument('--concurrency', type=int, default=1, help='Générations exécutées en parallèle')
+        parser.add_argument(
+            '--connect-latency-ms',
+            type=int,
+            default=60,
+            help='Coût simulé de l\'ouverture d\'une connexion (TCP + TLS) par le serveur local',
+        )
+        parser.add_argument('--response-latency-ms', type=int, default=20, help='Temps de réponse simulé de chaque requête')
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        server.daemon_threads = True
+        server.connect_latency = options['connect_latency_ms'] / 1000
+        server.response_latency = options['response_latency_ms'] / 1000
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}/v1'
+
+        handle, file_path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(b'%PDF-1.4\n' + os.urandom(64 * 1024))
+
+        try:
+            shared = OpenAIProvider(base_url=base_url, api_key='sk-benchmark')
+            scenarios = [
+                ('Client créé à chaque génération', lambda: self._generate_with_new_client(base_url, file_path)),
+                ('Client partagé du processus', lambda: self._generate(shared, file_path)),
+            ]
+            self.stdout.write(f'\n📊 {options["generations"]} générations, concurrence {options["concurrency"]}:')
+            for name, generate in scenarios:
+                before = get_connection_stats()
+                latencies = self._run(generate, options['generations'], options['concurrency'])
+                after = get_connection_stats()
+                requests = after['requests'] - before['requests']
+                connections = after['new_connections'] - before['new_connections']
+                self.stdout.write(
+                    f'  • {name}: moyenne {statistics.mean(latencies) * 1000:.0f} ms, '
+                    f'p50 {_percentile(latencies, 50) * 1000:.0f} ms, p95 {_percentile(latencies, 95) * 1000:.0f} ms '
+                    f'({requests} requêtes, {connections} connexions ouvertes)'
+                )
+            shared.close()
+        finally:
+            server.shutdown()
+            os.remove(file_path)
+
+    def _run(self, generate, generations, concurrency):
+        def timed():
+            started = time.perf_counter()
+            generate()
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            return list(executor.map(lambda _: timed(), range(generations)))
+
+    def _generate(self, provider, file_path):
+        OpenAIService(provider=provider).generate_questions_from_document(file_path, 'Benchmark', question_count=5)
+
+    def _generate_with_new_client(self, base_url, file_path):
+        provider = OpenAIProvider(base_url=base_url, api_key='sk-benchmark')
+        try:
+            self._generate(provider, file_path)
+        finally:
+            provider.close()
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Faux serveur OpenAI : files.create, files.delete et chat.completions"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # Coût d'ouverture d'une connexion, payé une seule fois par connexion keep-alive
+        time.sleep(self.server.connect_latency)
+        super().setup()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.response_latency)
+        if self.path.endswith('/files'):
+            self._send({
+                'id': f'file-{time.monotonic_ns()}', 'object': 'file', 'bytes': len(body),
+                'created_at': int(time.time()), 'filename': 'document.pdf', 'purpose': 'assistants', 'status': 'processed',
+            })
+        elif self.path.endswith('/chat/completions'):
+            count = int(re.search(r'Génère exactement (\d+) questions', body.decode('utf-8', 'replace')).group(1))
+            questions = [
+                {
+                    'question_text': f'Question {index}',
+                    'difficulty': 'medium',
+                    'answers': [{'text': 'Vrai', 'is_correct': True}, {'text': 'Faux', 'is_correct': False}],
+                }
+                for index in range(count)
+            ]
+            self._send({
+                'id': 'chatcmpl-benchmark', 'object': 'chat.completion', 'created': int(time.time()), 'model': 'gpt-4o-mini',
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': json.dumps({'questions': questions})}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 1000, 'completion_tokens': 500, 'total_tokens': 1500},
+            })
+        else:
+            self._send({'error': {'message': 'Not found'}}, status=404)
+
+    def do_DELETE(self):
+        time.sleep(self.server.response_latency)
+        self._send({'id': self.path.rsplit('/', 1)[-1], 'object': 'file', 'deleted': True})
+
+    def _send(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
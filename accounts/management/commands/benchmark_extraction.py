@@ -0,0 +1,129 @@
+"""
+Commande Django pour mesurer l'extraction locale du texte et la réduction des
+tokens envoyés au modèle selon la taille du document
+Usage: python manage.py benchmark_extraction [fichiers...] [--question-counts 5 10 20]
+"""
+import os
+import time
+import zipfile
+import tempfile
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from accounts.extraction import (
+    can_extract_text, estimate_tokens, extract_sections, get_token_budget,
+    select_chunks, split_into_chunks,
+)
+
+SAMPLE_PARAGRAPH = (
+    "La photosynthèse est le processus par lequel les plantes convertissent l'énergie lumineuse "
+    "en énergie chimique. Elle se déroule dans les chloroplastes et produit du glucose et du dioxygène "
+    "à partir de dioxyde de carbone et d'eau. "
+)
+
+class Command(BaseCommand):
+    help = 'Mesure le temps d\'extraction et les tokens envoyés au modèle avant/après sélection des extraits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='Documents à mesurer (par défaut : documents d\'exemple générés)')
+        parser.add_argument(
+            '--question-counts',
+            type=int,
+            nargs='+',
+            default=[5, 10, 20],
+            help='Nombres de questions pour lesquels calculer le budget de tokens',
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as sample_dir:
+            files = options['files'] or self._write_samples(sample_dir)
+            self.stdout.write('\n📊 Extraction locale et sélection des extraits:')
+            for file_path in files:
+                self._benchmark(file_path, options['question_counts'])
+
+    def _benchmark(self, file_path, question_counts):
+        name = os.path.basename(file_path)
+        if not can_extract_text(file_path):
+            self.stdout.write(self.style.WARNING(f'  • {name}: format non pris en charge'))
+            return
+
+        started = time.perf_counter()
+        chunks = split_into_chunks(extract_sections(file_path))
+        elapsed = time.perf_counter() - started
+        chunks = [SimpleNamespace(label=label, text=text, token_count=estimate_tokens(text)) for label, text in chunks]
+        total = sum(chunk.token_count for chunk in chunks)
+
+        self.stdout.write(f'\n  • {name} ({os.path.getsize(file_path) / 1024:.0f} KB): {len(chunks)} extraits, {total} tokens, extraction {elapsed * 1000:.0f} ms')
+        for question_count in question_counts:
+            selected = select_chunks(chunks, get_token_budget(question_count))
+            sent = sum(chunk.token_count for chunk in selected)
+            reduction = 1 - sent / total if total else 0
+            self.stdout.write(f'    - {question_count} questions: {sent} tokens envoyés ({len(selected)} extraits, -{reduction:.0%})')
+
+    def _write_samples(self, sample_dir):
+        """Documents d'exemple de tailles croissantes"""
+        files = []
+        for pages in (3, 30, 300):
+            path = os.path.join(sample_dir, f'cours_{pages}_pages.pdf')
+            _write_sample_pdf(path, pages)
+            files.append(path)
+        path = os.path.join(sample_dir, 'cours_40_diapositives.pptx')
+        _write_sample_pptx(path, 40)
+        files.append(path)
+        path = os.path.join(sample_dir, 'cours_60_sections.docx')
+        _write_sample_docx(path, 60)
+        files.append(path)
+        path = os.path.join(sample_dir, 'cours_80_sections.md')
+        with open(path, 'w', encoding='utf-8') as f:
+            for section in range(1, 81):
+                f.write(f'# Chapitre {section}\n\n' + SAMPLE_PARAGRAPH * 8 + '\n\n')
+        files.append(path)
+        return files
+
+def _write_sample_pdf(path, pages):
+    """PDF minimal avec une police standard et quelques lignes de texte par page"""
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    page_ids = []
+    for number in range(1, pages + 1):
+        lines = [f'Page {number}'] + [f'Ligne {line} : les chloroplastes convertissent la lumiere en energie chimique.' for line in range(1, 31)]
+        text = ' '.join(f'({line}) Tj T*' for line in lines)
+        stream = f'BT /F1 10 Tf 12 TL 50 780 Td {text} ET'.encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % len(objects))
+        page_ids.append(len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % page_id for page_id in page_ids), pages)
+
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+        xref = f.tell()
+        f.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b'%010d 00000 n \n' % offset)
+        f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+
+def _write_sample_docx(path, sections):
+    namespace = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+    body = ''
+    for section in range(1, sections + 1):
+        body += f'<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>Chapitre {section}</w:t></w:r></w:p>'
+        body += f'<w:p><w:r><w:t>{SAMPLE_PARAGRAPH * 6}</w:t></w:r></w:p>'
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('word/document.xml', f'<w:document xmlns:w="{namespace}"><w:body>{body}</w:body></w:document>')
+
+def _write_sample_pptx(path, slides):
+    namespace = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+    with zipfile.ZipFile(path, 'w') as archive:
+        for slide in range(1, slides + 1):
+            archive.writestr(
+                f'ppt/slides/slide{slide}.xml',
+                f'<p:sld xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main" xmlns:a="{namespace}">'
+                f'<a:p><a:r><a:t>Diapositive {slide}</a:t></a:r></a:p>'
+                f'<a:p><a:r><a:t>{SAMPLE_PARAGRAPH * 2}</a:t></a:r></a:p></p:sld>'
+            )
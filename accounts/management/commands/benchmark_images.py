@@ -0,0 +1,110 @@
+"""
+Commande Django pour mesurer la préparation des images envoyées au modèle de
+vision : taille du fichier et du payload base64, dimensions, tokens estimés,
+temps par image et débit du pool de préparation
+Usage: python manage.py benchmark_images [images...] [--copies 8]
+"""
+import os
+import math
+import time
+import shutil
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from accounts.images import Image, estimate_image_tokens, find_prepared_image, prepare_image
+
+class Command(BaseCommand):
+    help = 'Mesure la réduction et la recompression des images avant les appels au modèle de vision'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='Images à mesurer (par défaut : photos et captures d\'exemple générées)')
+        parser.add_argument('--copies', type=int, default=8, help='Copies de chaque image pour mesurer le débit du pool')
+
+    def handle(self, *args, **options):
+        if Image is None:
+            raise CommandError('Pillow n\'est pas installé')
+
+        with tempfile.TemporaryDirectory() as sample_dir:
+            files = options['files'] or self._write_samples(sample_dir)
+            self.stdout.write('\n📊 Préparation des images (original → préparée):')
+            for file_path in files:
+                self._benchmark(file_path, sample_dir)
+            self._benchmark_pool(files, sample_dir, options['copies'])
+
+    def _benchmark(self, file_path, work_dir):
+        name = os.path.basename(file_path)
+        # Travailler sur une copie : la version préparée est écrite à côté du fichier
+        copy_path = os.path.join(work_dir, f'run_{name}')
+        shutil.copyfile(file_path, copy_path)
+
+        started = time.perf_counter()
+        prepared_path = prepare_image(copy_path)
+        elapsed = time.perf_counter() - started
+        if prepared_path is None:
+            self.stdout.write(self.style.WARNING(f'  • {name}: image illisible'))
+            return
+
+        with Image.open(copy_path) as original, Image.open(prepared_path) as prepared:
+            original_size, prepared_size = original.size, prepared.size
+        original_bytes, prepared_bytes = os.path.getsize(copy_path), os.path.getsize(prepared_path)
+        self.stdout.write(f'\n  • {name} ({elapsed * 1000:.0f} ms)')
+        self.stdout.write(f'    - dimensions: {original_size[0]}x{original_size[1]} → {prepared_size[0]}x{prepared_size[1]}')
+        self.stdout.write(f'    - fichier: {original_bytes / 1024:.0f} KB → {prepared_bytes / 1024:.0f} KB ({prepared_bytes / original_bytes - 1:+.0%})')
+        self.stdout.write(f'    - payload base64: {_base64_size(original_bytes) / 1024:.0f} KB → {_base64_size(prepared_bytes) / 1024:.0f} KB')
+        self.stdout.write(
+            f'    - tokens estimés: {estimate_image_tokens(*original_size)} → {estimate_image_tokens(*prepared_size)}'
+            f' (l\'API réduit aussi l\'original avant facturation)'
+        )
+
+    def _benchmark_pool(self, files, work_dir, copies):
+        """Débit séquentiel puis avec le pool (AI_IMAGE_WORKERS threads)"""
+        workers = settings.AI_IMAGE_WORKERS
+        self.stdout.write(f'\n⏱️ Débit sur {len(files) * copies} images:')
+        for label, max_workers in (('séquentiel', 1), (f'pool de {workers}', workers)):
+            batch_dir = tempfile.mkdtemp(dir=work_dir)
+            paths = []
+            for index, file_path in enumerate(files * copies):
+                path = os.path.join(batch_dir, f'{index}_{os.path.basename(file_path)}')
+                shutil.copyfile(file_path, path)
+                paths.append(path)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(prepare_image, paths))
+            elapsed = time.perf_counter() - started
+            done = sum(find_prepared_image(path) is not None for path in paths)
+            self.stdout.write(f'  • {label}: {elapsed:.2f}s ({done / elapsed:.1f} images/s)')
+
+    def _write_samples(self, sample_dir):
+        """Photo de téléphone (bruit, orientation EXIF), capture d'écran PNG et GIF"""
+        rng = random.Random(42)
+        files = []
+
+        # Photo 12 MP prise en portrait : pixels stockés en paysage + tag Orientation
+        photo = Image.effect_noise((4032, 3024), 48).convert('RGB')
+        photo = Image.merge('RGB', [band.point(lambda value, shift=shift: (value + shift) % 256) for band, shift in zip(photo.split(), (0, 60, 120))])
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        path = os.path.join(sample_dir, 'photo_cours.jpg')
+        photo.save(path, 'JPEG', quality=92, exif=exif)
+        files.append(path)
+
+        # Capture d'écran : aplats de couleur et texte simulé
+        screenshot = Image.new('RGB', (2560, 1440), (250, 250, 250))
+        for line in range(60):
+            for word in range(rng.randint(4, 14)):
+                x = 80 + word * 170
+                screenshot.paste((30, 30, 30), (x, 60 + line * 22, x + rng.randint(60, 150), 72 + line * 22))
+        path = os.path.join(sample_dir, 'capture_ecran.png')
+        screenshot.save(path, 'PNG')
+        files.append(path)
+
+        path = os.path.join(sample_dir, 'schema.gif')
+        screenshot.resize((1280, 720)).convert('P', palette=Image.ADAPTIVE).save(path, 'GIF')
+        files.append(path)
+        return files
+
+def _base64_size(byte_count):
+    return 4 * math.ceil(byte_count / 3)
@@ -0,0 +1,121 @@
+"""
+Commande Django pour comparer la récupération des réponses tronquées ou
+malformées : ancien parsing (ajout d'accolades + regex) et parser incrémental
+Usage: python manage.py benchmark_quiz_parser [--samples 500] [--questions 10]
+"""
+import re
+import json
+import time
+import random
+import logging
+from django.core.management.base import BaseCommand
+from accounts.quiz_parser import IncrementalQuestionParser, parse_questions
+
+class Command(BaseCommand):
+    help = 'Mesure le taux de questions récupérées et le débit du parser sur des sorties tronquées ou malformées'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=500, help='Nombre de sorties générées par scénario')
+        parser.add_argument('--questions', type=int, default=10, help='Nombre de questions par sortie')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        # Les objets écartés sont journalisés un par un : les masquer pendant la mesure
+        logging.getLogger('accounts.quiz_parser').setLevel(logging.ERROR)
+        rng = random.Random(options['seed'])
+        count = options['questions']
+        # Chaque scénario retourne (sortie modifiée, nombre de questions intactes)
+        scenarios = {
+            'tronquée': lambda output, ends: _truncate(output, ends, rng),
+            'virgule finale': lambda output, ends: (output.replace('}\n  ]', '},\n  ]', 1), count),
+            'objet corrompu': lambda output, ends: (_corrupt_one_question(output, rng), count - 1),
+            'bloc markdown': lambda output, ends: (f'```json\n{output}\n```', count),
+        }
+
+        self.stdout.write('\n📊 Questions récupérées (ancien parsing → parser incrémental):')
+        for name, mutate in scenarios.items():
+            legacy = incremental = expected = lost_legacy = lost_incremental = 0
+            for _ in range(options['samples']):
+                sample, reference = mutate(*_sample_output(count, rng))
+                expected += reference
+                recovered_legacy = len(_legacy_parse(sample))
+                recovered_incremental = len(parse_questions(sample)[0])
+                legacy += min(recovered_legacy, reference)
+                incremental += recovered_incremental
+                lost_legacy += reference > 0 and recovered_legacy == 0
+                lost_incremental += reference > 0 and recovered_incremental == 0
+            self.stdout.write(
+                f'  • {name}: {legacy / max(expected, 1):.0%} → {incremental / max(expected, 1):.0%} '
+                f'(générations perdues: {lost_legacy} → {lost_incremental} sur {options["samples"]})'
+            )
+
+        output, _ = _sample_output(50, rng)
+        size_mb = len(output.encode('utf-8')) / (1024 * 1024)
+        started = time.perf_counter()
+        for _ in range(20):
+            parse_questions(output)
+        whole = 20 * size_mb / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(20):
+            parser = IncrementalQuestionParser()
+            for position in range(0, len(output), 8):
+                parser.feed(output[position:position + 8])
+        streamed = 20 * size_mb / (time.perf_counter() - started)
+
+        self.stdout.write('\n⏱️ Débit du parser incrémental:')
+        self.stdout.write(f'  • Réponse complète: {whole:.1f} MB/s')
+        self.stdout.write(f'  • Streaming par morceaux de 8 caractères: {streamed:.1f} MB/s')
+
+def _sample_output(count, rng):
+    """Sortie du modèle et position de fin de chaque question"""
+    output = '{\n  "questions": [\n'
+    ends = []
+    for index in range(count):
+        question = {
+            "question_text": f"Quel est le rôle n°{index} de la {{cellule}} \"eucaryote\" ?",
+            "difficulty": rng.choice(['easy', 'medium', 'hard']),
+            "answers": [
+                {"text": f"Réponse {answer} [{rng.random():.3f}]", "is_correct": answer == 0}
+                for answer in range(4)
+            ]
+        }
+        if index:
+            output += ',\n'
+        output += '    ' + json.dumps(question, ensure_ascii=False)
+        ends.append(len(output))
+    return output + '\n  ]\n}', ends
+
+def _truncate(output, ends, rng):
+    cut = rng.randint(0, len(output))
+    return output[:cut], sum(1 for end in ends if end <= cut)
+
+def _corrupt_one_question(output, rng):
+    """Supprime un caractère structurel au milieu d'une question"""
+    positions = [match.start() for match in re.finditer(r'"is_correct"', output)]
+    position = rng.choice(positions)
+    return output[:position] + output[position + 1:]
+
+def _legacy_parse(content):
+    """Reproduction du parsing utilisé avant le parser incrémental"""
+    if content.startswith('```json'):
+        content = content[7:]
+    if content.endswith('```'):
+        content = content[:-3]
+    if content.startswith('```'):
+        content = content[3:]
+    content = content.strip()
+    if not content.endswith('}') and content.count('{') > content.count('}'):
+        content += '}' * (content.count('{') - content.count('}'))
+    try:
+        data = json.loads(content)
+    except ValueError:
+        try:
+            content = re.sub(r"'([^']*)':", r'"\1":', content)
+            content = re.sub(r':\s*\'([^\']*)\'', r': "\1"', content)
+            data = json.loads(content)
+        except ValueError:
+            return []
+    if not isinstance(data, dict) or not isinstance(data.get('questions'), list):
+        return []
+    return data['questions']
@@ -0,0 +1,39 @@
+"""
+Commande Django pour inspecter et purger le cache des quiz générés
+Usage: python manage.py quiz_cache [--evict] [--clear]
+"""
+from django.core.management.base import BaseCommand
+from accounts.quiz_cache import evict_quiz_cache, get_quiz_cache_stats
+
+class Command(BaseCommand):
+    help = 'Affiche les statistiques du cache des quiz générés et applique la politique d\'éviction'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--evict',
+            action='store_true',
+            help='Supprime les entrées expirées ou au-delà des limites de taille',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Vide entièrement le cache des quiz',
+        )
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            from accounts.models import QuizCacheEntry
+            count, _ = QuizCacheEntry.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'✅ {count} entrée(s) supprimée(s)'))
+            return
+
+        if options['evict']:
+            evicted = evict_quiz_cache()
+            self.stdout.write(self.style.SUCCESS(f'✅ {evicted} entrée(s) évincée(s)'))
+
+        stats = get_quiz_cache_stats()
+        self.stdout.write('\n📊 Cache des quiz générés:')
+        self.stdout.write(f'  • Entrées: {stats["entries"]}')
+        self.stdout.write(f'  • Taille: {stats["size_bytes"] / 1024:.1f} KB')
+        self.stdout.write(f'  • Hits cumulés: {stats["total_hits"]}')
+        self.stdout.write(f'  • Hits / misses (tous processus confondus): {stats["hits"]} / {stats["misses"]} (taux {stats["hit_rate"]:.0%})')
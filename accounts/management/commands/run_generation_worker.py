@@ -0,0 +1,105 @@
+"""
+Commande Django pour exécuter les jobs de génération IA en file d'attente
+Usage: python manage.py run_generation_worker [--concurrency 4] [--once]
+"""
+import os
+import signal
+import socket
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from accounts.ai_providers import get_connection_stats, reset_ai_providers
+from accounts.generation_jobs import process_next_job, record_heartbeat, requeue_stale_jobs
+
+class Command(BaseCommand):
+    help = 'Exécute les jobs de génération de questions IA en attente'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.GENERATION_WORKER_CONCURRENCY,
+            help='Nombre de générations exécutées en parallèle par ce processus',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Délai (secondes) entre deux consultations de la file lorsqu\'elle est vide',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Vide la file puis s\'arrête au lieu d\'attendre de nouveaux jobs',
+        )
+
+    def handle(self, *args, **options):
+        self.stop_event = threading.Event()
+        concurrency = max(1, options['concurrency'])
+        base_worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        requeue_stale_jobs()
+        close_old_connections()
+
+        self.stdout.write(f'🚀 Worker de génération démarré ({concurrency} thread(s))')
+
+        threads = [
+            threading.Thread(
+                target=self.worker_loop,
+                args=(f"{base_worker_id}:{index}", options['poll_interval'], options['once']),
+                daemon=True,
+            )
+            for index in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        heartbeat = threading.Thread(target=self.heartbeat_loop, args=(f"{base_worker_id}:",), daemon=True)
+        heartbeat.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+
+        stats = get_connection_stats()
+        self.stdout.write(
+            f'🔌 Connexions IA: {stats["requests"]} requête(s), {stats["new_connections"]} connexion(s) ouverte(s), '
+            f'{stats["reused_connections"]} réutilisée(s) ({stats["reuse_rate"]:.0%})'
+        )
+        reset_ai_providers()
+        self.stdout.write(self.style.SUCCESS('✅ Worker de génération arrêté'))
+
+    def request_stop(self, signum, frame):
+        """Termine les jobs en cours puis arrête les threads"""
+        self.stdout.write(self.style.WARNING('Arrêt demandé, fin des jobs en cours...'))
+        self.stop_event.set()
+
+    def heartbeat_loop(self, worker_prefix):
+        """Signe de vie des jobs en cours de ce processus : ils ne sont remis en file que s'il s'arrête"""
+        while not self.stop_event.wait(settings.GENERATION_JOB_HEARTBEAT_SECONDS):
+            close_old_connections()
+            try:
+                record_heartbeat(worker_prefix)
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f'❌ Signe de vie des jobs impossible: {e}'))
+        close_old_connections()
+
+    def worker_loop(self, worker_id, poll_interval, once):
+        """Boucle d'un thread : réserve et exécute les jobs un par un"""
+        while not self.stop_event.is_set():
+            close_old_connections()
+            try:
+                processed = process_next_job(worker_id)
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f'❌ Erreur du worker {worker_id}: {e}'))
+                processed = False
+
+            if not processed:
+                if once:
+                    break
+                self.stop_event.wait(poll_interval)
+                requeue_stale_jobs()
+
+        close_old_connections()
@@ -0,0 +1,45 @@
+"""
+Commande Django pour supprimer les fichiers expirés ou orphelins chez OpenAI
+Usage: python manage.py sweep_provider_files [--dry-run]
+"""
+from django.core.management.base import BaseCommand
+from accounts.ai_providers import get_ai_provider
+from accounts.provider_files import ProviderFileCache, sweep_provider_files
+
+class Command(BaseCommand):
+    help = 'Supprime chez OpenAI les fichiers uploadés expirés ou orphelins (worker interrompu)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Affiche ce qui serait supprimé sans effectuer la suppression',
+        )
+        parser.add_argument(
+            '--grace-seconds',
+            type=int,
+            default=None,
+            help='Âge minimal d\'un fichier distant inconnu avant d\'être considéré comme orphelin',
+        )
+
+    def handle(self, *args, **options):
+        client = get_ai_provider()
+
+        if options['dry_run']:
+            self.stdout.write(
+                self.style.WARNING('Mode dry-run activé - aucune suppression ne sera effectuée')
+            )
+
+        try:
+            result = sweep_provider_files(client, grace_seconds=options['grace_seconds'], dry_run=options['dry_run'])
+            if not options['dry_run']:
+                ProviderFileCache().evict(client)
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'❌ Erreur lors du balayage: {e}')
+            )
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(f'✅ {result["expired"]} fichier(s) expiré(s), {result["orphaned"]} fichier(s) orphelin(s)')
+        )
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0023_alter_user_stripe_customer_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+                ('question_count', models.PositiveIntegerField(default=5)),
+                ('difficulty', models.CharField(default='medium', max_length=10)),
+                ('question_types', models.CharField(default='["qcm"]', max_length=100)),
+                ('education_level', models.CharField(blank=True, default='', max_length=100)),
+                ('instructions', models.TextField(blank=True, default='')),
+                ('status', models.CharField(choices=[('queued', 'En attente'), ('running', 'En cours'), ('done', 'Terminé'), ('failed', 'Échoué')], default='queued', max_length=10)),
+                ('error', models.TextField(blank=True, default='', help_text="Message d'erreur en cas d'échec")),
+                ('attempts', models.PositiveIntegerField(default=0, help_text="Nombre de tentatives d'exécution")),
+                ('worker_id', models.CharField(blank=True, default='', help_text='Worker ayant réservé le job', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('document', models.ForeignKey(blank=True, help_text='Document à traiter (null si supprimé après échec)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generation_jobs', to='accounts.document')),
+                ('guest_session', models.ForeignKey(blank=True, help_text='Session invité demandeuse', null=True, on_delete=django.db.models.deletion.CASCADE, to='accounts.guestsession')),
+                ('lesson', models.ForeignKey(blank=True, help_text='Leçon créée à la fin de la génération', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generation_jobs', to='accounts.lesson')),
+                ('user', models.ForeignKey(blank=True, help_text='Utilisateur demandeur (null pour les invités)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='accounts_ge_status_dfd16a_idx')],
+            },
+        ),
+    ]
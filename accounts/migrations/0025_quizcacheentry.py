@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0024_generationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache_key', models.CharField(help_text='SHA-256 du fichier + paramètres de génération', max_length=64, unique=True)),
+                ('file_hash', models.CharField(db_index=True, help_text='SHA-256 du contenu du fichier', max_length=64)),
+                ('question_count', models.PositiveIntegerField()),
+                ('difficulty', models.CharField(max_length=10)),
+                ('education_level', models.CharField(blank=True, default='', max_length=100)),
+                ('instructions', models.TextField(blank=True, default='', help_text='Instructions normalisées')),
+                ('questions', models.JSONField(default=list, help_text='Questions générées (format du service IA)')),
+                ('size_bytes', models.PositiveIntegerField(default=0, help_text='Taille sérialisée des questions')),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_hit_at', models.DateTimeField(auto_now_add=True, help_text='Dernière utilisation (création ou hit)')),
+            ],
+            options={
+                'ordering': ['-last_hit_at'],
+                'indexes': [models.Index(fields=['last_hit_at'], name='accounts_qu_last_hi_9d60ab_idx')],
+            },
+        ),
+    ]
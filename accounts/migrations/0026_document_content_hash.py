@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:52
+
+import accounts.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0025_quizcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='SHA-256 du contenu du fichier', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='file',
+            field=models.FileField(storage=accounts.storage.get_document_storage, upload_to='documents/'),
+        ),
+    ]
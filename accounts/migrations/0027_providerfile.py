@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0026_document_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(help_text='SHA-256 du contenu du fichier', max_length=64, unique=True)),
+                ('file_id', models.CharField(blank=True, db_index=True, default='', help_text='ID du fichier chez le fournisseur', max_length=255)),
+                ('status', models.CharField(choices=[('uploading', 'Upload en cours'), ('ready', 'Disponible')], default='uploading', max_length=10)),
+                ('size_bytes', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, help_text="Dernière réutilisation (sert à l'éviction LRU)")),
+                ('expires_at', models.DateTimeField(blank=True, help_text='Au-delà, le fichier distant est supprimé par le balayage', null=True)),
+            ],
+            options={
+                'ordering': ['-last_used_at'],
+                'indexes': [models.Index(fields=['status', 'last_used_at'], name='accounts_pr_status_5600b4_idx'), models.Index(fields=['expires_at'], name='accounts_pr_expires_66b670_idx')],
+            },
+        ),
+    ]
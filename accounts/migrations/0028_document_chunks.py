@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0027_providerfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='text_extracted_at',
+            field=models.DateTimeField(blank=True, help_text="Date d'extraction locale du texte (null si pas encore extrait)", null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='text_token_count',
+            field=models.PositiveIntegerField(default=0, help_text='Estimation du nombre de tokens du texte extrait'),
+        ),
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(help_text="Ordre de l'extrait dans le document")),
+                ('label', models.CharField(help_text="Repère lisible, ex. 'Page 3'", max_length=100)),
+                ('text', models.TextField()),
+                ('token_count', models.PositiveIntegerField(default=0)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='accounts.document')),
+            ],
+            options={
+                'ordering': ['document', 'position'],
+                'unique_together': {('document', 'position')},
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0028_document_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_role', models.CharField(default='guest', help_text='Rôle du demandeur au moment de la génération', max_length=20)),
+                ('mode', models.CharField(choices=[('job', "File d'attente"), ('stream', 'Streaming')], default='job', max_length=10)),
+                ('model', models.CharField(blank=True, default='', max_length=100)),
+                ('api_calls', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('cached_tokens', models.PositiveIntegerField(default=0, help_text='Tokens du prompt servis par le cache de préfixe')),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('cost_eur', models.DecimalField(decimal_places=6, default=0, help_text='Coût estimé (tarifs AI_PRICE_*)', max_digits=10)),
+                ('file_size_bytes', models.PositiveBigIntegerField(default=0)),
+                ('question_count', models.PositiveIntegerField(default=0, help_text='Questions demandées')),
+                ('questions_generated', models.PositiveIntegerField(default=0)),
+                ('outcome', models.CharField(choices=[('success', 'Réussie'), ('partial', 'Incomplète'), ('cache_hit', 'Servie par le cache'), ('cancelled', 'Interrompue'), ('failed', 'Échouée')], default='success', max_length=10)),
+                ('error_class', models.CharField(blank=True, default='', max_length=100)),
+                ('extraction_ms', models.PositiveIntegerField(default=0, help_text='Extraction locale du texte')),
+                ('upload_ms', models.PositiveIntegerField(default=0, help_text='Préparation et upload du fichier chez le fournisseur')),
+                ('generation_ms', models.PositiveIntegerField(default=0, help_text='Cumul des appels au modèle')),
+                ('first_token_ms', models.PositiveIntegerField(blank=True, help_text='Délai avant le premier token (streaming)', null=True)),
+                ('save_ms', models.PositiveIntegerField(default=0, help_text='Enregistrement des questions')),
+                ('total_ms', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(blank=True, help_text='Document traité (null si supprimé après échec)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generation_runs', to='accounts.document')),
+                ('guest_session', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generation_runs', to='accounts.guestsession')),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='runs', to='accounts.generationjob')),
+                ('user', models.ForeignKey(blank=True, help_text='Utilisateur demandeur (null pour les invités)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generation_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at'], name='accounts_ge_created_642df7_idx'), models.Index(fields=['user_role', 'created_at'], name='accounts_ge_user_ro_4da040_idx')],
+            },
+        ),
+    ]
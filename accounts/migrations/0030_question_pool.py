@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0029_generation_runs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='kind',
+            field=models.CharField(choices=[('lesson', 'Leçon'), ('pool_refill', 'Réserve de questions')], default='lesson', help_text='Leçon à créer ou simple remplissage de la réserve du document', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='pool_extra',
+            field=models.PositiveIntegerField(default=0, help_text='Questions générées en plus pour la réserve du document'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='in_pool',
+            field=models.BooleanField(default=False, help_text='Question de réserve du document, pas encore montrée'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['document', 'in_pool'], name='accounts_qu_documen_a91271_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0030_question_pool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='page_end',
+            field=models.PositiveIntegerField(blank=True, help_text='Dernière page utilisée (PDF, null = fin du document)', null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='page_start',
+            field=models.PositiveIntegerField(blank=True, help_text='Première page utilisée (PDF, null = début du document)', null=True),
+        ),
+    ]
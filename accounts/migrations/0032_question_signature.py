@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0031_document_page_range'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='signature',
+            field=models.BinaryField(blank=True, default=b'', help_text='Signature MinHash du texte (détection des quasi-doublons)'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0032_question_signature'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIConcurrencyTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lane', models.CharField(choices=[('premium', 'Premium'), ('free', 'Gratuit'), ('guest', 'Invité')], max_length=10)),
+                ('priority', models.PositiveSmallIntegerField(default=0, help_text="Ordre d'admission (0 = en premier)")),
+                ('status', models.CharField(choices=[('waiting', 'En attente'), ('active', 'En cours')], default='waiting', max_length=10)),
+                ('slot', models.PositiveIntegerField(blank=True, help_text='Numéro de place occupée (null en attente)', null=True, unique=True)),
+                ('lane_slot', models.PositiveIntegerField(blank=True, help_text='Numéro de place dans une voie plafonnée (gratuit, invité)', null=True)),
+                ('holder', models.CharField(blank=True, default='', help_text='Processus demandeur (hôte:pid)', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(help_text='Au-delà, la demande est considérée abandonnée (processus tué)')),
+            ],
+            options={
+                'ordering': ['priority', 'created_at', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Ordre de prise en charge (0 = premium en premier, voir accounts.ai_limiter)'),
+        ),
+        migrations.AddField(
+            model_name='generationrun',
+            name='queue_ms',
+            field=models.PositiveIntegerField(default=0, help_text="Attente d'une place dans le limiteur global des appels IA"),
+        ),
+        migrations.AddIndex(
+            model_name='generationjob',
+            index=models.Index(fields=['status', 'priority', 'created_at'], name='accounts_ge_status_00e23a_idx'),
+        ),
+        migrations.AddField(
+            model_name='aiconcurrencyticket',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_tickets', to='accounts.generationjob'),
+        ),
+        migrations.AddIndex(
+            model_name='aiconcurrencyticket',
+            index=models.Index(fields=['status', 'priority', 'created_at'], name='accounts_ai_status_91f836_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aiconcurrencyticket',
+            index=models.Index(fields=['expires_at'], name='accounts_ai_expires_a21981_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='aiconcurrencyticket',
+            constraint=models.UniqueConstraint(fields=('lane', 'lane_slot'), name='unique_ai_ticket_lane_slot'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0033_ai_concurrency_limiter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='estimated_tokens',
+            field=models.PositiveIntegerField(default=0, help_text='Tokens estimés du document entier tel que lu par le modèle'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='has_text',
+            field=models.BooleanField(blank=True, help_text='Texte extractible localement (null si inconnu)', null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, help_text="Nombre d'images (estimé par échantillonnage pour les PDF)"),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, help_text='Nombre de pages (PDF) ou de diapositives (PPTX)', null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='profiled_at',
+            field=models.DateTimeField(blank=True, help_text='Date du calcul du profil (null si pas encore calculé)', null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='size_bytes',
+            field=models.PositiveBigIntegerField(default=0, help_text='Taille du fichier en octets'),
+        ),
+    ]
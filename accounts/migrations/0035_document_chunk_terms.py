@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0034_document_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='terms',
+            field=models.JSONField(blank=True, default=dict, help_text="Fréquence de chaque terme (index BM25 de l'extrait)"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0035_document_chunk_terms'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='generationrun',
+            name='outcome',
+            field=models.CharField(choices=[('success', 'Réussie'), ('partial', 'Incomplète'), ('cache_hit', 'Servie par le cache'), ('degraded', 'Générateur local (mode dégradé)'), ('cancelled', 'Interrompue'), ('failed', 'Échouée')], default='success', max_length=10),
+        ),
+    ]
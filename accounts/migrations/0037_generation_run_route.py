@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0036_generation_run_degraded'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationrun',
+            name='route',
+            field=models.CharField(blank=True, default='', help_text="Règle de routage appliquée, suivie de la raison d'un repli éventuel", max_length=100),
+        ),
+    ]
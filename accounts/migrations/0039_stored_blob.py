@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_references(apps, schema_editor):
+    """Compteurs des blobs déjà référencés par des Documents"""
+    Document = apps.get_model('accounts', 'Document')
+    StoredBlob = apps.get_model('accounts', 'StoredBlob')
+    references = Document.objects.exclude(file='').values('file').annotate(count=Count('id'))
+    StoredBlob.objects.bulk_create([
+        StoredBlob(name=reference['file'], ref_count=reference['count'])
+        for reference in references
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0038_generation_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Chemin du blob dans le stockage', max_length=255, unique=True)),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='Documents qui référencent ce blob (ou en cours de création)')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(count_existing_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0039_stored_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='retired',
+            field=models.BooleanField(default=False, help_text='Question déjà montrée puis détachée de sa leçon (historique des tentatives)'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0040_question_retired'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='not_before',
+            field=models.DateTimeField(blank=True, help_text='Pas de nouvelle tentative avant cette date (attente après un échec)', null=True),
+        ),
+    ]
@@ -0,0 +1,176 @@
+"""
+Routage des générations vers un modèle : une table de règles (AI_MODEL_ROUTES, JSON)
+choisit le modèle et ses paramètres d'après la taille du document dans le prompt
+(profil), le nombre de questions et le rôle du demandeur. La première règle qui
+correspond l'emporte. Les appels de chaque modèle (latence, erreurs) sont comptés
+dans le cache Django sur une fenêtre glissante : un modèle trop lent pour le budget
+de latence de la règle, ou qui échoue trop souvent, cède la place au modèle de
+repli de la règle. Chaque décision est journalisée et enregistrée avec la
+génération (GenerationRun.route).
+
+Exemple de table :
+[
+  {"name": "invite", "roles": ["guest"], "model": "gpt-4o-mini", "max_latency_ms": 15000},
+  {"name": "gros_premium", "roles": ["premium"], "min_prompt_tokens": 15000,
+   "model": "gpt-4.1", "fallback": "gpt-4o-mini", "shard_size": 20},
+  {"name": "defaut", "model": "gpt-4o-mini"}
+]
+"""
+import json
+import time
+import logging
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Durée d'un compartiment de la fenêtre glissante des mesures par modèle
+STATS_BUCKET_SECONDS = 60
+STATS_FIELDS = ('calls', 'errors', 'latency_ms')
+
+RULE_KEYS = {
+    'name', 'model', 'fallback', 'roles', 'min_prompt_tokens', 'max_prompt_tokens',
+    'min_questions', 'max_questions', 'max_latency_ms', 'temperature', 'shard_size',
+}
+
+class ModelRoute:
+    """Décision de routage : modèle, paramètres de l'appel et raison du choix"""
+
+    def __init__(self, name, model, temperature=None, shard_size=None, reason='rule'):
+        self.name = name
+        self.model = model
+        self.temperature = temperature
+        self.shard_size = shard_size
+        self.reason = reason
+
+    @property
+    def label(self):
+        """Règle et raison, tel qu'enregistré avec la génération (ex. 'gros_premium:repli_erreurs')"""
+        return self.name if self.reason == 'rule' else f"{self.name}:{self.reason}"
+
+def get_routes():
+    """Règles de routage configurées, ou règles par défaut (AI_MODEL, AI_LARGE_PROMPT_MODEL)"""
+    if settings.AI_MODEL_ROUTES:
+        routes = _parse_routes(settings.AI_MODEL_ROUTES)
+        if routes:
+            return routes
+    return [
+        {
+            'name': 'gros_document',
+            'min_prompt_tokens': settings.AI_LARGE_PROMPT_TOKENS,
+            'model': settings.AI_LARGE_PROMPT_MODEL or settings.AI_MODEL,
+            # Chaque lot relit tout le document : des lots moins nombreux et plus gros
+            'shard_size': max(settings.AI_SHARD_SIZE, settings.AI_LARGE_PROMPT_SHARD_SIZE),
+        },
+        {'name': 'defaut', 'model': settings.AI_MODEL},
+    ]
+
+@lru_cache(maxsize=4)
+def _parse_routes(raw):
+    try:
+        routes = json.loads(raw)
+        if not isinstance(routes, list):
+            raise ValueError("la table doit être une liste de règles")
+        for index, rule in enumerate(routes):
+            if not isinstance(rule, dict) or not rule.get('model'):
+                raise ValueError(f"règle {index + 1} sans modèle")
+            unknown = set(rule) - RULE_KEYS
+            if unknown:
+                raise ValueError(f"règle {index + 1}: clé(s) inconnue(s) {', '.join(sorted(unknown))}")
+            rule.setdefault('name', f"regle_{index + 1}")
+    except ValueError as e:
+        logger.error(f"❌ AI_MODEL_ROUTES invalide, règles par défaut utilisées: {e}")
+        return []
+    return routes
+
+def route_generation(prompt_tokens, question_count, user_role):
+    """Choisit le modèle et les paramètres d'une génération, et journalise la décision"""
+    rule = next((rule for rule in get_routes() if _matches(rule, prompt_tokens, question_count, user_role)), None)
+    if rule is None:
+        route = ModelRoute('defaut', settings.AI_MODEL)
+        stats = get_model_stats(route.model)
+    else:
+        route = ModelRoute(rule['name'], rule['model'], rule.get('temperature'), rule.get('shard_size'))
+        stats = get_model_stats(route.model)
+        reason = _get_degradation(stats, rule.get('max_latency_ms'))
+        fallback = rule.get('fallback')
+        if reason and fallback and fallback != route.model:
+            fallback_stats = get_model_stats(fallback)
+            if _get_degradation(fallback_stats, None) is None:
+                logger.warning(f"🔀 Modèle {route.model} écarté ({reason}: {_format_stats(stats)}), repli sur {fallback}")
+                route.model, route.reason, stats = fallback, reason, fallback_stats
+    logger.info(
+        f"🧭 Routage: règle {route.label} → {route.model} "
+        f"({user_role}, {prompt_tokens} tokens de document, {question_count} questions ; {_format_stats(stats)})"
+    )
+    return route
+
+def _matches(rule, prompt_tokens, question_count, user_role):
+    if rule.get('roles') and user_role not in rule['roles']:
+        return False
+    if prompt_tokens < rule.get('min_prompt_tokens', 0):
+        return False
+    if rule.get('max_prompt_tokens') is not None and prompt_tokens > rule['max_prompt_tokens']:
+        return False
+    if question_count < rule.get('min_questions', 0):
+        return False
+    if rule.get('max_questions') is not None and question_count > rule['max_questions']:
+        return False
+    return True
+
+def _get_degradation(stats, max_latency_ms):
+    """'repli_erreurs' ou 'repli_latence' si les mesures récentes du modèle dépassent les seuils, sinon None"""
+    if stats['calls'] < settings.AI_ROUTING_MIN_CALLS:
+        return None
+    if stats['error_rate'] >= settings.AI_ROUTING_MAX_ERROR_RATE:
+        return 'repli_erreurs'
+    if max_latency_ms and stats['avg_latency_ms'] > max_latency_ms:
+        return 'repli_latence'
+    return None
+
+def _format_stats(stats):
+    if not stats['calls']:
+        return "aucun appel récent"
+    return f"{stats['calls']} appel(s), {stats['error_rate']:.0%} d'erreurs, {stats['avg_latency_ms']:.0f} ms en moyenne"
+
+def record_model_call(model, latency_seconds, failed=False):
+    """Compte un appel au modèle (latence, échec) dans la fenêtre glissante partagée"""
+    bucket = int(time.time() // STATS_BUCKET_SECONDS)
+    timeout = settings.AI_ROUTING_WINDOW_SECONDS + STATS_BUCKET_SECONDS
+    # La latence moyenne ne porte que sur les appels réussis
+    increments = {'calls': 1, 'errors': int(failed), 'latency_ms': 0 if failed else int(latency_seconds * 1000)}
+    try:
+        for field, value in increments.items():
+            if not value:
+                continue
+            key = _stats_key(model, bucket, field)
+            cache.add(key, 0, timeout=timeout)
+            try:
+                cache.incr(key, value)
+            except ValueError:
+                cache.set(key, value, timeout=timeout)
+    except Exception as e:
+        # Les mesures ne doivent jamais faire échouer une génération
+        logger.warning(f"⚠️ Impossible d'enregistrer les mesures du modèle {model}: {e}")
+
+def get_model_stats(model):
+    """Appels, taux d'erreur et latence moyenne (ms) du modèle sur AI_ROUTING_WINDOW_SECONDS"""
+    current = int(time.time() // STATS_BUCKET_SECONDS)
+    buckets = range(current - settings.AI_ROUTING_WINDOW_SECONDS // STATS_BUCKET_SECONDS, current + 1)
+    keys = [_stats_key(model, bucket, field) for bucket in buckets for field in STATS_FIELDS]
+    values = cache.get_many(keys)
+    totals = {field: 0 for field in STATS_FIELDS}
+    for bucket in buckets:
+        for field in STATS_FIELDS:
+            totals[field] += values.get(_stats_key(model, bucket, field), 0)
+    calls = totals['calls']
+    successes = calls - totals['errors']
+    return {
+        'calls': calls,
+        'error_rate': totals['errors'] / calls if calls else 0.0,
+        'avg_latency_ms': totals['latency_ms'] / successes if successes else 0.0,
+    }
+
+def _stats_key(model, bucket, field):
+    return f"ai_model_stats:{model}:{bucket}:{field}"
@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
+from .storage import get_document_storage, content_hash_from_name, release_document_file
 
 class User(AbstractUser):
     email = models.EmailField(unique=True)
@@ -123,7 +124,12 @@ class User(AbstractUser):
         if self.is_premium:
             return True
         else:
-            return self.quiz_count_today < 1
+            # Les quiz en cours de génération ne sont décomptés qu'à la fin : les compter ici
+            return self.quiz_count_today + self.get_pending_quiz_count() < 1
+    
+    def get_pending_quiz_count(self):
+        """Nombre de quiz en file ou en cours de génération pour cet utilisateur"""
+        return self.generation_jobs.filter(kind='lesson', status__in=('queued', 'running')).count()
     
     def increment_quiz_count(self):
         """Incrémente le compteur de quiz du jour"""
@@ -175,14 +181,71 @@ class Document(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documents', null=True, blank=True, help_text="Utilisateur propriétaire du document (null pour les invités)")
     guest_session = models.ForeignKey('GuestSession', on_delete=models.CASCADE, null=True, blank=True, help_text="Session invité (pour les documents d'invités)")
     title = models.CharField(max_length=200)
-    file = models.FileField(upload_to='documents/')
+    file = models.FileField(upload_to='documents/', storage=get_document_storage)
     file_type = models.CharField(max_length=50)
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True, help_text="SHA-256 du contenu du fichier")
+    text_extracted_at = models.DateTimeField(null=True, blank=True, help_text="Date d'extraction locale du texte (null si pas encore extrait)")
+    text_token_count = models.PositiveIntegerField(default=0, help_text="Estimation du nombre de tokens du texte extrait")
+    page_start = models.PositiveIntegerField(null=True, blank=True, help_text="Première page utilisée (PDF, null = début du document)")
+    page_end = models.PositiveIntegerField(null=True, blank=True, help_text="Dernière page utilisée (PDF, null = fin du document)")
+    # Profil calculé une fois à l'upload (voir accounts.document_profile)
+    size_bytes = models.PositiveBigIntegerField(default=0, help_text="Taille du fichier en octets")
+    page_count = models.PositiveIntegerField(null=True, blank=True, help_text="Nombre de pages (PDF) ou de diapositives (PPTX)")
+    image_count = models.PositiveIntegerField(default=0, help_text="Nombre d'images (estimé par échantillonnage pour les PDF)")
+    estimated_tokens = models.PositiveIntegerField(default=0, help_text="Tokens estimés du document entier tel que lu par le modèle")
+    has_text = models.BooleanField(null=True, blank=True, help_text="Texte extractible localement (null si inconnu)")
+    profiled_at = models.DateTimeField(null=True, blank=True, help_text="Date du calcul du profil (null si pas encore calculé)")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    def save(self, *args, **kwargs):
+        # Enregistrer le fichier avant l'INSERT pour connaître son hash de contenu
+        # (le stockage compte alors une référence au blob, voir StoredBlob)
+        new_file = bool(self.file) and not self.file._committed
+        if new_file:
+            self.file.save(self.file.name, self.file.file, save=False)
+        if self.file and not self.content_hash:
+            self.content_hash = content_hash_from_name(self.file.name)
+        try:
+            super().save(*args, **kwargs)
+        except Exception:
+            if new_file:
+                # Document non créé : rendre la référence prise par le stockage
+                file_name = self.file.name
+                transaction.on_commit(lambda: release_document_file(file_name))
+            raise
+    
     def __str__(self):
         return self.title
 
+class StoredBlob(models.Model):
+    """
+    Compteur de références d'un blob du stockage adressé par contenu (voir accounts.storage) :
+    incrémenté à l'enregistrement du fichier, décrémenté à la suppression d'un Document
+    """
+    name = models.CharField(max_length=255, unique=True, help_text="Chemin du blob dans le stockage")
+    ref_count = models.PositiveIntegerField(default=0, help_text="Documents qui référencent ce blob (ou en cours de création)")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+class DocumentChunk(models.Model):
+    """Extrait de texte d'un document (page, diapositive ou section)"""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
+    position = models.PositiveIntegerField(help_text="Ordre de l'extrait dans le document")
+    label = models.CharField(max_length=100, help_text="Repère lisible, ex. 'Page 3'")
+    text = models.TextField()
+    token_count = models.PositiveIntegerField(default=0)
+    terms = models.JSONField(default=dict, blank=True, help_text="Fréquence de chaque terme (index BM25 de l'extrait)")
+    
+    class Meta:
+        ordering = ['document', 'position']
+        unique_together = ['document', 'position']
+    
+    def __str__(self):
+        return f"{self.document.title} - {self.label}"
+
 class Question(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='questions')
     lesson = models.ForeignKey('Lesson', on_delete=models.CASCADE, related_name='questions', null=True, blank=True)
@@ -196,8 +259,16 @@ class Question(models.Model):
         ('medium', 'Moyen'),
         ('hard', 'Difficile')
     ])
+    in_pool = models.BooleanField(default=False, help_text="Question de réserve du document, pas encore montrée")
+    retired = models.BooleanField(default=False, help_text="Question déjà montrée puis détachée de sa leçon (historique des tentatives)")
+    signature = models.BinaryField(blank=True, default=b'', editable=False, help_text="Signature MinHash du texte (détection des quasi-doublons)")
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['document', 'in_pool']),
+        ]
+    
     def __str__(self):
         return self.question_text[:50] + "..."
 
@@ -329,8 +400,12 @@ class GuestSession(models.Model):
         ]
     
     def can_create_document(self):
-        """Vérifie si l'invité peut créer un document"""
-        return not self.is_blocked and self.documents_created < 1
+        """Vérifie si l'invité peut créer un document (quiz en cours de génération compris)"""
+        return not self.is_blocked and self.documents_created + self.get_pending_quiz_count() < 1
+    
+    def get_pending_quiz_count(self):
+        """Nombre de quiz en file ou en cours de génération pour cette session"""
+        return GenerationJob.objects.filter(guest_session=self, kind='lesson', status__in=('queued', 'running')).count()
     
     def increment_document_count(self):
         """Incrémente le compteur de documents et bloque si nécessaire"""
@@ -394,3 +469,213 @@ class StripePayment(models.Model):
     def is_successful(self):
         """Vérifie si le paiement a réussi"""
         return self.status == 'succeeded'
+
+class GenerationJob(models.Model):
+    """File d'attente persistante des générations de questions IA"""
+    STATUS_CHOICES = [
+        ('queued', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminé'),
+        ('failed', 'Échoué'),
+    ]
+    KIND_CHOICES = [
+        ('lesson', 'Leçon'),
+        ('pool_refill', 'Réserve de questions'),
+    ]
+    
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_jobs', help_text="Document à traiter (null si supprimé après échec)")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='generation_jobs', help_text="Utilisateur demandeur (null pour les invités)")
+    guest_session = models.ForeignKey(GuestSession, on_delete=models.CASCADE, null=True, blank=True, help_text="Session invité demandeuse")
+    lesson = models.ForeignKey(Lesson, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_jobs', help_text="Leçon créée à la fin de la génération")
+    
+    # Paramètres de génération
+    title = models.CharField(max_length=200)
+    question_count = models.PositiveIntegerField(default=5)
+    difficulty = models.CharField(max_length=10, default='medium')
+    question_types = models.CharField(max_length=100, default='["qcm"]')
+    education_level = models.CharField(max_length=100, blank=True, default='')
+    instructions = models.TextField(blank=True, default='')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='lesson', help_text="Leçon à créer ou simple remplissage de la réserve du document")
+    pool_extra = models.PositiveIntegerField(default=0, help_text="Questions générées en plus pour la réserve du document")
+    priority = models.PositiveSmallIntegerField(default=0, help_text="Ordre de prise en charge (0 = premium en premier, voir accounts.ai_limiter)")
+    
+    # Suivi d'exécution
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    error = models.TextField(blank=True, default='', help_text="Message d'erreur en cas d'échec")
+    attempts = models.PositiveIntegerField(default=0, help_text="Nombre de tentatives d'exécution")
+    worker_id = models.CharField(max_length=100, blank=True, default='', help_text="Worker ayant réservé le job")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True, help_text="Dernier signe de vie du worker qui exécute le job")
+    not_before = models.DateTimeField(null=True, blank=True, help_text="Pas de nouvelle tentative avant cette date (attente après un échec)")
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['status', 'priority', 'created_at']),
+        ]
+    
+    def to_status_dict(self):
+        """Représentation renvoyée par l'endpoint de statut"""
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'document_id': self.document_id,
+            'lesson_id': self.lesson_id,
+            'error': self.error or None,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+    
+    def __str__(self):
+        return f"Job {self.id} - {self.title} ({self.status})"
+
+class QuizCacheEntry(models.Model):
+    """Cache des questions générées, indexé par le contenu du fichier et les paramètres de génération"""
+    cache_key = models.CharField(max_length=64, unique=True, help_text="SHA-256 du fichier + paramètres de génération")
+    file_hash = models.CharField(max_length=64, db_index=True, help_text="SHA-256 du contenu du fichier")
+    question_count = models.PositiveIntegerField()
+    difficulty = models.CharField(max_length=10)
+    education_level = models.CharField(max_length=100, blank=True, default='')
+    instructions = models.TextField(blank=True, default='', help_text="Instructions normalisées")
+    questions = models.JSONField(default=list, help_text="Questions générées (format du service IA)")
+    size_bytes = models.PositiveIntegerField(default=0, help_text="Taille sérialisée des questions")
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(auto_now_add=True, help_text="Dernière utilisation (création ou hit)")
+    
+    class Meta:
+        ordering = ['-last_hit_at']
+        indexes = [
+            models.Index(fields=['last_hit_at']),
+        ]
+    
+    def __str__(self):
+        return f"Cache {self.file_hash[:12]}... - {self.question_count} questions ({self.hit_count} hits)"
+
+class ProviderFile(models.Model):
+    """Fichier déjà uploadé chez le fournisseur IA, réutilisable par hash de contenu"""
+    STATUS_CHOICES = [
+        ('uploading', 'Upload en cours'),
+        ('ready', 'Disponible'),
+    ]
+    
+    content_hash = models.CharField(max_length=64, unique=True, help_text="SHA-256 du contenu du fichier")
+    file_id = models.CharField(max_length=255, blank=True, default='', db_index=True, help_text="ID du fichier chez le fournisseur")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='uploading')
+    size_bytes = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, help_text="Dernière réutilisation (sert à l'éviction LRU)")
+    expires_at = models.DateTimeField(null=True, blank=True, help_text="Au-delà, le fichier distant est supprimé par le balayage")
+    
+    class Meta:
+        ordering = ['-last_used_at']
+        indexes = [
+            models.Index(fields=['status', 'last_used_at']),
+            models.Index(fields=['expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.file_id or '(upload en cours)'} - {self.content_hash[:12]}..."
+
+class GenerationRun(models.Model):
+    """Mesures d'une génération de questions : tokens, coût estimé, latences par étape et issue"""
+    OUTCOME_CHOICES = [
+        ('success', 'Réussie'),
+        ('partial', 'Incomplète'),
+        ('cache_hit', 'Servie par le cache'),
+        ('degraded', 'Générateur local (mode dégradé)'),
+        ('cancelled', 'Interrompue'),
+        ('failed', 'Échouée'),
+    ]
+    MODE_CHOICES = [
+        ('job', 'File d\'attente'),
+        ('stream', 'Streaming'),
+    ]
+    
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_runs', help_text="Document traité (null si supprimé après échec)")
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_runs', help_text="Utilisateur demandeur (null pour les invités)")
+    guest_session = models.ForeignKey(GuestSession, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_runs')
+    job = models.ForeignKey(GenerationJob, on_delete=models.SET_NULL, null=True, blank=True, related_name='runs')
+    user_role = models.CharField(max_length=20, default='guest', help_text="Rôle du demandeur au moment de la génération")
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default='job')
+    
+    # Appels au modèle
+    model = models.CharField(max_length=100, blank=True, default='')
+    route = models.CharField(max_length=100, blank=True, default='', help_text="Règle de routage appliquée, suivie de la raison d'un repli éventuel")
+    api_calls = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    cached_tokens = models.PositiveIntegerField(default=0, help_text="Tokens du prompt servis par le cache de préfixe")
+    completion_tokens = models.PositiveIntegerField(default=0)
+    cost_eur = models.DecimalField(max_digits=10, decimal_places=6, default=0, help_text="Coût estimé (tarifs AI_PRICE_*)")
+    
+    # Taille de la demande et résultat
+    file_size_bytes = models.PositiveBigIntegerField(default=0)
+    question_count = models.PositiveIntegerField(default=0, help_text="Questions demandées")
+    questions_generated = models.PositiveIntegerField(default=0)
+    outcome = models.CharField(max_length=10, choices=OUTCOME_CHOICES, default='success')
+    error_class = models.CharField(max_length=100, blank=True, default='')
+    
+    # Latences par étape (millisecondes)
+    queue_ms = models.PositiveIntegerField(default=0, help_text="Attente d'une place dans le limiteur global des appels IA")
+    extraction_ms = models.PositiveIntegerField(default=0, help_text="Extraction locale du texte")
+    upload_ms = models.PositiveIntegerField(default=0, help_text="Préparation et upload du fichier chez le fournisseur")
+    generation_ms = models.PositiveIntegerField(default=0, help_text="Cumul des appels au modèle")
+    first_token_ms = models.PositiveIntegerField(null=True, blank=True, help_text="Délai avant le premier token (streaming)")
+    save_ms = models.PositiveIntegerField(default=0, help_text="Enregistrement des questions")
+    total_ms = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['user_role', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"Génération {self.id} - {self.model or 'cache'} ({self.outcome})"
+
+class AIConcurrencyTicket(models.Model):
+    """
+    Demande de place dans le limiteur global des générations IA (voir accounts.ai_limiter).
+    Une place occupée porte un numéro unique, et un numéro unique dans sa voie pour
+    les voies plafonnées : l'unicité rend l'admission atomique entre processus et hôtes.
+    """
+    LANE_CHOICES = [
+        ('premium', 'Premium'),
+        ('free', 'Gratuit'),
+        ('guest', 'Invité'),
+    ]
+    STATUS_CHOICES = [
+        ('waiting', 'En attente'),
+        ('active', 'En cours'),
+    ]
+    
+    lane = models.CharField(max_length=10, choices=LANE_CHOICES)
+    priority = models.PositiveSmallIntegerField(default=0, help_text="Ordre d'admission (0 = en premier)")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='waiting')
+    slot = models.PositiveIntegerField(null=True, blank=True, unique=True, help_text="Numéro de place occupée (null en attente)")
+    lane_slot = models.PositiveIntegerField(null=True, blank=True, help_text="Numéro de place dans une voie plafonnée (gratuit, invité)")
+    job = models.ForeignKey(GenerationJob, on_delete=models.SET_NULL, null=True, blank=True, related_name='ai_tickets')
+    holder = models.CharField(max_length=100, blank=True, default='', help_text="Processus demandeur (hôte:pid)")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(help_text="Au-delà, la demande est considérée abandonnée (processus tué)")
+    
+    class Meta:
+        ordering = ['priority', 'created_at', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['lane', 'lane_slot'], name='unique_ai_ticket_lane_slot'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'priority', 'created_at']),
+            models.Index(fields=['expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_lane_display()} - {self.get_status_display()}" + (f" (place {self.slot})" if self.slot is not None else '')
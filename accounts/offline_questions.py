@@ -0,0 +1,248 @@
+"""
+Générateur local de questions (mode dégradé) : sans appel au modèle, des QCM sont
+construits à partir du texte extrait du document. Questions à trous sur les
+phrases les plus riches en termes clés, et questions de définition ("X est un...")
+quand le document en contient assez ; les mauvaises réponses sont d'autres termes
+clés (ou définitions) du même document. Utilisé quand le fournisseur est
+indisponible (disjoncteur ouvert), quand la file des générations IA est trop
+longue, ou pour les invités pendant les pics.
+"""
+import re
+import math
+import random
+import logging
+import unicodedata
+from collections import Counter
+from django.conf import settings
+from .models import AIConcurrencyTicket, GenerationJob
+from .ai_limiter import AIQueueTimeoutError, BACKGROUND_PRIORITY_OFFSET
+from .ai_providers import CircuitOpenError, get_ai_provider
+from .extraction import can_extract_text, get_document_chunks, get_token_budget
+from .retrieval import STOP_WORDS, retrieve_chunks
+
+logger = logging.getLogger(__name__)
+
+ANSWER_COUNT = 4
+BLANK = '_____'
+MIN_SENTENCE_LENGTH = 40
+MAX_SENTENCE_LENGTH = 300
+MIN_TERM_LENGTH = 5
+
+# Mots fréquents qui ne font pas de bons trous (en plus des mots outils de la recherche)
+COMMON_WORDS = frozenset("""
+    ainsi alors apres autre autres aussi avant avoir celle celles celui certain certaine
+    certaines certains cette ceux chaque comme comment depuis donc dont elles encore entre
+    etaient etait etre exemple exemples egalement faire grace jamais leurs meme moins notre
+    nous parce pendant peuvent plusieurs plupart pourquoi pourtant premier premiere quand
+    quelque quelques selon souvent toujours toute toutes tres vous votre voici deux trois
+    there their these those which where while would could should about after before other
+""".split())
+
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+(?=[A-ZÀ-ÖØ-Þ0-9«"])')
+WORD_PATTERN = re.compile(r'\b\w[\w-]*\w\b|\b\d\b')
+NUMBER_PATTERN = re.compile(r'^\d+$')
+DEFINITION_PATTERN = re.compile(
+    r"^(?P<term>[^,;:()]{3,60}?)\s+(?:est|sont|désigne|désignent|correspond à|se définit comme|représente)\s+"
+    r"(?P<definition>(?:un|une|le|la|les|des|l'|l’)\s*[^;]{10,200}?)\.?$",
+    re.IGNORECASE
+)
+LEADING_ARTICLE_PATTERN = re.compile(r"^(?:le|la|les|l'|l’|un|une|des)\s*", re.IGNORECASE)
+
+def get_degraded_reason(lane, document=None):
+    """
+    Raison de servir la demande avec le générateur local plutôt que le modèle :
+    'circuit_open', 'backlog' (trop de générations IA en attente), 'guest_spike'
+    (invités en attente pendant un pic), ou None. Toujours None pour un `document`
+    sans texte extractible, que seul le modèle peut lire.
+    """
+    if not settings.AI_DEGRADED_MODE_ENABLED:
+        return None
+    reason = _get_load_reason(lane)
+    if reason and document is not None and not can_generate_offline(document):
+        return None
+    return reason
+
+def _get_load_reason(lane):
+    if get_ai_provider().breaker.state() == 'open':
+        return 'circuit_open'
+    if settings.AI_DEGRADED_BACKLOG:
+        backlog = (
+            AIConcurrencyTicket.objects.filter(status='waiting', priority__lt=BACKGROUND_PRIORITY_OFFSET).count()
+            + GenerationJob.objects.filter(status='queued', kind='lesson').count()
+        )
+        if backlog >= settings.AI_DEGRADED_BACKLOG:
+            return 'backlog'
+    if lane == 'guest' and settings.AI_DEGRADED_GUEST_BACKLOG:
+        if AIConcurrencyTicket.objects.filter(status='waiting', lane='guest').count() >= settings.AI_DEGRADED_GUEST_BACKLOG:
+            return 'guest_spike'
+    return None
+
+def can_generate_offline(document):
+    return bool(document.file) and can_extract_text(document.file.name) and bool(get_document_chunks(document))
+
+def is_unavailable_error(error):
+    """Vrai si l'erreur (ou son origine, les erreurs étant reformulées) signale un fournisseur indisponible"""
+    while error is not None:
+        if isinstance(error, (CircuitOpenError, AIQueueTimeoutError)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+def generate_offline_questions(document, question_count, difficulty='medium', instructions=''):
+    """
+    Questions au format du service IA construites localement à partir du texte du
+    document (extraits visés par les instructions s'il y en a). Liste vide si le
+    document n'a pas de texte extractible (PDF scanné, image).
+    """
+    chunks = get_document_chunks(document)
+    if instructions and instructions.strip():
+        chunks = retrieve_chunks(chunks, instructions, get_token_budget(question_count)) or chunks
+    sentences = split_sentences(chunks)
+    if not sentences:
+        return []
+
+    rng = random.Random(f"{document.content_hash or document.id}:{question_count}:{difficulty}")
+    terms = extract_key_terms(sentences)
+    definitions = find_definitions(sentences)
+
+    questions = []
+    used_sentences = set()
+    # Questions de définition d'abord (au plus la moitié), si les définitions suffisent à fournir les distracteurs
+    if len(definitions) >= ANSWER_COUNT:
+        for index, (term, definition) in definitions[:(question_count + 1) // 2]:
+            others = [other for _, (_, other) in definitions if other != definition]
+            answers = [definition] + rng.sample(others, ANSWER_COUNT - 1)
+            questions.append(build_question(f"Quelle définition correspond à « {term} » ?", answers, difficulty, rng))
+            used_sentences.add(index)
+
+    for index, sentence, term in select_cloze_sentences(sentences, terms):
+        if len(questions) >= question_count:
+            break
+        if index in used_sentences:
+            continue
+        distractors = pick_distractors(term, terms, sentence, rng)
+        if len(distractors) < ANSWER_COUNT - 1:
+            continue
+        text = re.sub(rf'\b{re.escape(term)}\b', BLANK, sentence, count=1)
+        questions.append(build_question(f"Complétez la phrase : « {text} »", [term] + distractors, difficulty, rng))
+        used_sentences.add(index)
+
+    logger.info(f"🧰 {len(questions)}/{question_count} question(s) générée(s) localement pour {document.title}")
+    return questions[:question_count]
+
+def split_sentences(chunks):
+    """Phrases exploitables des extraits, dans l'ordre du document"""
+    sentences = []
+    for chunk in chunks:
+        for paragraph in re.split(r'\n\s*\n', chunk.text):
+            for sentence in SENTENCE_PATTERN.split(' '.join(paragraph.split())):
+                sentence = sentence.strip()
+                if MIN_SENTENCE_LENGTH <= len(sentence) <= MAX_SENTENCE_LENGTH:
+                    sentences.append(sentence)
+    return sentences
+
+def normalize(word):
+    word = unicodedata.normalize('NFKD', word.lower())
+    return ''.join(char for char in word if not unicodedata.combining(char))
+
+def extract_key_terms(sentences):
+    """
+    Termes clés du document (forme la plus fréquente -> poids) : mots rares à
+    l'échelle d'une phrase mais répétés dans le document, nombres, noms propres
+    """
+    occurrences = Counter()
+    sentence_frequency = Counter()
+    surfaces = {}
+    for sentence in sentences:
+        seen = set()
+        for position, word in enumerate(WORD_PATTERN.findall(sentence)):
+            key = normalize(word)
+            if key in STOP_WORDS or key in COMMON_WORDS:
+                continue
+            is_number = bool(NUMBER_PATTERN.match(word))
+            is_proper_noun = position > 0 and word[0].isupper()
+            if not is_number and len(word) < MIN_TERM_LENGTH and not is_proper_noun:
+                continue
+            occurrences[key] += 1
+            surfaces.setdefault(key, Counter())[word] += 1
+            seen.add(key)
+        sentence_frequency.update(seen)
+
+    terms = {}
+    total = len(sentences)
+    for key, count in occurrences.items():
+        surface = surfaces[key].most_common(1)[0][0]
+        # Un terme présent dans la plupart des phrases est le sujet du document, pas un détail à retenir
+        if total > 4 and sentence_frequency[key] > total / 2:
+            continue
+        if count < 2 and not NUMBER_PATTERN.match(surface) and not surface[0].isupper():
+            continue
+        terms[surface] = count * math.log(1 + total / sentence_frequency[key])
+    return terms
+
+def find_definitions(sentences):
+    """Phrases de définition : [(index de la phrase, (terme, définition))], un terme par définition"""
+    definitions = []
+    seen_terms = set()
+    for index, sentence in enumerate(sentences):
+        match = DEFINITION_PATTERN.match(sentence)
+        if not match:
+            continue
+        term = LEADING_ARTICLE_PATTERN.sub('', match.group('term')).strip()
+        if not term or len(term.split()) > 6 or normalize(term) in seen_terms:
+            continue
+        seen_terms.add(normalize(term))
+        definition = match.group('definition').strip().rstrip('.')
+        definitions.append((index, (term, definition[0].upper() + definition[1:])))
+    return definitions
+
+def select_cloze_sentences(sentences, terms):
+    """[(index, phrase, terme à masquer)] par score décroissant, chaque terme n'étant masqué qu'une fois"""
+    candidates = []
+    for index, sentence in enumerate(sentences):
+        present = [word for word in set(WORD_PATTERN.findall(sentence)) if word in terms]
+        if not present:
+            continue
+        best = max(present, key=lambda word: (terms[word], word))
+        score = (terms[best] + 0.1 * sum(terms[word] for word in present if word != best)) / math.sqrt(len(sentence.split()))
+        candidates.append((score, index, sentence, best))
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+
+    selected = []
+    blanked = set()
+    for _, index, sentence, term in candidates:
+        if term in blanked:
+            continue
+        blanked.add(term)
+        selected.append((index, sentence, term))
+    return selected
+
+def pick_distractors(term, terms, sentence, rng):
+    """Mauvaises réponses : termes clés du même genre (nombre ou mot) et de longueur proche, absents de la phrase"""
+    is_number = bool(NUMBER_PATTERN.match(term))
+    sentence_words = {normalize(word) for word in WORD_PATTERN.findall(sentence)}
+    candidates = [
+        other for other in terms
+        if other != term
+        and bool(NUMBER_PATTERN.match(other)) == is_number
+        and normalize(other) not in sentence_words
+        and other[0].isupper() == term[0].isupper()
+    ]
+    candidates.sort(key=lambda other: (abs(len(other) - len(term)), -terms[other], other))
+    pool = candidates[:(ANSWER_COUNT - 1) * 3]
+    distractors = rng.sample(pool, min(len(pool), ANSWER_COUNT - 1))
+    if is_number and len(distractors) < ANSWER_COUNT - 1:
+        # Pas assez d'autres nombres dans le document : valeurs voisines
+        value = int(term)
+        offsets = [offset for offset in (-10, -5, -2, -1, 1, 2, 5, 10) if value + offset >= 0 and str(value + offset) not in distractors]
+        for offset in rng.sample(offsets, len(offsets)):
+            if len(distractors) >= ANSWER_COUNT - 1:
+                break
+            distractors.append(str(value + offset))
+    return distractors
+
+def build_question(question_text, answers, difficulty, rng):
+    """Question au format du service IA ; la première réponse de `answers` est la bonne"""
+    choices = [{'text': answer, 'is_correct': index == 0} for index, answer in enumerate(answers)]
+    rng.shuffle(choices)
+    return {'question_text': question_text, 'difficulty': difficulty, 'answers': choices}
@@ -0,0 +1,119 @@
+"""
+Sélection des pages des PDF longs : plage demandée à l'upload (Document.page_start
+et page_end) ou, sans plage, pages réparties uniformément au-delà de
+AI_PDF_MAX_PAGES. Le PDF réduit est écrit à côté du blob d'origine et c'est lui
+qui est envoyé au fournisseur, jamais le document complet.
+"""
+import os
+import hashlib
+import logging
+import tempfile
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    PdfReader = PdfWriter = None
+
+def is_pdf(file_path):
+    return os.path.splitext(file_path)[1].lower() == '.pdf'
+
+def get_pdf_page_count(file):
+    """Nombre de pages d'un PDF (chemin ou fichier ouvert), ou None s'il est illisible"""
+    if PdfReader is None:
+        return None
+    try:
+        return len(PdfReader(file).pages)
+    except Exception as e:
+        logger.warning(f"⚠️ Lecture du PDF impossible: {e}")
+        return None
+    finally:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+
+def has_page_range(document):
+    return document.page_start is not None or document.page_end is not None
+
+def get_page_range(document, page_count):
+    """Plage demandée (numéros de pages à partir de 1, bornes incluses), limitée au document"""
+    start = max(1, document.page_start or 1)
+    end = min(page_count, document.page_end or page_count)
+    return start, end
+
+def sample_pages(page_count, max_pages):
+    """`max_pages` numéros de pages répartis uniformément sur le document"""
+    if page_count <= max_pages:
+        return list(range(1, page_count + 1))
+    stride = page_count / max_pages
+    return [int(index * stride + stride / 2) + 1 for index in range(max_pages)]
+
+def get_selected_pages(document, page_count):
+    """
+    Pages du document à utiliser : la plage demandée, sinon un échantillon si le
+    document dépasse AI_PDF_MAX_PAGES. Retourne (pages, nom du sous-ensemble), ou
+    (None, '') quand le document entier convient.
+    """
+    if has_page_range(document):
+        start, end = get_page_range(document, page_count)
+        if (start, end) == (1, page_count):
+            return None, ''
+        return list(range(start, end + 1)), f"pages-{start}-{end}"
+    max_pages = settings.AI_PDF_MAX_PAGES
+    if max_pages and page_count > max_pages:
+        return sample_pages(page_count, max_pages), f"sample-{max_pages}"
+    return None, ''
+
+def get_source_hash(document, file_hash):
+    """
+    Clé du contenu réellement utilisé pour la génération (cache des quiz, fichiers
+    du fournisseur) : le hash du fichier, combiné à la plage de pages s'il y en a une
+    """
+    if not has_page_range(document):
+        return file_hash
+    raw = f"{file_hash}|pages:{document.page_start or ''}-{document.page_end or ''}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def get_provider_file(document, file_hash):
+    """
+    Fichier à envoyer au fournisseur et sa clé de contenu : le PDF réduit aux
+    pages sélectionnées (écrit une seule fois à côté du blob), sinon le fichier
+    d'origine. En cas d'échec, le fichier d'origine est envoyé.
+    """
+    file_path = document.file.path
+    if PdfWriter is None or not is_pdf(file_path):
+        return file_path, file_hash
+
+    page_count = get_pdf_page_count(file_path)
+    if not page_count:
+        return file_path, file_hash
+    pages, subset_name = get_selected_pages(document, page_count)
+    if pages is None:
+        return file_path, file_hash
+
+    subset_path = f"{os.path.splitext(file_path)[0]}.{subset_name}.pdf"
+    subset_hash = hashlib.sha256(f"{file_hash}|{subset_name}".encode('utf-8')).hexdigest()
+    if os.path.exists(subset_path):
+        return subset_path, subset_hash
+
+    try:
+        reader = PdfReader(file_path)
+        writer = PdfWriter()
+        for number in pages:
+            writer.add_page(reader.pages[number - 1])
+        # Écriture atomique : un autre worker peut préparer le même sous-ensemble
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(subset_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                writer.write(tmp_file)
+            os.replace(tmp_path, subset_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except Exception as e:
+        logger.warning(f"⚠️ Découpage du PDF impossible, envoi du document complet: {e}")
+        return file_path, file_hash
+
+    logger.info(f"📄 PDF réduit à {len(pages)}/{page_count} pages ({subset_name}): {os.path.getsize(file_path)} → {os.path.getsize(subset_path)} octets")
+    return subset_path, subset_hash
@@ -0,0 +1,268 @@
+"""
+Contrôles rapides des fichiers uploadés, avant tout enregistrement ou appel au
+fournisseur : type réel d'après les premiers octets, PDF protégé, corrompu ou
+sans page, document sans texte exploitable. Un fichier dont l'extension ne
+correspond pas au contenu, mais dont le type réel est pris en charge, est
+renommé avec la bonne extension plutôt que refusé. Le même passage mesure le
+document (pages, texte, images) pour son profil (voir accounts.document_profile).
+"""
+import os
+import time
+import zipfile
+import logging
+from .ingestion import IMAGE_EXTENSIONS, MIME_TYPES
+from .images import Image
+from .pdf_pages import PdfReader
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypdf.errors import FileNotDecryptedError
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    FileNotDecryptedError = None
+
+# Octets lus pour reconnaître le type du fichier
+SNIFF_BYTES = 8192
+# Pages d'un PDF dont le texte et les images sont mesurés (réparties sur le document)
+PDF_SAMPLE_PAGES = 5
+
+TEXT_LIKE_EXTENSIONS = ['.txt', '.md', '.csv', '.json', '.xml']
+TEXT = 'text'
+
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+]
+# Partie principale de chaque format Office (archives ZIP)
+OFFICE_MAIN_PARTS = {
+    '.docx': 'word/document.xml',
+    '.pptx': 'ppt/presentation.xml',
+    '.xlsx': 'xl/workbook.xml',
+}
+EQUIVALENT_EXTENSIONS = {'.jpeg': '.jpg'}
+
+class PreflightError(Exception):
+    """Fichier refusé avant l'enregistrement ; `code` identifie la cause pour le client"""
+
+    def __init__(self, code, message, details='', status_code=400):
+        self.code = code
+        self.message = message
+        self.details = details
+        self.status_code = status_code
+        super().__init__(message)
+
+    def to_dict(self):
+        data = {'error': self.message, 'code': self.code}
+        if self.details:
+            data['details'] = self.details
+        return data
+
+def inspect_upload(file):
+    """
+    Vérifie le fichier reçu (sans l'enregistrer) et corrige son extension si
+    nécessaire. Retourne un dict (extension, mime_type, page_count, has_text,
+    text_tokens, image_count, image_size) ou lève PreflightError.
+    """
+    started = time.monotonic()
+    if not file.size:
+        raise PreflightError('empty_file', 'Le fichier est vide.')
+
+    stem, declared = os.path.splitext(file.name)
+    declared = declared.lower()
+    file.seek(0)
+    head = file.read(SNIFF_BYTES)
+    file.seek(0)
+
+    detected = sniff_extension(file, head)
+    if detected is None:
+        if declared not in MIME_TYPES:
+            raise PreflightError(
+                'unsupported_type',
+                'Type de fichier non pris en charge.',
+                f"Formats acceptés : {', '.join(sorted(MIME_TYPES))}.",
+                status_code=415
+            )
+        raise PreflightError(
+            'type_mismatch',
+            f'Le contenu du fichier ne correspond pas à un fichier {declared}.',
+            'Le fichier est peut-être corrompu ou mal nommé.',
+            status_code=415
+        )
+
+    if detected == TEXT:
+        extension = declared if declared in TEXT_LIKE_EXTENSIONS else '.txt'
+    else:
+        extension = detected if EQUIVALENT_EXTENSIONS.get(declared, declared) != detected else declared
+    if extension != declared:
+        logger.info(f"🔀 Extension corrigée d'après le contenu: {file.name} → {stem}{extension}")
+        file.name = f"{stem}{extension}"
+
+    result = {
+        'extension': extension,
+        'mime_type': MIME_TYPES[extension],
+        'page_count': None,
+        'has_text': None,
+        'text_tokens': None,
+        'image_count': 0,
+        'image_size': None,
+    }
+    try:
+        if extension == '.pdf':
+            result.update(_inspect_pdf(file))
+        elif extension in ('.docx', '.pptx'):
+            result.update(_inspect_office(file, extension))
+        elif extension in TEXT_LIKE_EXTENSIONS:
+            result['has_text'] = _has_text(file, head)
+            result['text_tokens'] = _estimate_tokens(file.size)
+        elif extension in IMAGE_EXTENSIONS:
+            result.update(_inspect_image(file, extension))
+    finally:
+        file.seek(0)
+
+    if result['has_text'] is False and extension != '.pdf':
+        raise PreflightError(
+            'no_extractable_text',
+            'Le document ne contient aucun texte exploitable.',
+            'Vérifiez le fichier ou envoyez une version contenant le texte du cours.'
+        )
+    logger.info(f"🛂 Fichier vérifié en {(time.monotonic() - started) * 1000:.0f} ms: {file.name} ({extension}, {result['page_count'] or '-'} page(s))")
+    return result
+
+def sniff_extension(file, head):
+    """Extension correspondant au contenu, TEXT pour un fichier texte, None si inconnu"""
+    # La signature PDF peut être précédée de quelques octets parasites
+    if b'%PDF-' in head[:1024]:
+        return '.pdf'
+    for signature, extension in SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    if head.startswith(b'PK\x03\x04'):
+        try:
+            with zipfile.ZipFile(file) as archive:
+                names = set(archive.namelist())
+        except zipfile.BadZipFile:
+            return None
+        finally:
+            file.seek(0)
+        for extension, main_part in OFFICE_MAIN_PARTS.items():
+            if main_part in names:
+                return extension
+        return None
+    if b'\x00' not in head:
+        return TEXT
+    return None
+
+def _inspect_pdf(file):
+    if PdfReader is None:
+        return {}
+    try:
+        reader = PdfReader(file)
+        # Les PDF chiffrés sans mot de passe d'ouverture sont déchiffrés par pypdf
+        page_count = len(reader.pages)
+    except Exception as e:
+        if FileNotDecryptedError is not None and isinstance(e, FileNotDecryptedError):
+            raise PreflightError(
+                'encrypted_pdf',
+                'Ce PDF est protégé par un mot de passe.',
+                'Retirez la protection du document avant de l\'envoyer.'
+            )
+        raise PreflightError('corrupt_file', 'Ce PDF est illisible ou corrompu.', str(e)[:200])
+    if page_count == 0:
+        raise PreflightError('empty_document', 'Ce PDF ne contient aucune page.')
+
+    # Un PDF scanné (sans texte) reste accepté : le fichier est alors envoyé tel quel
+    stride = max(1, page_count // PDF_SAMPLE_PAGES)
+    sampled = list(range(0, page_count, stride))[:PDF_SAMPLE_PAGES]
+    text_length = image_count = 0
+    for index in sampled:
+        try:
+            page = reader.pages[index]
+            text_length += len((page.extract_text() or '').strip())
+            image_count += _count_page_images(page)
+        except Exception:
+            continue
+    # Extrapolation de l'échantillon à tout le document
+    scale = page_count / len(sampled)
+    return {
+        'page_count': page_count,
+        'has_text': text_length > 0,
+        'text_tokens': int(_estimate_tokens(text_length) * scale),
+        'image_count': round(image_count * scale),
+    }
+
+def _estimate_tokens(length):
+    """Même estimation que extraction.estimate_tokens (~4 caractères par token), d'après une longueur"""
+    return (length + 3) // 4
+
+def _count_page_images(page):
+    resources = page.get('/Resources')
+    xobjects = resources.get_object().get('/XObject') if resources else None
+    if not xobjects:
+        return 0
+    return sum(1 for xobject in xobjects.get_object().values() if xobject.get_object().get('/Subtype') == '/Image')
+
+def _inspect_office(file, extension):
+    """Texte et images du document Word, diapositives d'une présentation"""
+    try:
+        with zipfile.ZipFile(file) as archive:
+            names = archive.namelist()
+            media_prefix = 'word/media/' if extension == '.docx' else 'ppt/media/'
+            image_count = sum(1 for name in names if name.startswith(media_prefix))
+            if extension == '.docx':
+                text_length = _xml_text_length(archive.read(OFFICE_MAIN_PARTS['.docx']), b'<w:t')
+                page_count = None
+            else:
+                slides = [name for name in names if name.startswith('ppt/slides/slide') and name.endswith('.xml')]
+                if not slides:
+                    raise PreflightError('empty_document', 'Cette présentation ne contient aucune diapositive.')
+                text_length = sum(_xml_text_length(archive.read(name), b'<a:t') for name in slides)
+                page_count = len(slides)
+            return {
+                'page_count': page_count,
+                'has_text': text_length > 0,
+                'text_tokens': _estimate_tokens(text_length),
+                'image_count': image_count,
+            }
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise PreflightError('corrupt_file', 'Ce document est illisible ou corrompu.', str(e)[:200])
+
+def _xml_text_length(data, tag):
+    """Longueur du texte (espaces exclus en bordure) des éléments `tag` (ex. <w:t>)"""
+    length = 0
+    position = data.find(tag)
+    while position != -1:
+        end = position + len(tag)
+        if data[end:end + 1] in (b'>', b' '):
+            start = data.find(b'>', end) + 1
+            end = data.find(b'<', start)
+            if start:
+                length += len(data[start:end].strip())
+        position = data.find(tag, end)
+    return length
+
+def _has_text(file, head):
+    if head.strip():
+        return True
+    # Début blanc : parcourir le reste du fichier jusqu'au premier caractère visible
+    file.seek(len(head))
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        if chunk.strip():
+            return True
+    return False
+
+def _inspect_image(file, extension):
+    # Sans Pillow (ou sans prise en charge du WebP), l'image est transmise sans contrôle
+    if Image is None or (extension == '.webp' and '.webp' not in Image.registered_extensions()):
+        return {'image_count': 1}
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except Exception as e:
+        raise PreflightError('corrupt_file', 'Cette image est illisible ou corrompue.', str(e)[:200])
+    if not width or not height:
+        raise PreflightError('corrupt_file', 'Cette image est vide.')
+    return {'image_count': 1, 'image_size': (width, height)}
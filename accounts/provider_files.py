@@ -0,0 +1,230 @@
+"""
+Cache des fichiers uploadés chez le fournisseur IA (hash de contenu -> file_id)
+"""
+import os
+import time
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import ProviderFile
+
+logger = logging.getLogger(__name__)
+
+# Intervalle de vérification d'un upload du même contenu en cours ailleurs
+UPLOAD_POLL_SECONDS = 0.25
+# Réservations tentées avant d'abandonner quand le même contenu est uploadé ailleurs
+RESERVE_ATTEMPTS = 3
+
+def get_upload_name(name):
+    """
+    Nom du fichier chez le fournisseur : préfixé par AI_FILE_NAME_PREFIX pour que le
+    balayage ne considère comme orphelins que les fichiers uploadés par l'application
+    """
+    return f"{settings.AI_FILE_NAME_PREFIX}{os.path.basename(name)}"
+
+class ProviderFileCache:
+    """
+    Réutilise les fichiers déjà uploadés chez le fournisseur pour un même contenu.
+    Les entrées expirent après `ttl_seconds` sans utilisation et les moins
+    récemment utilisées sont supprimées au-delà de `max_entries`. Une entrée
+    utilisée depuis moins de `grace_seconds` n'est jamais supprimée : une
+    génération en cours peut encore s'en servir.
+    """
+
+    def __init__(self, ttl_seconds=None, max_entries=None, grace_seconds=None):
+        self.ttl = timedelta(seconds=ttl_seconds if ttl_seconds is not None else settings.AI_FILE_CACHE_TTL_SECONDS)
+        self.max_entries = max_entries if max_entries is not None else settings.AI_FILE_CACHE_MAX_ENTRIES
+        self.grace = timedelta(seconds=grace_seconds if grace_seconds is not None else settings.AI_FILE_SWEEP_GRACE_SECONDS)
+
+    def acquire(self, client, file_path, content_hash):
+        """Retourne le file_id distant pour ce contenu, en uploadant le fichier si nécessaire"""
+        for _ in range(RESERVE_ATTEMPTS):
+            file_id = self._reuse(client, content_hash)
+            if file_id:
+                return file_id
+            # Réserver la ligne avant l'upload : si le worker meurt pendant l'upload,
+            # le balayage retrouvera le fichier distant comme orphelin
+            reserved_at = self._reserve(content_hash)
+            if reserved_at is not None:
+                break
+        else:
+            raise Exception("Le fichier est déjà en cours d'upload vers le fournisseur, réessayez plus tard")
+
+        logger.info(f"📤 Upload du fichier vers le fournisseur...")
+        try:
+            with open(file_path, 'rb') as upload_handle:
+                uploaded_file = client.files.create(file=(get_upload_name(file_path), upload_handle), purpose='assistants')
+        except Exception:
+            # Libérer la réservation : la prochaine demande (nouvel essai du job) uploade sans attendre
+            ProviderFile.objects.filter(content_hash=content_hash, status='uploading', last_used_at=reserved_at).delete()
+            raise
+
+        now = timezone.now()
+        completed = ProviderFile.objects.filter(content_hash=content_hash, status='uploading', last_used_at=reserved_at).update(
+            file_id=uploaded_file.id,
+            status='ready',
+            size_bytes=os.path.getsize(file_path),
+            last_used_at=now,
+            expires_at=now + self.ttl,
+        )
+        if completed:
+            logger.info(f"✅ Fichier uploadé et mis en cache avec l'ID: {uploaded_file.id}")
+        else:
+            # Réservation reprise entre-temps : le fichier sert à cet appel, le balayage le supprimera
+            logger.warning(f"⚠️ Fichier uploadé sans mise en cache (réservation reprise): {uploaded_file.id}")
+
+        self.evict(client)
+        return uploaded_file.id
+
+    def _reuse(self, client, content_hash):
+        """file_id d'un fichier prêt pour ce contenu (après l'éventuel upload en cours ailleurs), sinon None"""
+        now = timezone.now()
+        entry = ProviderFile.objects.filter(content_hash=content_hash, status='ready', expires_at__gt=now).first()
+        if entry is None:
+            entry = self._wait_for_upload(content_hash)
+        if entry is not None:
+            now = timezone.now()
+            # UPDATE conditionnel : l'entrée a pu être évincée (et le fichier supprimé) entre-temps
+            reused = ProviderFile.objects.filter(id=entry.id, status='ready', file_id=entry.file_id).update(
+                last_used_at=now,
+                expires_at=now + self.ttl
+            )
+            if reused:
+                logger.info(f"♻️ Fichier déjà présent chez le fournisseur, upload évité: {entry.file_id}")
+                return entry.file_id
+
+        # Entrée expirée : supprimer l'ancien fichier distant avant de réuploader
+        expired = ProviderFile.objects.filter(content_hash=content_hash, status='ready', expires_at__lte=now).first()
+        if expired is not None:
+            forget_entry(client, expired)
+        return None
+
+    def _reserve(self, content_hash):
+        """
+        Crée la ligne 'uploading' de ce contenu et retourne son horodatage, ou None si
+        un autre processus l'a réservée (il uploade : attendre son résultat). Une
+        réservation abandonnée depuis AI_UPLOAD_PIPELINE_WAIT_SECONDS est reprise.
+        """
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                return ProviderFile.objects.create(content_hash=content_hash, status='uploading', file_id='').last_used_at
+        except IntegrityError:
+            pass
+        stale_before = now - timedelta(seconds=settings.AI_UPLOAD_PIPELINE_WAIT_SECONDS)
+        taken_over = ProviderFile.objects.filter(content_hash=content_hash, status='uploading', last_used_at__lt=stale_before).update(
+            file_id='',
+            last_used_at=now
+        )
+        return now if taken_over else None
+
+    def _wait_for_upload(self, content_hash):
+        """
+        Attend la fin d'un upload du même contenu déjà en cours (upload en pipeline
+        lancé à la réception du fichier, voir accounts.upload_pipeline), au plus
+        AI_UPLOAD_PIPELINE_WAIT_SECONDS après son début. Retourne l'entrée prête ou None.
+        """
+        deadline = time.monotonic() + settings.AI_UPLOAD_PIPELINE_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            entry = ProviderFile.objects.filter(content_hash=content_hash).first()
+            if entry is None:
+                return None
+            if entry.status == 'ready':
+                return entry if entry.expires_at and entry.expires_at > timezone.now() else None
+            if entry.last_used_at < timezone.now() - timedelta(seconds=settings.AI_UPLOAD_PIPELINE_WAIT_SECONDS):
+                return None
+            time.sleep(UPLOAD_POLL_SECONDS)
+        return None
+
+    def invalidate(self, client, content_hash):
+        """Oublie (et supprime chez le fournisseur) le fichier associé à ce contenu"""
+        entry = ProviderFile.objects.filter(content_hash=content_hash).first()
+        if entry is None:
+            return False
+        delete_remote_file(client, entry.file_id)
+        entry.delete()
+        return True
+
+    def evict(self, client):
+        """Supprime les fichiers les moins récemment utilisés au-delà de max_entries"""
+        overflow = list(
+            ProviderFile.objects.filter(status='ready')
+            .order_by('-last_used_at')[self.max_entries:]
+        )
+        used_before = timezone.now() - self.grace
+        evicted = sum(1 for entry in overflow if forget_entry(client, entry, used_before))
+        if evicted:
+            logger.info(f"🧹 {evicted} fichier(s) distant(s) évincé(s) (LRU)")
+        return evicted
+
+def forget_entry(client, entry, used_before=None):
+    """
+    Supprime l'entrée du cache puis son fichier distant, sauf si une génération
+    l'a réutilisée entre-temps (last_used_at modifié depuis la lecture de `entry`,
+    ou postérieur à `used_before`). Retourne True si l'entrée a été supprimée.
+    """
+    rows = ProviderFile.objects.filter(id=entry.id, status=entry.status, last_used_at=entry.last_used_at)
+    if used_before is not None:
+        rows = rows.filter(last_used_at__lt=used_before)
+    deleted, _ = rows.delete()
+    if not deleted:
+        return False
+    delete_remote_file(client, entry.file_id)
+    return True
+
+def delete_remote_file(client, file_id):
+    """Supprime un fichier chez le fournisseur sans faire échouer l'appelant"""
+    if not file_id:
+        return False
+    try:
+        client.files.delete(file_id)
+        logger.info(f"🗑️ Fichier distant supprimé: {file_id}")
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Impossible de supprimer le fichier distant {file_id}: {e}")
+        return False
+
+def sweep_provider_files(client, grace_seconds=None, dry_run=False):
+    """
+    Supprime chez le fournisseur les fichiers expirés et les fichiers orphelins
+    (uploadés par un worker interrompu avant d'avoir enregistré leur ID). Seuls
+    les fichiers nommés avec AI_FILE_NAME_PREFIX (voir get_upload_name) peuvent
+    être orphelins : ceux des autres applications du compte ne sont jamais touchés.
+    Les fichiers plus récents que `grace_seconds`, et les entrées utilisées
+    depuis moins longtemps, sont laissés aux générations en cours.
+    Retourne un dict avec le nombre de fichiers expirés et orphelins.
+    """
+    now = timezone.now()
+    grace = timedelta(seconds=grace_seconds if grace_seconds is not None else settings.AI_FILE_SWEEP_GRACE_SECONDS)
+    result = {'expired': 0, 'orphaned': 0}
+
+    for entry in ProviderFile.objects.filter(status='ready', expires_at__lte=now, last_used_at__lt=now - grace):
+        if dry_run:
+            result['expired'] += 1
+        elif forget_entry(client, entry, now - grace):
+            result['expired'] += 1
+
+    # Réservations d'uploads jamais terminés
+    if not dry_run:
+        ProviderFile.objects.filter(status='uploading', last_used_at__lt=now - grace).delete()
+
+    if not settings.AI_FILE_NAME_PREFIX:
+        # Sans préfixe, impossible de distinguer les fichiers de l'application
+        logger.info(f"🧹 Balayage des fichiers distants: {result['expired']} expiré(s), orphelins ignorés (AI_FILE_NAME_PREFIX vide)")
+        return result
+
+    known_ids = set(ProviderFile.objects.exclude(file_id='').values_list('file_id', flat=True))
+    for remote_file in client.files.list(purpose='assistants'):
+        if not (getattr(remote_file, 'filename', None) or '').startswith(settings.AI_FILE_NAME_PREFIX):
+            continue
+        created_at = datetime.fromtimestamp(remote_file.created_at, tz=dt_timezone.utc)
+        if remote_file.id in known_ids or created_at > now - grace:
+            continue
+        result['orphaned'] += 1
+        if not dry_run:
+            delete_remote_file(client, remote_file.id)
+
+    logger.info(f"🧹 Balayage des fichiers distants: {result['expired']} expiré(s), {result['orphaned']} orphelin(s)")
+    return result
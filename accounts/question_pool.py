@@ -0,0 +1,91 @@
+"""
+Réserve de questions par document : les générations des utilisateurs connectés
+produisent plus de questions que demandé, le surplus est gardé (Question.in_pool)
+et servi instantanément aux nouvelles leçons et aux reprises avec de nouvelles
+questions. Un remplissage en arrière-plan est mis en file sous un seuil.
+"""
+import logging
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+from .models import GenerationJob, Question
+from .generation_jobs import enqueue_generation_job
+
+logger = logging.getLogger(__name__)
+
+# Nombre de questions existantes rappelées au modèle lors d'un remplissage
+REFILL_AVOID_LIMIT = 30
+
+def get_pool_extra(question_count, user=None):
+    """Questions à générer en plus pour la réserve (utilisateurs connectés seulement)"""
+    if user is None or settings.QUESTION_POOL_FACTOR <= 1:
+        return 0
+    extra = int(question_count * (settings.QUESTION_POOL_FACTOR - 1))
+    return max(0, min(extra, settings.QUESTION_POOL_MAX_GENERATION - question_count))
+
+def get_pool_size(document):
+    return Question.objects.filter(document=document, in_pool=True).count()
+
+def draw_pool_questions(document, lesson, count, difficulty=None):
+    """
+    Attribue à la leçon jusqu'à `count` questions de la réserve, celles de la
+    difficulté demandée en premier. Retourne le nombre de questions attribuées.
+    L'UPDATE conditionnel (in_pool=True) empêche deux tirages concurrents de
+    prendre la même question.
+    """
+    drawn = 0
+    while drawn < count:
+        pool = Question.objects.filter(document=document, in_pool=True)
+        if difficulty:
+            pool = pool.annotate(
+                other_difficulty=Case(When(difficulty=difficulty, then=Value(0)), default=Value(1), output_field=IntegerField())
+            ).order_by('other_difficulty', 'created_at', 'id')
+        else:
+            pool = pool.order_by('created_at', 'id')
+        ids = list(pool.values_list('id', flat=True)[:count - drawn])
+        if not ids:
+            break
+        drawn += Question.objects.filter(id__in=ids, in_pool=True).update(in_pool=False, lesson=lesson)
+
+    logger.info(f"🎲 {drawn}/{count} question(s) tirée(s) de la réserve du document {document.id}")
+    return drawn
+
+def schedule_pool_refill(document):
+    """
+    Met en file un remplissage de la réserve si elle est sous le seuil
+    (QUESTION_POOL_REFILL_THRESHOLD) et qu'aucun remplissage n'est déjà prévu.
+    Retourne le job créé ou None.
+    """
+    if document.user_id is None or settings.QUESTION_POOL_FACTOR <= 1:
+        return None
+    if get_pool_size(document) >= settings.QUESTION_POOL_REFILL_THRESHOLD:
+        return None
+    if GenerationJob.objects.filter(document=document, kind='pool_refill', status__in=['queued', 'running']).exists():
+        return None
+
+    # Reprendre les paramètres de la dernière génération du document
+    last_job = GenerationJob.objects.filter(document=document, kind='lesson').order_by('-created_at').first()
+    return enqueue_generation_job(
+        document,
+        document.title,
+        user=document.user,
+        question_count=settings.QUESTION_POOL_REFILL_SIZE,
+        difficulty=last_job.difficulty if last_job else 'medium',
+        education_level=last_job.education_level if last_job else '',
+        instructions=last_job.instructions if last_job else '',
+        kind='pool_refill'
+    )
+
+def build_refill_instructions(document, instructions=''):
+    """Instructions d'un remplissage : ne pas reprendre les questions déjà générées pour le document"""
+    existing = list(
+        Question.objects.filter(document=document)
+        .order_by('-created_at')
+        .values_list('question_text', flat=True)[:REFILL_AVOID_LIMIT]
+    )
+    if not existing:
+        return instructions
+    return '\n'.join(filter(None, [
+        instructions,
+        "Ne reprends aucune de ces questions déjà posées :",
+        *(f"- {text}" for text in existing)
+    ]))
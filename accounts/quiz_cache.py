@@ -0,0 +1,132 @@
+"""
+Cache des quiz générés, indexé par le SHA-256 du fichier et les paramètres de génération
+"""
+import json
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import QuizCacheEntry
+
+logger = logging.getLogger(__name__)
+
+HITS_COUNTER_KEY = 'quiz_cache:hits'
+MISSES_COUNTER_KEY = 'quiz_cache:misses'
+
+def normalize_instructions(instructions):
+    """Normalise les instructions (casse et espaces) pour que des variantes triviales partagent la même entrée"""
+    if not instructions:
+        return ''
+    return ' '.join(instructions.lower().split())
+
+def build_cache_key(file_hash, question_count, difficulty, education_level, instructions):
+    """Clé de cache : SHA-256 du hash du fichier et des paramètres de génération"""
+    raw = '|'.join([
+        file_hash,
+        str(question_count),
+        difficulty or '',
+        education_level or '',
+        normalize_instructions(instructions),
+    ])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def get_cached_questions(file_hash, question_count, difficulty, education_level, instructions):
+    """Retourne les questions en cache pour ces paramètres, ou None"""
+    cache_key = build_cache_key(file_hash, question_count, difficulty, education_level, instructions)
+    entry = QuizCacheEntry.objects.filter(cache_key=cache_key).first()
+
+    max_age = timedelta(days=settings.QUIZ_CACHE_MAX_AGE_DAYS)
+    if entry is not None and entry.created_at < timezone.now() - max_age:
+        entry.delete()
+        entry = None
+
+    if entry is None:
+        _increment_counter(MISSES_COUNTER_KEY)
+        return None
+
+    QuizCacheEntry.objects.filter(id=entry.id).update(
+        hit_count=F('hit_count') + 1,
+        last_hit_at=timezone.now()
+    )
+    _increment_counter(HITS_COUNTER_KEY)
+    logger.info(f"🎯 Quiz trouvé en cache ({file_hash[:12]}..., {question_count} questions)")
+    return entry.questions
+
+def store_cached_questions(file_hash, question_count, difficulty, education_level, instructions, questions):
+    """Enregistre les questions générées puis applique la politique d'éviction"""
+    if not questions:
+        return
+    cache_key = build_cache_key(file_hash, question_count, difficulty, education_level, instructions)
+    try:
+        with transaction.atomic():
+            QuizCacheEntry.objects.create(
+                cache_key=cache_key,
+                file_hash=file_hash,
+                question_count=question_count,
+                difficulty=difficulty or '',
+                education_level=education_level or '',
+                instructions=normalize_instructions(instructions),
+                questions=questions,
+                size_bytes=len(json.dumps(questions, ensure_ascii=False).encode('utf-8')),
+            )
+    except IntegrityError:
+        # Une génération concurrente a déjà rempli cette entrée
+        return
+    evict_quiz_cache()
+
+def evict_quiz_cache():
+    """
+    Supprime les entrées trop anciennes, puis les moins récemment utilisées
+    jusqu'à respecter les limites de nombre d'entrées et de taille totale.
+    Retourne le nombre d'entrées supprimées.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.QUIZ_CACHE_MAX_AGE_DAYS)
+    deleted, _ = QuizCacheEntry.objects.filter(created_at__lt=cutoff).delete()
+
+    entries = QuizCacheEntry.objects.order_by('-last_hit_at')
+
+    overflow_ids = list(entries.values_list('id', flat=True)[settings.QUIZ_CACHE_MAX_ENTRIES:])
+    if overflow_ids:
+        deleted += QuizCacheEntry.objects.filter(id__in=overflow_ids).delete()[0]
+
+    total_size = entries.aggregate(total=Sum('size_bytes'))['total'] or 0
+    if total_size > settings.QUIZ_CACHE_MAX_BYTES:
+        # Parcourir du plus récent au plus ancien et supprimer ce qui dépasse le budget
+        kept_size = 0
+        evicted_ids = []
+        for entry_id, size_bytes in entries.values_list('id', 'size_bytes'):
+            kept_size += size_bytes
+            if kept_size > settings.QUIZ_CACHE_MAX_BYTES:
+                evicted_ids.append(entry_id)
+        deleted += QuizCacheEntry.objects.filter(id__in=evicted_ids).delete()[0]
+
+    if deleted:
+        logger.info(f"🧹 {deleted} entrée(s) du cache de quiz supprimée(s)")
+    return deleted
+
+def get_quiz_cache_stats():
+    """Retourne les compteurs hit/miss (partagés par tous les processus via le cache Django) et la taille du cache"""
+    aggregates = QuizCacheEntry.objects.aggregate(total_size=Sum('size_bytes'), total_hits=Sum('hit_count'))
+    hits = cache.get(HITS_COUNTER_KEY, 0)
+    misses = cache.get(MISSES_COUNTER_KEY, 0)
+    lookups = hits + misses
+    return {
+        'entries': QuizCacheEntry.objects.count(),
+        'size_bytes': aggregates['total_size'] or 0,
+        'total_hits': aggregates['total_hits'] or 0,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+    }
+
+def _increment_counter(key):
+    # cache.add n'écrase pas une valeur existante : initialise le compteur sans course
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
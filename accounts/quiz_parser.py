@@ -0,0 +1,173 @@
+"""
+Parsing incrémental de la réponse du modèle : extrait chaque question du
+tableau {"questions": [...]} dès que son objet JSON est refermé
+"""
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUESTIONS_ARRAY_PATTERN = re.compile(r'"questions"\s*:\s*\[')
+# Tableau renvoyé sans l'objet englobant, éventuellement dans un bloc markdown
+BARE_ARRAY_PATTERN = re.compile(r'^\s*(?:```(?:json)?\s*)?\[')
+# Début d'objet question, utilisé pour se resynchroniser après une chaîne cassée
+QUESTION_START_PATTERN = re.compile(r'\{\s*"question_text"')
+TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+SINGLE_QUOTED_KEY_PATTERN = re.compile(r"'([^']*)'\s*:")
+SINGLE_QUOTED_VALUE_PATTERN = re.compile(r":\s*'([^']*)'")
+# Corrections appliquées dans l'ordre aux objets illisibles : virgules finales, clés puis valeurs entre guillemets simples
+REPAIRS = [
+    (TRAILING_COMMA_PATTERN, r'\1'),
+    (SINGLE_QUOTED_KEY_PATTERN, r'"\1":'),
+    (SINGLE_QUOTED_VALUE_PATTERN, r': "\1"'),
+]
+DIFFICULTIES = ('easy', 'medium', 'hard')
+
+def is_complete_question(question):
+    """Vérifie qu'un objet a la forme attendue d'une question QCM"""
+    if not isinstance(question, dict):
+        return False
+    if not isinstance(question.get('question_text'), str) or not question['question_text'].strip():
+        return False
+    answers = question.get('answers')
+    if not isinstance(answers, list) or len(answers) < 2:
+        return False
+    if not all(isinstance(answer, dict) and isinstance(answer.get('text'), str) and 'is_correct' in answer for answer in answers):
+        return False
+    # Au moins une bonne réponse
+    return any(answer['is_correct'] is True for answer in answers)
+
+def parse_questions(content):
+    """
+    Parse une réponse complète du modèle. Retourne (questions, parser) : les
+    questions bien formées et le parser, dont `finished` indique si le tableau
+    a été refermé (False si la sortie est tronquée) et `rejected` le nombre
+    d'objets écartés.
+    """
+    parser = IncrementalQuestionParser()
+    questions = parser.feed(content)
+    return questions, parser
+
+class IncrementalQuestionParser:
+    """
+    Reçoit la sortie du modèle morceau par morceau (feed) et retourne les
+    questions complètes au fur et à mesure. Seul l'objet en cours de
+    réception est conservé en mémoire.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.position = 0
+        self.in_array = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+        self.resyncing = False
+        self.rejected = 0
+
+    def feed(self, text):
+        """Ajoute un morceau de sortie et retourne la liste des questions terminées"""
+        if self.finished or not text:
+            return []
+
+        self.buffer += text
+        if not self.in_array:
+            match = QUESTIONS_ARRAY_PATTERN.search(self.buffer) or BARE_ARRAY_PATTERN.match(self.buffer)
+            if match is None:
+                return []
+            self.buffer = self.buffer[match.end():]
+            self.position = 0
+            self.in_array = True
+
+        questions = []
+        buffer = self.buffer
+        index = self.position
+        while index < len(buffer):
+            if self.resyncing:
+                match = QUESTION_START_PATTERN.search(buffer, index)
+                if match is None:
+                    # Conserver de quoi reconnaître un début de question coupé entre deux morceaux
+                    self.buffer = buffer[max(index, len(buffer) - 64):]
+                    self.position = 0
+                    return questions
+                self.resyncing = False
+                index = match.start()
+            char = buffer[index]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                elif char == '\n':
+                    # Retour à la ligne brut dans une chaîne : guillemet manquant, l'objet en
+                    # cours est perdu, reprendre à la question suivante
+                    logger.warning("⚠️ Chaîne JSON non fermée, question ignorée")
+                    self.rejected += 1
+                    self.in_string = False
+                    self.escaped = False
+                    self.depth = 0
+                    self.object_start = None
+                    self.resyncing = True
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                if self.depth == 0:
+                    self.object_start = index
+                self.depth += 1
+            elif char == '}' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    question = self._decode(buffer[self.object_start:index + 1])
+                    if question is not None:
+                        questions.append(question)
+                    self.object_start = None
+            elif char == ']' and self.depth == 0:
+                self.finished = True
+                index += 1
+                break
+            index += 1
+
+        # Ne garder que l'objet en cours de réception
+        if self.object_start is not None:
+            self.buffer = buffer[self.object_start:]
+            self.position = index - self.object_start
+            self.object_start = 0
+        else:
+            self.buffer = ''
+            self.position = 0
+
+        return questions
+
+    def _decode(self, raw):
+        question = _loads_with_repair(raw)
+        if question is None:
+            logger.warning(f"⚠️ Objet question illisible ignoré: {raw[:100]}")
+            self.rejected += 1
+            return None
+        if not is_complete_question(question):
+            logger.warning("⚠️ Question incomplète ignorée")
+            self.rejected += 1
+            return None
+        if question.get('difficulty') not in DIFFICULTIES:
+            question['difficulty'] = 'medium'
+        return question
+
+def _loads_with_repair(raw):
+    """json.loads d'un objet, puis après chaque correction successive"""
+    try:
+        return json.loads(raw)
+    except ValueError:
+        pass
+    repaired = raw
+    for pattern, replacement in REPAIRS:
+        repaired = pattern.sub(replacement, repaired)
+        try:
+            return json.loads(repaired)
+        except ValueError:
+            continue
+    return None
@@ -0,0 +1,113 @@
+"""
+Recherche BM25 dans les extraits d'un document, pour ne placer dans le prompt que
+les passages visés par les instructions personnalisées ("seulement le chapitre 2",
+"les formules"). Les fréquences des termes de chaque extrait sont enregistrées avec
+lui (DocumentChunk.terms) : l'index est construit une fois et resservi aux
+générations suivantes du même document.
+"""
+import re
+import math
+import logging
+import unicodedata
+from collections import Counter
+from django.conf import settings
+from .models import DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+# Paramètres BM25 usuels : saturation de la fréquence et normalisation par la longueur
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Mots outils et mots de consigne ("questions sur...", "focus on...") : ils ne
+# désignent aucune partie du document
+STOP_WORDS = frozenset("""
+    a au aux avec c ce ces cet cette d dans de des du elle en est et il j l la le les leur
+    lui n ne on ou par pas pour qu que qui s sa se ses son sont sur t un une y
+    uniquement seulement surtout principalement notamment partie parties porte portant
+    question questions quiz qcm concentre concentrer insiste insister cible cibler
+    the of and or on in to for about only mainly focus focusing
+""".split())
+
+NON_ALPHANUMERIC_PATTERN = re.compile(r'[^a-z0-9]+')
+# Numérotation des repères ("Page 3", "Section 2 - ", "(1/4)") : seul le titre éventuel est indexé
+LABEL_NUMBERING_PATTERN = re.compile(r'^(Page|Diapositive|Section|Texte)( \d+)?( - )?|\(\d+/\d+\)$')
+
+def tokenize(text):
+    """Termes d'un texte : minuscules sans accents, mots outils retirés, pluriels ramenés au singulier"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    terms = []
+    for word in NON_ALPHANUMERIC_PATTERN.sub(' ', text).split():
+        if word in STOP_WORDS or (len(word) < 2 and not word.isdigit()):
+            continue
+        if len(word) > 4 and word[-1] in 'sx':
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+def compute_terms(label, text):
+    """Fréquences des termes d'un extrait (repère compris, ex. titre de section)"""
+    title = LABEL_NUMBERING_PATTERN.sub('', label).strip()
+    return dict(Counter(tokenize(f"{title}\n{text}")))
+
+def ensure_terms(chunks):
+    """Calcule et enregistre les termes des extraits qui n'en ont pas encore (extraits antérieurs)"""
+    missing = [chunk for chunk in chunks if not chunk.terms]
+    for chunk in missing:
+        chunk.terms = compute_terms(chunk.label, chunk.text)
+    if missing:
+        DocumentChunk.objects.bulk_update([chunk for chunk in missing if chunk.pk], ['terms'])
+    return chunks
+
+def rank_chunks(chunks, query):
+    """Extraits classés par score BM25 décroissant pour `query` ; seuls ceux qui en contiennent un terme"""
+    query_terms = set(tokenize(query))
+    if not query_terms or not chunks:
+        return []
+
+    ensure_terms(chunks)
+    lengths = [sum(chunk.terms.values()) for chunk in chunks]
+    average_length = max(1, sum(lengths) / len(chunks))
+    document_frequency = Counter(term for chunk in chunks for term in query_terms if term in chunk.terms)
+
+    scored = []
+    for chunk, length in zip(chunks, lengths):
+        score = 0.0
+        for term in query_terms:
+            frequency = chunk.terms.get(term, 0)
+            if not frequency:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (len(chunks) - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+        if score > 0:
+            scored.append((score, chunk))
+    scored.sort(key=lambda item: (-item[0], item[1].position))
+    return scored
+
+def retrieve_chunks(chunks, query, token_budget):
+    """
+    Extraits les mieux classés pour `query` dans `token_budget`, dans l'ordre du
+    document. Les extraits bien en dessous du meilleur score sont écartés, sauf
+    pour atteindre AI_RETRIEVAL_MIN_TOKENS. Retourne None si aucun extrait ne
+    correspond (instructions sans rapport avec le contenu, ex. "questions difficiles").
+    """
+    scored = rank_chunks(chunks, query)
+    if not scored:
+        return None
+
+    threshold = scored[0][0] * settings.AI_RETRIEVAL_MIN_SCORE_RATIO
+    min_tokens = min(settings.AI_RETRIEVAL_MIN_TOKENS, token_budget)
+    selected = []
+    used = 0
+    for score, chunk in scored:
+        if score < threshold and used >= min_tokens:
+            break
+        if used + chunk.token_count > token_budget:
+            continue
+        selected.append(chunk)
+        used += chunk.token_count
+    if not selected:
+        return None
+    return sorted(selected, key=lambda chunk: chunk.position)
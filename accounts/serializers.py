@@ -47,7 +47,12 @@ class UserSerializer(serializers.ModelSerializer):
 class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
-        fields = ('id', 'title', 'file_type', 'created_at')
+        fields = (
+            'id', 'title', 'file_type', 'page_start', 'page_end',
+            # Profil calculé à l'upload : permet d'avertir avant une génération coûteuse
+            'size_bytes', 'page_count', 'image_count', 'estimated_tokens', 'has_text', 'content_hash',
+            'created_at'
+        )
 
 class AnswerSerializer(serializers.ModelSerializer):
     class Meta:
@@ -95,7 +100,7 @@ class LessonAttemptSerializer(serializers.ModelSerializer):
     def get_user_answers(self, obj):
         """Récupère les réponses de l'utilisateur pour cette tentative"""
         # Récupérer toutes les questions de la leçon
-        questions = Question.objects.filter(document=obj.lesson.document).order_by('id')
+        questions = Question.objects.filter(document=obj.lesson.document, in_pool=False).order_by('id')
         
         # Pour cette tentative, on récupère les réponses les plus récentes
         # car le système actuel ne stocke pas attempt_number dans UserAnswer
@@ -0,0 +1,15 @@
+"""
+Signaux du modèle Document
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import Document
+from .storage import release_document_file
+
+@receiver(post_delete, sender=Document)
+def release_file_on_document_delete(sender, instance, **kwargs):
+    """Supprime le blob une fois la dernière référence supprimée (après commit)"""
+    if instance.file:
+        file_name = instance.file.name
+        transaction.on_commit(lambda: release_document_file(file_name))
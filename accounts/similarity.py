@@ -0,0 +1,151 @@
+"""
+Détection des questions quasi identiques (paraphrases) par signatures MinHash :
+chaque question est réduite à ses mots porteurs de sens, découpée en trigrammes
+de caractères puis résumée par NUM_PERM minimums de hachage. Un index LSH (bandes
+de BAND_ROWS valeurs) limite la comparaison aux questions candidates. Deux questions
+dont les nombres diffèrent (calculs, dates) ne sont jamais des doublons.
+"""
+import re
+import struct
+import random
+import hashlib
+import unicodedata
+from django.conf import settings
+from django.db.models import Q
+from .models import Question
+
+NUM_PERM = 128
+BAND_ROWS = 2
+SHINGLE_SIZE = 3
+
+# Mots outils ignorés : seuls les termes du sujet distinguent deux questions
+STOP_WORDS = frozenset("""
+    a au aux avec c ce ces cet cette comment combien d dans de des du elle elles en est et
+    etait il ils j l la laquelle le lequel les lesquelles lesquels leur leurs lui n ne on ou
+    par parmi pas pour pourquoi qu que quel quelle quelles quels qui quoi s sa se ses son
+    sont suivant suivante suivantes suivants sur t un une y
+""".split())
+
+NON_ALPHANUMERIC_PATTERN = re.compile(r'[^a-z0-9]+')
+NUMBER_PATTERN = re.compile(r'\d+')
+
+# Permutations fixes : les signatures enregistrées restent comparables d'un processus à l'autre
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_random = random.Random(20240601)
+_PERMUTATIONS = [(_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+_SIGNATURE_FORMAT = f'<{NUM_PERM}I'
+
+def normalize_for_similarity(text):
+    """Minuscules sans accents ni ponctuation, mots outils retirés"""
+    from ai_service import question_key
+
+    text = unicodedata.normalize('NFKD', question_key(text))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    words = NON_ALPHANUMERIC_PATTERN.sub(' ', text).split()
+    return ' '.join(word for word in words if word not in STOP_WORDS) or ' '.join(words)
+
+def get_numbers(text):
+    return frozenset(NUMBER_PATTERN.findall(normalize_for_similarity(text)))
+
+def get_shingles(text):
+    normalized = normalize_for_similarity(text)
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized}
+    return {normalized[index:index + SHINGLE_SIZE] for index in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+def compute_signature(text):
+    """Signature MinHash (NUM_PERM entiers de 32 bits) du texte d'une question"""
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little') for shingle in get_shingles(text)]
+    return tuple(
+        min(((a * value + b) % _MERSENNE_PRIME) & _MAX_HASH for value in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+def pack_signature(signature):
+    return struct.pack(_SIGNATURE_FORMAT, *signature)
+
+def unpack_signature(data):
+    if not data or len(data) != struct.calcsize(_SIGNATURE_FORMAT):
+        return None
+    return struct.unpack(_SIGNATURE_FORMAT, bytes(data))
+
+def estimate_similarity(first, second):
+    """Estimation de l'indice de Jaccard entre deux signatures"""
+    return sum(1 for a, b in zip(first, second) if a == b) / NUM_PERM
+
+class SimilarityIndex:
+    """
+    Questions déjà connues (générées ou en base) indexées par bandes LSH.
+    Les textes des questions écartées comme doublons sont gardés dans `rejected`
+    pour les rappeler au modèle lors d'un complément.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = settings.QUESTION_DUPLICATE_THRESHOLD if threshold is None else threshold
+        self.texts = []
+        self.numbers = []
+        self.signatures = []
+        self.bands = {}
+        self.rejected = []
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, text, signature=None):
+        signature = signature or compute_signature(text)
+        position = len(self.texts)
+        self.texts.append(text)
+        self.numbers.append(get_numbers(text))
+        self.signatures.append(signature)
+        for band in self._iter_bands(signature):
+            self.bands.setdefault(band, []).append(position)
+
+    def find_duplicate(self, text, signature=None):
+        """Texte de la question connue la plus proche au-delà du seuil, ou None"""
+        signature = signature or compute_signature(text)
+        candidates = {position for band in self._iter_bands(signature) for position in self.bands.get(band, ())}
+        numbers = get_numbers(text)
+        best, best_score = None, self.threshold
+        for position in candidates:
+            if self.numbers[position] != numbers:
+                continue
+            score = estimate_similarity(signature, self.signatures[position])
+            if score >= best_score:
+                best, best_score = self.texts[position], score
+        return best
+
+    def add_if_new(self, text):
+        """Ajoute la question si elle n'est pas un quasi-doublon ; retourne True si elle est nouvelle"""
+        signature = compute_signature(text)
+        duplicate = self.find_duplicate(text, signature)
+        if duplicate is not None:
+            if duplicate not in self.rejected:
+                self.rejected.append(duplicate)
+            return False
+        self.add(text, signature)
+        return True
+
+    def _iter_bands(self, signature):
+        for start in range(0, NUM_PERM, BAND_ROWS):
+            yield start, signature[start:start + BAND_ROWS]
+
+def build_question_index(document):
+    """
+    Index des questions existantes du document (réserve comprise) et des
+    QUESTION_DUPLICATE_USER_LIMIT dernières questions des autres documents de
+    son propriétaire
+    """
+    index = SimilarityIndex()
+    scope = Q(document=document)
+    if document.user_id and settings.QUESTION_DUPLICATE_USER_LIMIT > 0:
+        user_questions = (
+            Question.objects.filter(document__user_id=document.user_id)
+            .exclude(document=document)
+            .order_by('-created_at')
+            .values_list('id', flat=True)[:settings.QUESTION_DUPLICATE_USER_LIMIT]
+        )
+        scope |= Q(id__in=list(user_questions))
+    for text, signature in Question.objects.filter(scope).values_list('question_text', 'signature'):
+        index.add(text, unpack_signature(signature))
+    return index
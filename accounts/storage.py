@@ -0,0 +1,148 @@
+"""
+Stockage des fichiers de documents adressé par contenu (dédupliqué).
+Chaque blob a un compteur de références (StoredBlob) : l'enregistrement d'un
+fichier et la libération par un Document supprimé le modifient sous le verrou
+de sa ligne, de sorte qu'un blob réutilisé par un upload concurrent n'est
+jamais supprimé entre la vérification et la suppression.
+"""
+import os
+import hashlib
+import logging
+import tempfile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.move import file_move_safe
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = 'blobs'
+
+def blob_name(content_hash, extension=''):
+    """Chemin relatif d'un blob : blobs/ab/cd/<sha256><ext>"""
+    return f"{BLOB_PREFIX}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{extension.lower()}"
+
+def content_hash_from_name(name):
+    """Retourne le SHA-256 encodé dans un nom de blob, ou '' pour un fichier hors du stockage adressé"""
+    if not name or not name.startswith(f"{BLOB_PREFIX}/"):
+        return ''
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return stem if len(stem) == 64 else ''
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Enregistre chaque fichier sous le SHA-256 de son contenu, dans une
+    arborescence répartie sur deux niveaux (blobs/ab/cd/...).
+    Un contenu déjà présent n'est pas réécrit : plusieurs Documents
+    partagent alors le même blob (voir release_document_file).
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Le nom final dépend du contenu : pas de suffixe aléatoire
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1]
+        tmp_dir = self.path(f"{BLOB_PREFIX}/tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # Écrire dans un fichier temporaire tout en calculant le hash (un seul passage)
+        sha256 = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    sha256.update(chunk)
+                    tmp_file.write(chunk)
+
+            target = blob_name(sha256.hexdigest(), extension)
+            target_path = self.path(target)
+
+            # Référence prise avant de regarder si le blob existe : une libération
+            # concurrente attend la fin de cette transaction et le trouve référencé
+            with transaction.atomic():
+                acquire_blob(target)
+                if os.path.exists(target_path):
+                    logger.info(f"♻️ Contenu déjà stocké, blob réutilisé: {target}")
+                    return target
+
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                file_move_safe(tmp_path, target_path, allow_overwrite=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(target_path, self.file_permissions_mode)
+                return target
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def get_document_storage():
+    """Stockage utilisé par Document.file"""
+    return document_storage
+
+document_storage = ContentAddressedStorage()
+
+def get_derived_names(storage, file_name):
+    """Fichiers écrits à côté d'un blob à partir de son contenu (<sha256>.<variante>.<ext>)"""
+    directory, basename = os.path.split(file_name)
+    stem = os.path.splitext(basename)[0]
+    try:
+        _, names = storage.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [
+        f"{directory}/{name}" if directory else name
+        for name in names
+        if name.startswith(f"{stem}.") and name != basename
+    ]
+
+def acquire_blob(name):
+    """Ajoute une référence au blob (verrouille sa ligne jusqu'à la fin de la transaction)"""
+    from .models import Document, StoredBlob
+
+    while not StoredBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1):
+        try:
+            with transaction.atomic():
+                # Documents enregistrés avant le comptage des références compris
+                StoredBlob.objects.create(name=name, ref_count=1 + Document.objects.filter(file=name).count())
+            return
+        except IntegrityError:
+            # Ligne créée au même instant par un autre upload : l'incrémenter
+            continue
+
+def release_document_file(file_name):
+    """
+    Retire une référence au blob et le supprime (avec ses fichiers dérivés) s'il
+    n'en a plus. Appelé après la suppression d'un Document (signal post_delete).
+    Décompte et suppression ont lieu sous le verrou de la ligne StoredBlob, que
+    l'enregistrement d'un même contenu doit aussi prendre (voir acquire_blob).
+    """
+    from .models import Document, StoredBlob
+
+    if not file_name:
+        return False
+
+    storage = Document._meta.get_field('file').storage
+    with transaction.atomic():
+        released = StoredBlob.objects.filter(name=file_name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        if not released and not StoredBlob.objects.filter(name=file_name).exists():
+            # Fichier enregistré avant le comptage des références
+            if Document.objects.filter(file=file_name).exists():
+                logger.info(f"🔗 Fichier encore référencé, conservé: {file_name}")
+                return False
+        elif StoredBlob.objects.filter(name=file_name, ref_count__gt=0).exists():
+            logger.info(f"🔗 Fichier encore référencé, conservé: {file_name}")
+            return False
+        StoredBlob.objects.filter(name=file_name).delete()
+
+        try:
+            storage.delete(file_name)
+            # Fichiers dérivés du blob (image préparée, PDF réduit à certaines pages)
+            for derived_name in get_derived_names(storage, file_name):
+                storage.delete(derived_name)
+            logger.info(f"🗑️ Fichier supprimé (dernière référence): {file_name}")
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Impossible de supprimer le fichier physique: {e}")
+            return False
@@ -1,3 +1,1703 @@
-from django.test import TestCase
+import io
+import os
+import json
+import re
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+import openai
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from django.utils import timezone
+from ai_service import OpenAIService
+from . import ai_providers
+from .ai_limiter import AIQueueTimeoutError, AISlot, get_job_queue_position
+from .ai_providers import CircuitBreaker, CircuitOpenError, ReplayProvider, call_with_retry, get_ai_provider
+from .extraction import extract_sections, select_chunks, split_into_chunks
+from .retrieval import compute_terms, retrieve_chunks
+from .ingestion import CHUNK_SIZE, build_image_data_url, compute_file_hash
+from .generation import create_ai_questions
+from .images import Image, get_vision_image, prepare_image, schedule_image_preparation
+from .generation_jobs import claim_next_job, enqueue_generation_job, process_next_job, record_heartbeat, requeue_stale_jobs, run_generation_job
+from .generation_runs import estimate_cost, summarize_generation_runs
+from .offline_questions import generate_offline_questions
+from .pdf_pages import PdfReader, PdfWriter, get_provider_file, get_source_hash
+from .preflight import PreflightError, inspect_upload
+from .document_profile import build_profile, get_prompt_tokens
+from .model_routing import get_model_stats, record_model_call, route_generation
+from .models import AIConcurrencyTicket, Document, GenerationJob, GenerationRun, Lesson, ProviderFile, Question, QuizCacheEntry, StoredBlob, User
+from .provider_files import ProviderFileCache, get_upload_name, sweep_provider_files
+from .question_pool import get_pool_extra, get_pool_size
+from .storage import document_storage
+from .similarity import SimilarityIndex, compute_signature, pack_signature, unpack_signature
+from .upload_pipeline import ChunkPipe, start_pipelined_upload
+from .quiz_parser import IncrementalQuestionParser, parse_questions
+from .quiz_cache import build_cache_key, get_cached_questions, store_cached_questions
 
-# Create your tests here.
+
+class FakeFilesAPI:
+    """Faux `client.files` d'OpenAI : garde les fichiers en mémoire"""
+
+    def __init__(self):
+        self.files = {}
+        self.created = 0
+        self.deleted = []
+
+    def create(self, file, purpose):
+        filename, file = file[:2] if isinstance(file, tuple) else (os.path.basename(file.name), file)
+        # Lire le fichier par blocs, comme le ferait un upload multipart en streaming
+        size = 0
+        for chunk in iter(lambda: file.read(64 * 1024), b''):
+            size += len(chunk)
+        self.created += 1
+        file_id = f"file-{self.created}"
+        self.files[file_id] = SimpleNamespace(id=file_id, created_at=int(time.time()), purpose=purpose, size=size, filename=filename)
+        return self.files[file_id]
+
+    def delete(self, file_id):
+        self.deleted.append(file_id)
+        self.files.pop(file_id, None)
+
+    def list(self, purpose=None):
+        return [f for f in self.files.values() if purpose is None or f.purpose == purpose]
+
+
+class FakeChatCompletions:
+    """Faux `client.chat.completions` renvoyant des questions valides"""
+
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        questions = [
+            {
+                "question_text": f"Question {index}",
+                "difficulty": "medium",
+                "answers": [
+                    {"text": "Bonne réponse", "is_correct": True},
+                    {"text": "Mauvaise réponse", "is_correct": False},
+                ]
+            }
+            for index in range(5)
+        ]
+        message = SimpleNamespace(content=json.dumps({"questions": questions}))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason='stop')])
+
+
+class FakeChatCompletionsWithUsage(FakeChatCompletions):
+    """Variante renvoyant aussi le champ `usage` (dont les tokens servis par le cache)"""
+
+    def __init__(self, usage):
+        super().__init__()
+        self.usage = usage
+
+    def create(self, **kwargs):
+        response = super().create(**kwargs)
+        response.usage = ai_providers.build_completion('', usage=self.usage).usage
+        return response
+
+
+class FakeClient:
+    def __init__(self, completions=None):
+        self.files = FakeFilesAPI()
+        self.chat = SimpleNamespace(completions=completions or FakeChatCompletions())
+
+
+@override_settings(QUESTION_POOL_FACTOR=1, GENERATION_JOB_MAX_ATTEMPTS=2)
+class GenerationJobTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user(username='eleve', email='eleve@example.com', password='secret', first_name='A', last_name='B')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def upload(self, question_count=5):
+        file = SimpleUploadedFile('cours.txt', 'La mitochondrie produit l\'énergie de la cellule.'.encode('utf-8'))
+        return self.api.post(reverse('upload_document'), {'file': file, 'question_count': question_count}, format='multipart')
+
+    def test_upload_is_queued_and_worker_creates_lesson(self):
+        response = self.upload()
+
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['job_id']
+        self.assertEqual((response.data['status'], response.data['queue_position']), ('queued', 1))
+        status_response = self.api.get(reverse('get_generation_job', args=[job_id]))
+        self.assertEqual((status_response.data['status'], status_response.data['lesson_id']), ('queued', None))
+
+        client = FakeClient()
+        with mock.patch('accounts.generation.OpenAIService', lambda **kwargs: OpenAIService(provider=client, **kwargs)):
+            self.assertTrue(process_next_job('worker-1'))
+        self.assertFalse(process_next_job('worker-1'))
+
+        status_response = self.api.get(reverse('get_generation_job', args=[job_id]))
+        self.assertEqual((status_response.data['status'], status_response.data['attempts']), ('done', 1))
+        lesson = self.user.lessons.get(id=status_response.data['lesson_id'])
+        self.assertEqual(lesson.total_questions, 5)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.quiz_count_today, 1)
+
+    @override_settings(GENERATION_JOB_RETRY_DELAY_SECONDS=0)
+    def test_queued_quiz_counts_toward_daily_quota(self):
+        self.assertEqual(self.upload().status_code, 202)
+
+        # Le quota n'est décompté qu'à la fin de la génération : le job en file compte déjà
+        self.assertEqual(self.upload().status_code, 403)
+        self.assertEqual(GenerationJob.objects.count(), 1)
+
+        with mock.patch('accounts.generation.create_ai_questions', side_effect=ValueError('réponse illisible')):
+            for worker_id in ('worker-1', 'worker-2'):
+                run_generation_job(claim_next_job(worker_id))
+        # Génération échouée : rien n'a été décompté, l'élève peut réessayer
+        self.assertEqual(self.upload().status_code, 202)
+
+    def test_job_status_is_private(self):
+        job_id = self.upload().data['job_id']
+        other = User.objects.create_user(username='autre', email='autre@example.com', password='secret', first_name='A', last_name='B')
+        self.api.force_authenticate(other)
+
+        self.assertEqual(self.api.get(reverse('get_generation_job', args=[job_id])).status_code, 403)
+        self.assertEqual(self.api.get(reverse('get_generation_job', args=[job_id + 1])).status_code, 404)
+
+    def test_failed_job_is_retried_then_marked_failed(self):
+        job_id = self.upload().data['job_id']
+
+        with mock.patch('accounts.generation.create_ai_questions', side_effect=ValueError('réponse illisible')):
+            first = run_generation_job(claim_next_job('worker-1'))
+            self.assertEqual((first.status, first.attempts, first.error), ('queued', 1, 'réponse illisible'))
+            # Nouvelle tentative différée de GENERATION_JOB_RETRY_DELAY_SECONDS
+            self.assertGreater(first.not_before, timezone.now() + timedelta(seconds=settings.GENERATION_JOB_RETRY_DELAY_SECONDS - 5))
+            self.assertIsNone(claim_next_job('worker-2'))
+            GenerationJob.objects.filter(id=job_id).update(not_before=timezone.now())
+            last = run_generation_job(claim_next_job('worker-2'))
+
+        self.assertEqual((last.id, last.status, last.attempts), (job_id, 'failed', 2))
+        self.assertIsNotNone(last.finished_at)
+        # Échec définitif : le document est supprimé et le quota n'est pas consommé
+        self.assertFalse(Document.objects.exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.quiz_count_today, 0)
+
+    @override_settings(GENERATION_JOB_STALE_SECONDS=60)
+    def test_abandoned_running_job_is_requeued_then_failed(self):
+        job_id = self.upload().data['job_id']
+        claim_next_job('hote:1:0')
+        GenerationJob.objects.filter(id=job_id).update(started_at=timezone.now() - timedelta(seconds=600), heartbeat_at=timezone.now() - timedelta(seconds=61))
+        # Worker vivant : son signe de vie empêche la remise en file, même après une longue génération
+        self.assertEqual(record_heartbeat('hote:1:'), 1)
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+        GenerationJob.objects.filter(id=job_id).update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        job = GenerationJob.objects.get(id=job_id)
+        self.assertEqual((job.status, job.worker_id), ('queued', ''))
+
+        # Seconde tentative abandonnée : plus de remise en file
+        self.assertEqual(claim_next_job('hote:2:0').id, job_id)
+        GenerationJob.objects.filter(id=job_id).update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(requeue_stale_jobs(), 0)
+        job = GenerationJob.objects.get(id=job_id)
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertFalse(Document.objects.exists())
+
+
+@override_settings(QUESTION_POOL_FACTOR=1, QUIZ_CACHE_MAX_ENTRIES=5000, QUIZ_CACHE_MAX_BYTES=10 * 1024 * 1024, QUIZ_CACHE_MAX_AGE_DAYS=30)
+class QuizCacheTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user(username='prof', email='prof@example.com', password='secret', first_name='A', last_name='B', is_premium=True)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def store(self, file_hash, question_count=5):
+        questions = [{'question_text': f'Question {index}', 'difficulty': 'medium', 'answers': []} for index in range(question_count)]
+        store_cached_questions(file_hash, question_count, 'medium', '', '', questions)
+        return QuizCacheEntry.objects.get(file_hash=file_hash)
+
+    def test_cache_key_covers_generation_parameters(self):
+        key = build_cache_key('a' * 64, 5, 'medium', 'lycee', 'Le chapitre 2')
+
+        variants = [
+            build_cache_key('b' * 64, 5, 'medium', 'lycee', 'Le chapitre 2'),
+            build_cache_key('a' * 64, 6, 'medium', 'lycee', 'Le chapitre 2'),
+            build_cache_key('a' * 64, 5, 'hard', 'lycee', 'Le chapitre 2'),
+            build_cache_key('a' * 64, 5, 'medium', 'college', 'Le chapitre 2'),
+            build_cache_key('a' * 64, 5, 'medium', 'lycee', 'Le chapitre 3'),
+        ]
+        self.assertNotIn(key, variants)
+        self.assertEqual(len(set(variants)), len(variants))
+        # Casse et espaces des instructions ne changent pas la clé
+        self.assertEqual(key, build_cache_key('a' * 64, 5, 'medium', 'lycee', '  le   CHAPITRE 2 '))
+        self.assertEqual(build_cache_key('a' * 64, 5, 'medium', '', None), build_cache_key('a' * 64, 5, 'medium', None, ''))
+
+    def test_identical_upload_is_served_from_cache(self):
+        client = FakeClient()
+        with mock.patch('accounts.generation.OpenAIService', lambda **kwargs: OpenAIService(provider=client, **kwargs)):
+            for _ in range(2):
+                file = SimpleUploadedFile('cours.txt', 'La mitochondrie produit l\'énergie de la cellule.'.encode('utf-8'))
+                self.assertEqual(self.api.post(reverse('upload_document'), {'file': file, 'question_count': 5}, format='multipart').status_code, 202)
+                self.assertTrue(process_next_job('worker-1'))
+
+        self.assertEqual(len(client.chat.completions.calls), 1)
+        self.assertEqual(list(GenerationRun.objects.order_by('id').values_list('outcome', flat=True)), ['success', 'cache_hit'])
+        self.assertEqual(QuizCacheEntry.objects.get().hit_count, 1)
+        # Le quiz en cache est recopié dans la nouvelle leçon : questions et réponses propres à celle-ci
+        first, second = self.user.lessons.order_by('id')
+        first_ids = set(first.questions.values_list('id', flat=True))
+        self.assertEqual(second.total_questions, 5)
+        self.assertTrue(first_ids.isdisjoint(second.questions.values_list('id', flat=True)))
+        self.assertEqual(
+            sorted(second.questions.values_list('question_text', flat=True)),
+            sorted(first.questions.values_list('question_text', flat=True))
+        )
+        for question in second.questions.all():
+            self.assertEqual(question.answers.filter(is_correct=True).count(), 1)
+
+    def test_expired_entry_is_a_miss(self):
+        entry = self.store('a' * 64)
+        QuizCacheEntry.objects.filter(id=entry.id).update(created_at=timezone.now() - timedelta(days=31))
+
+        self.assertIsNone(get_cached_questions('a' * 64, 5, 'medium', '', ''))
+        self.assertFalse(QuizCacheEntry.objects.exists())
+
+    @override_settings(QUIZ_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_entry_is_evicted(self):
+        oldest = self.store('a' * 64)
+        self.store('b' * 64)
+        QuizCacheEntry.objects.update(last_hit_at=timezone.now() - timedelta(hours=1))
+        # Le hit rafraîchit la plus ancienne entrée : c'est l'autre qui sort
+        self.assertIsNotNone(get_cached_questions('a' * 64, 5, 'medium', '', ''))
+        self.store('c' * 64)
+
+        self.assertEqual(sorted(QuizCacheEntry.objects.values_list('file_hash', flat=True)), ['a' * 64, 'c' * 64])
+        self.assertTrue(QuizCacheEntry.objects.filter(id=oldest.id).exists())
+
+    def test_entries_over_the_size_budget_are_evicted(self):
+        first = self.store('a' * 64)
+        QuizCacheEntry.objects.update(last_hit_at=timezone.now() - timedelta(hours=1))
+
+        with override_settings(QUIZ_CACHE_MAX_BYTES=first.size_bytes + 10):
+            self.store('b' * 64)
+
+        self.assertEqual(list(QuizCacheEntry.objects.values_list('file_hash', flat=True)), ['b' * 64])
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def test_shared_blob_is_kept_until_last_reference_is_deleted(self):
+        first = Document.objects.create(title='A', file=SimpleUploadedFile('cours.PDF', b'%PDF-1.4 identique'), file_type='.pdf')
+        second = Document.objects.create(title='B', file=SimpleUploadedFile('copie.pdf', b'%PDF-1.4 identique'), file_type='.pdf')
+        path = first.file.path
+        derived_path = os.path.splitext(path)[0] + '.vision.jpg'
+        with open(derived_path, 'wb') as f:
+            f.write(b'image preparee')
+
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(first.content_hash, os.path.splitext(os.path.basename(path))[0])
+        self.assertEqual(StoredBlob.objects.get(name=first.file.name).ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(StoredBlob.objects.get(name=second.file.name).ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(derived_path))
+        self.assertFalse(StoredBlob.objects.exists())
+
+    def test_blob_reused_by_pending_upload_survives_release(self):
+        document = Document.objects.create(title='A', file=SimpleUploadedFile('cours.pdf', b'%PDF-1.4 identique'), file_type='.pdf')
+        # Upload concurrent : blob réutilisé par le stockage, Document pas encore créé
+        name = document_storage.save('copie.pdf', ContentFile(b'%PDF-1.4 identique'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            document.delete()
+        self.assertTrue(document_storage.exists(name))
+
+        copy = Document.objects.create(title='B', file=name, file_type='.pdf')
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.delete()
+        self.assertFalse(document_storage.exists(name))
+
+
+class ProviderFileCacheTests(TestCase):
+    def setUp(self):
+        handle, self.file_path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(b'%PDF-1.4 contenu de test')
+        self.addCleanup(os.remove, self.file_path)
+        self.client = FakeClient()
+
+    def test_reuses_uploaded_file_for_same_content(self):
+        cache = ProviderFileCache(ttl_seconds=3600, max_entries=10)
+        first = cache.acquire(self.client, self.file_path, 'a' * 64)
+        second = cache.acquire(self.client, self.file_path, 'a' * 64)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.client.files.created, 1)
+
+    def test_expired_entry_is_uploaded_again(self):
+        cache = ProviderFileCache(ttl_seconds=3600, max_entries=10)
+        first = cache.acquire(self.client, self.file_path, 'a' * 64)
+        ProviderFile.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        second = cache.acquire(self.client, self.file_path, 'a' * 64)
+
+        self.assertNotEqual(first, second)
+        self.assertIn(first, self.client.files.deleted)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ProviderFileCache(ttl_seconds=3600, max_entries=2, grace_seconds=0)
+        oldest = cache.acquire(self.client, self.file_path, 'a' * 64)
+        cache.acquire(self.client, self.file_path, 'b' * 64)
+        cache.acquire(self.client, self.file_path, 'a' * 64)
+        cache.acquire(self.client, self.file_path, 'c' * 64)
+
+        self.assertEqual(ProviderFile.objects.count(), 2)
+        self.assertFalse(ProviderFile.objects.filter(content_hash='b' * 64).exists())
+        self.assertNotIn(oldest, self.client.files.deleted)
+
+    def test_entries_in_use_are_not_evicted(self):
+        cache = ProviderFileCache(ttl_seconds=3600, max_entries=1, grace_seconds=600)
+        first = cache.acquire(self.client, self.file_path, 'a' * 64)
+        # Entrée utilisée par une génération en cours : gardée malgré le dépassement
+        second = cache.acquire(self.client, self.file_path, 'b' * 64)
+        self.assertEqual(self.client.files.deleted, [])
+
+        ProviderFile.objects.filter(content_hash='a' * 64).update(last_used_at=timezone.now() - timedelta(seconds=601))
+        self.assertEqual(cache.evict(self.client), 1)
+        self.assertEqual(self.client.files.deleted, [first])
+        self.assertEqual(cache.acquire(self.client, self.file_path, 'b' * 64), second)
+
+    def test_evicted_entry_is_not_reused(self):
+        cache = ProviderFileCache(ttl_seconds=3600, max_entries=10)
+        first = cache.acquire(self.client, self.file_path, 'a' * 64)
+        entry = ProviderFile.objects.get(content_hash='a' * 64)
+
+        # Éviction entre la lecture de l'entrée (ici rendue par l'attente d'upload) et sa réutilisation
+        ProviderFile.objects.filter(id=entry.id).delete()
+        self.client.files.delete(first)
+
+        with mock.patch.object(ProviderFileCache, '_wait_for_upload', return_value=entry):
+            second = cache.acquire(self.client, self.file_path, 'a' * 64)
+        self.assertNotEqual(second, first)
+        self.assertIn(second, self.client.files.files)
+
+    def test_failed_upload_releases_its_reservation(self):
+        cache = ProviderFileCache(ttl_seconds=3600, max_entries=10)
+        with mock.patch.object(self.client.files, 'create', side_effect=ValueError('coupure')):
+            with self.assertRaises(ValueError):
+                cache.acquire(self.client, self.file_path, 'a' * 64)
+        self.assertFalse(ProviderFile.objects.exists())
+
+        # Nouvel essai immédiat : pas d'attente d'un upload qui n'aura jamais lieu
+        with mock.patch('accounts.provider_files.time.sleep', side_effect=AssertionError('attente inutile')):
+            file_id = cache.acquire(self.client, self.file_path, 'a' * 64)
+        self.assertEqual(ProviderFile.objects.get().file_id, file_id)
+
+    def test_concurrent_reservation_waits_for_the_other_upload(self):
+        cache = ProviderFileCache(ttl_seconds=3600, max_entries=10)
+        waits = []
+
+        def other_process_uploads(content_hash):
+            waits.append(content_hash)
+            if len(waits) == 1:
+                # L'autre processus réserve le contenu juste avant nous...
+                ProviderFile.objects.create(content_hash=content_hash, status='uploading', file_id='')
+                return None
+            # ... puis termine son upload
+            ProviderFile.objects.filter(content_hash=content_hash).update(status='ready', file_id='file-autre', expires_at=timezone.now() + timedelta(hours=1))
+            return ProviderFile.objects.get(content_hash=content_hash)
+
+        with mock.patch.object(ProviderFileCache, '_wait_for_upload', side_effect=other_process_uploads):
+            file_id = cache.acquire(self.client, self.file_path, 'a' * 64)
+
+        self.assertEqual(file_id, 'file-autre')
+        self.assertEqual(self.client.files.created, 0)
+
+    def test_sweep_deletes_expired_and_orphaned_files(self):
+        cache = ProviderFileCache(ttl_seconds=3600, max_entries=10)
+        expired = cache.acquire(self.client, self.file_path, 'a' * 64)
+        kept = cache.acquire(self.client, self.file_path, 'b' * 64)
+        used = cache.acquire(self.client, self.file_path, 'c' * 64)
+        ProviderFile.objects.filter(content_hash='a' * 64).update(
+            expires_at=timezone.now() - timedelta(seconds=1),
+            last_used_at=timezone.now() - timedelta(seconds=7200)
+        )
+        # Expirée mais réutilisée par une génération encore en cours
+        ProviderFile.objects.filter(content_hash='c' * 64).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        # Fichier uploadé par un worker interrompu avant l'enregistrement de son ID
+        with open(self.file_path, 'rb') as f:
+            orphan = self.client.files.create(file=(get_upload_name(self.file_path), f), purpose='assistants').id
+        self.client.files.files[orphan].created_at -= 7200
+        with open(self.file_path, 'rb') as f:
+            in_flight = self.client.files.create(file=(get_upload_name(self.file_path), f), purpose='assistants').id
+        # Fichier d'une autre application du même compte
+        with open(self.file_path, 'rb') as f:
+            foreign = self.client.files.create(file=f, purpose='assistants').id
+        self.client.files.files[foreign].created_at -= 7200
+
+        result = sweep_provider_files(self.client, grace_seconds=3600)
+
+        self.assertEqual(result, {'expired': 1, 'orphaned': 1})
+        self.assertEqual(set(self.client.files.files), {kept, used, in_flight, foreign})
+        self.assertIn(expired, self.client.files.deleted)
+
+
+class StreamingIngestionMemoryTests(TestCase):
+    """Pic mémoire (tracemalloc) de l'ingestion selon la taille du fichier"""
+
+    def _write_file(self, suffix, size):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        block = os.urandom(1024 * 1024)
+        with os.fdopen(handle, 'wb') as f:
+            for _ in range(size // len(block)):
+                f.write(block)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def _peak_memory(self, func):
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_hashing_memory_does_not_grow_with_file_size(self):
+        for size in (4 * 1024 * 1024, 32 * 1024 * 1024):
+            path = self._write_file('.pdf', size)
+            peak = self._peak_memory(lambda: compute_file_hash(path))
+            self.assertLess(peak, 3 * CHUNK_SIZE, f"{size} octets -> pic {peak}")
+
+    def test_document_generation_streams_file_to_provider(self):
+        for size in (4 * 1024 * 1024, 32 * 1024 * 1024):
+            path = self._write_file('.pdf', size)
+            service = OpenAIService()
+            service.client = FakeClient()
+
+            peak = self._peak_memory(lambda: service.generate_questions_from_document(path, 'Cours', question_count=5))
+
+            self.assertLess(peak, 2 * 1024 * 1024, f"{size} octets -> pic {peak}")
+            self.assertEqual(service.client.files.files, {})
+
+    def test_only_images_are_base64_encoded(self):
+        size = 8 * 1024 * 1024
+        path = self._write_file('.jpg', size)
+        encoded_size = 4 * size // 3
+
+        peak = self._peak_memory(lambda: build_image_data_url(path))
+
+        # Tampon base64 + chaîne finale, sans copie du fichier brut
+        self.assertLess(peak, 2 * encoded_size + 2 * CHUNK_SIZE)
+
+        service = OpenAIService()
+        service.client = FakeClient()
+        service.generate_questions_from_document(path, 'Photo', question_count=5)
+        self.assertEqual(service.client.files.created, 0)
+
+
+class ShardedCompletions:
+    """Faux `chat.completions` : autant de questions que demandé, numérotées dans chaque lot"""
+
+    def __init__(self, failures=None):
+        self.calls = []
+        self.failures = failures or {}
+        self.lock = threading.Lock()
+
+    def create(self, **kwargs):
+        prompt = json.dumps(kwargs['messages'], ensure_ascii=False)
+        count = int(re.search(r'Génère exactement (\d+) questions', prompt).group(1))
+        part = re.search(r'la partie (\d+)/\d+', prompt)
+        shard = int(part.group(1)) if part else 0
+        with self.lock:
+            self.calls.append(shard)
+            failure = self.failures.get(shard)
+            if failure:
+                self.failures[shard] = failure[1:]
+                raise failure[0]
+        questions = [
+            {
+                "question_text": f"{index + 1}. Que retient-on du point {shard * 100 + index + 1} du cours ?",
+                "difficulty": "medium",
+                "answers": [
+                    {"text": "Bonne réponse", "is_correct": True},
+                    {"text": "Mauvaise réponse", "is_correct": False},
+                ]
+            }
+            for index in range(count)
+        ]
+        message = SimpleNamespace(content=json.dumps({"questions": questions}))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason='stop')])
+
+
+# Un lot à la fois : le cache en base (SQLite) des tests supporte mal les écritures concurrentes
+@override_settings(AI_SHARD_SIZE=10, AI_MAX_PARALLEL_SHARDS=1, AI_RETRY_MAX_ATTEMPTS=3, AI_TOP_UP_MAX_ATTEMPTS=1)
+class ShardedGenerationTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('test', failure_threshold=10, window_seconds=60, cooldown_seconds=30)
+
+    def generate(self, completions, question_count=25):
+        # Même enveloppe que le fournisseur réel : reprise sur erreur et disjoncteur
+        client = SimpleNamespace(
+            files=ai_providers.ResilientProxy(FakeFilesAPI(), self.breaker, 'test.files'),
+            chat=ai_providers.ResilientProxy(SimpleNamespace(completions=completions), self.breaker, 'test.chat'),
+        )
+        with mock.patch('accounts.ai_providers.time.sleep'):
+            return OpenAIService(provider=client).generate_questions_from_document(
+                file_path='cours.txt', document_title='Cours', question_count=question_count, document_text='Texte du cours'
+            )
+
+    def test_question_count_is_split_into_balanced_shards(self):
+        service = OpenAIService(provider=FakeClient())
+
+        self.assertEqual(service._split_into_shards(25), [9, 8, 8])
+        self.assertEqual(service._split_into_shards(10), [10])
+        self.assertEqual(service._split_into_shards(40, shard_size=20), [20, 20])
+
+    def test_shards_are_merged_in_order_without_their_numbering(self):
+        completions = ShardedCompletions()
+
+        questions = self.generate(completions)
+
+        self.assertEqual(sorted(completions.calls), [1, 2, 3])
+        texts = [question['question_text'] for question in questions]
+        self.assertEqual(len(texts), 25)
+        self.assertEqual(texts[0], 'Que retient-on du point 101 du cours ?')
+        self.assertEqual(texts[9], 'Que retient-on du point 201 du cours ?')
+        self.assertEqual(texts[-1], 'Que retient-on du point 308 du cours ?')
+
+    def test_transient_shard_failure_is_retried_once_by_the_provider(self):
+        completions = ShardedCompletions(failures={2: [rate_limit_error()]})
+
+        questions = self.generate(completions)
+
+        self.assertEqual(len(questions), 25)
+        self.assertEqual(sorted(completions.calls), [1, 2, 2, 3])
+
+    def test_failed_shard_is_not_retried_and_topped_up(self):
+        completions = ShardedCompletions(failures={2: [ValueError('réponse illisible')]})
+
+        questions = self.generate(completions)
+
+        # Pas de seconde couche de reprise : le lot est abandonné, ses questions redemandées une fois
+        self.assertEqual(sorted(completions.calls), [0, 1, 2, 3])
+        self.assertEqual(len(questions), 25)
+
+
+class FakeCompletionStream:
+    """Réponse en streaming : la sortie JSON découpée en petits morceaux, puis l'usage"""
+
+    def __init__(self, content, piece_size=7):
+        self.chunks = [
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[index:index + piece_size]))], usage=None)
+            for index in range(0, len(content), piece_size)
+        ]
+        self.chunks.append(SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=100, completion_tokens=50)))
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if self.closed:
+                return
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class StreamingCompletions(FakeChatCompletions):
+    def create(self, **kwargs):
+        response = super().create(**kwargs)
+        if not kwargs.get('stream'):
+            return response
+        self.stream = FakeCompletionStream(response.choices[0].message.content)
+        return self.stream
+
+
+def parse_sse_events(body):
+    """[(événement, données)] d'un corps Server-Sent Events ; chaque événement se termine par une ligne vide"""
+    assert body.endswith('\n\n'), body
+    events = []
+    for frame in body[:-2].split('\n\n'):
+        event_line, data_line = frame.split('\n')
+        events.append((event_line.removeprefix('event: '), json.loads(data_line.removeprefix('data: '))))
+    return events
+
+
+@override_settings(QUESTION_POOL_FACTOR=1)
+class StreamingUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user(username='eleve', email='eleve@example.com', password='secret', first_name='A', last_name='B')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.completions = StreamingCompletions()
+        client = FakeClient(self.completions)
+        service_patch = mock.patch('accounts.generation.OpenAIService', lambda **kwargs: OpenAIService(provider=client, **kwargs))
+        service_patch.start()
+        self.addCleanup(service_patch.stop)
+
+    def upload(self, question_count=3):
+        file = SimpleUploadedFile('cours.txt', 'La mitochondrie produit l\'énergie de la cellule.'.encode('utf-8'))
+        return self.api.post(reverse('upload_document_stream'), {'file': file, 'question_count': question_count}, format='multipart')
+
+    def test_questions_are_sent_as_events_then_done(self):
+        response = self.upload()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual((response['Cache-Control'], response['X-Accel-Buffering']), ('no-cache', 'no'))
+        events = parse_sse_events(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual([event for event, _ in events], ['lesson', 'question', 'question', 'question', 'done'])
+        lesson = self.user.lessons.get()
+        self.assertEqual(events[0][1]['lesson_id'], lesson.id)
+        self.assertEqual([data['question_text'] for _, data in events[1:4]], ['Question 0', 'Question 1', 'Question 2'])
+        self.assertEqual(events[-1][1], {'lesson_id': lesson.id, 'total_questions': 3})
+        self.assertEqual(lesson.total_questions, 3)
+        self.assertEqual(GenerationJob.objects.get().status, 'done')
+        self.assertEqual(GenerationRun.objects.get().outcome, 'success')
+
+    def test_client_disconnect_cancels_generation(self):
+        response = self.upload()
+        content = iter(response.streaming_content)
+        self.assertTrue(next(content).startswith(b'event: lesson\n'))
+        self.assertTrue(next(content).startswith(b'event: question\n'))
+
+        # Fermeture de la connexion : GeneratorExit remonte jusqu'à stream_ai_questions
+        response.close()
+
+        self.assertTrue(self.completions.stream.closed)
+        self.assertEqual(GenerationRun.objects.get().outcome, 'cancelled')
+        self.assertEqual(self.user.lessons.get().questions.count(), 1)
+        self.assertFalse(AIConcurrencyTicket.objects.filter(status='active').exists())
+        # Job clos tout de suite : il ne compte plus dans le quota en attente
+        self.assertEqual((GenerationJob.objects.get().status, self.user.get_pending_quiz_count()), ('failed', 0))
+
+    @override_settings(AI_CONCURRENCY_LIMIT=1, AI_CONCURRENCY_POLL_SECONDS=0, AI_CONCURRENCY_MAX_WAIT_SECONDS=600)
+    def test_disconnect_while_queued_leaves_nothing_behind(self):
+        blocker = AISlot('premium')
+        list(blocker.wait())
+        self.addCleanup(blocker.release)
+        response = self.upload()
+        content = iter(response.streaming_content)
+        self.assertTrue(next(content).startswith(b'event: lesson\n'))
+        GenerationJob.objects.update(heartbeat_at=timezone.now() - timedelta(seconds=600))
+
+        self.assertTrue(next(content).startswith(b'event: queue\n'))
+        # L'attente d'une place donne signe de vie
+        self.assertGreater(GenerationJob.objects.get().heartbeat_at, timezone.now() - timedelta(seconds=60))
+
+        response.close()
+
+        job = GenerationJob.objects.get()
+        self.assertEqual((job.status, job.error), ('failed', 'Génération interrompue (client déconnecté)'))
+        self.assertFalse(self.user.lessons.exists())
+        self.assertFalse(Document.objects.exists())
+        self.assertEqual(AIConcurrencyTicket.objects.count(), 1)
+
+
+class TextExtractionTests(TestCase):
+    def _write(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w', encoding='utf-8') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_markdown_is_split_by_heading(self):
+        path = self._write('.md', "Intro\n\n# Chapitre 1\nTexte un\n\n## Chapitre 2\nTexte deux\n")
+
+        sections = extract_sections(path)
+
+        self.assertEqual([text.splitlines()[0] for _, text in sections], ['Intro', '# Chapitre 1', '## Chapitre 2'])
+
+    def test_long_sections_are_split_into_bounded_chunks(self):
+        chunks = split_into_chunks([('Page 1', '\n\n'.join(['mot ' * 200] * 10))], max_tokens=300)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(text) <= 300 * 4 + 2 for _, text in chunks))
+
+    def test_selection_respects_budget_and_covers_document(self):
+        chunks = [SimpleNamespace(label=f'Page {index}', token_count=100) for index in range(100)]
+
+        selected = select_chunks(chunks, 1000)
+        positions = [int(chunk.label.split()[1]) for chunk in selected]
+
+        self.assertEqual(len(selected), 10)
+        self.assertEqual(positions, sorted(positions))
+        self.assertLess(positions[0], 10)
+        self.assertGreaterEqual(positions[-1], 90)
+
+    def test_small_documents_are_sent_whole(self):
+        chunks = [SimpleNamespace(label=f'Page {index}', token_count=100) for index in range(5)]
+
+        self.assertEqual(select_chunks(chunks, 1000), chunks)
+
+    def test_instructions_retrieve_matching_chunks(self):
+        texts = ["Page de cours sur l'histoire des sciences et des techniques." for index in range(40)]
+        texts[17] = "Chapitre 2 : les formules de la dérivée et de la primitive."
+        texts[18] = "Suite du chapitre 2, exemples de dérivées."
+        chunks = [
+            SimpleNamespace(label=f'Page {index}', text=text, position=index, token_count=100, terms=compute_terms(f'Page {index}', text))
+            for index, text in enumerate(texts)
+        ]
+
+        selected = retrieve_chunks(chunks, "Concentre-toi uniquement sur les dérivées du chapitre 2", 1000)
+
+        self.assertEqual([chunk.position for chunk in selected], [17, 18])
+        self.assertIsNone(retrieve_chunks(chunks, "Questions difficiles", 1000))
+
+
+def build_sample_questions(count):
+    """Questions dont les textes contiennent accolades, guillemets échappés et accents"""
+    return [
+        {
+            "question_text": f"Que vaut {{x}} dans \"f(x) = [x] + {index}\" ?",
+            "difficulty": "medium",
+            "answers": [
+                {"text": f"Réponse {index} }} correcte", "is_correct": True},
+                {"text": "Mauvaise réponse \\ {", "is_correct": False},
+            ]
+        }
+        for index in range(count)
+    ]
+
+
+class QuestionParserFuzzTests(TestCase):
+    """Sorties du modèle tronquées ou malformées"""
+
+    def setUp(self):
+        self.questions = build_sample_questions(6)
+        # Sortie construite objet par objet pour connaître la position de fin de chaque question
+        self.output = '{\n  "questions": [\n'
+        self.ends = []
+        for index, question in enumerate(self.questions):
+            if index:
+                self.output += ',\n'
+            self.output += '    ' + json.dumps(question, ensure_ascii=False)
+            self.ends.append(len(self.output))
+        self.output += '\n  ]\n}'
+
+    def test_truncation_keeps_every_closed_question(self):
+        for cut in range(len(self.output) + 1):
+            questions, _ = parse_questions(self.output[:cut])
+            expected = sum(1 for end in self.ends if end <= cut)
+            self.assertEqual(questions, self.questions[:expected], f"coupure à {cut}")
+
+    def test_chunked_feed_matches_single_feed(self):
+        rng = random.Random(42)
+        for _ in range(200):
+            parser = IncrementalQuestionParser()
+            questions = []
+            position = 0
+            while position < len(self.output):
+                size = rng.randint(1, 40)
+                questions += parser.feed(self.output[position:position + size])
+                position += size
+            self.assertEqual(questions, self.questions)
+            self.assertTrue(parser.finished)
+
+    def test_random_corruption_never_raises(self):
+        rng = random.Random(7)
+        for _ in range(500):
+            chars = list(self.output[:rng.randint(0, len(self.output))])
+            for _ in range(rng.randint(1, 5)):
+                if chars:
+                    chars[rng.randrange(len(chars))] = rng.choice('{}[]",:\\\'x')
+            questions, _ = parse_questions(''.join(chars))
+            self.assertTrue(all(question['answers'] for question in questions))
+
+    def test_malformed_samples(self):
+        valid = '{"question_text": "Q", "difficulty": "easy", "answers": [{"text": "a", "is_correct": true}, {"text": "b", "is_correct": false}]}'
+        samples = {
+            'markdown': (f'```json\n{{"questions": [{valid}]}}\n```', 1),
+            'tableau nu': (f'[{valid}, {valid}]', 2),
+            'virgules finales': ('{"questions": [{"question_text": "Q", "difficulty": "easy", "answers": [{"text": "a", "is_correct": true,}, {"text": "b", "is_correct": false},],},]}', 1),
+            'guillemets simples': ("{\"questions\": [{'question_text': 'Q', 'difficulty': 'easy', 'answers': [{'text': 'a', 'is_correct': true}, {'text': 'b', 'is_correct': false}]}]}", 1),
+            'sans réponses': (f'{{"questions": [{{"question_text": "Q"}}, {valid}]}}', 1),
+            'sans bonne réponse': ('{"questions": [{"question_text": "Q", "answers": [{"text": "a", "is_correct": false}, {"text": "b", "is_correct": false}]}]}', 0),
+            'texte avant': (f'Voici le quiz : {{"questions": [{valid}]}}', 1),
+            'guillemet manquant': ('{"questions": [\n{"question_text": "Q, "answers": [\n{"text": "a", "is_correct": true}]},\n' + valid + ']}', 1),
+        }
+        for name, (content, expected) in samples.items():
+            questions, _ = parse_questions(content)
+            self.assertEqual(len(questions), expected, name)
+
+    def test_missing_difficulty_defaults_to_medium(self):
+        questions, _ = parse_questions('{"questions": [{"question_text": "Q", "answers": [{"text": "a", "is_correct": true}, {"text": "b", "is_correct": false}]}]}')
+
+        self.assertEqual(questions[0]['difficulty'], 'medium')
+
+
+class TruncatedCompletions:
+    """Première réponse tronquée après 3 questions, puis réponses complètes"""
+
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if len(self.calls) == 1:
+            content = json.dumps({"questions": build_sample_questions(5)})
+            content = content[:content.index('[x] + 3')]
+            finish_reason = 'length'
+        else:
+            questions = build_sample_questions(10)[5:]
+            content = json.dumps({"questions": questions})
+            finish_reason = 'stop'
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)])
+
+
+class TopUpTests(TestCase):
+    def test_truncated_output_is_topped_up_with_missing_count(self):
+        handle, path = tempfile.mkstemp(suffix='.txt')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        service = OpenAIService()
+        service.client = FakeClient()
+        service.client.chat.completions = TruncatedCompletions()
+
+        questions = service.generate_questions_from_document(path, 'Cours', question_count=5, document_text='Texte du cours')
+
+        self.assertEqual(len(questions), 5)
+        calls = service.client.chat.completions.calls
+        self.assertEqual(len(calls), 2)
+        self.assertIn('2 questions', calls[1]['messages'][1]['content'][-1]['text'])
+
+    @override_settings(AI_TOP_UP_MAX_ATTEMPTS=0)
+    def test_partial_quiz_is_not_cached(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        client = FakeClient(TruncatedCompletions())
+        with override_settings(MEDIA_ROOT=media_root.name):
+            document = Document.objects.create(title='Cours', file=SimpleUploadedFile('cours.txt', b'Texte du cours'), file_type='.txt')
+            with mock.patch('accounts.generation.OpenAIService', lambda **kwargs: OpenAIService(provider=client, **kwargs)):
+                create_ai_questions(document, question_count=5)
+
+        self.assertEqual(document.questions.count(), 3)
+        self.assertEqual(GenerationRun.objects.get().outcome, 'partial')
+        self.assertFalse(QuizCacheEntry.objects.exists())
+
+
+def rate_limit_error(retry_after=None):
+    headers = {'retry-after': retry_after} if retry_after else {}
+    response = SimpleNamespace(request=None, status_code=429, headers=headers)
+    return openai.RateLimitError('Rate limit', response=response, body=None)
+
+
+@override_settings(AI_RETRY_MAX_ATTEMPTS=3, AI_RETRY_BASE_DELAY=1.0, AI_RETRY_MAX_DELAY=30)
+class ProviderResilienceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('test', failure_threshold=3, window_seconds=60, cooldown_seconds=30)
+
+    def test_transient_errors_are_retried_honouring_retry_after(self):
+        func = mock.Mock(side_effect=[rate_limit_error('7'), 'ok'])
+
+        with mock.patch('accounts.ai_providers.time.sleep') as sleep:
+            result = call_with_retry(self.breaker, 'test', func)
+
+        self.assertEqual(result, 'ok')
+        sleep.assert_called_once_with(7.0)
+        self.assertEqual(self.breaker.state(), 'closed')
+
+    def test_non_transient_errors_are_not_retried(self):
+        func = mock.Mock(side_effect=ValueError('bad request'))
+
+        with self.assertRaises(ValueError):
+            call_with_retry(self.breaker, 'test', func)
+        self.assertEqual(func.call_count, 1)
+
+    def test_circuit_opens_and_fails_fast_then_recovers(self):
+        failing = mock.Mock(side_effect=rate_limit_error())
+        with mock.patch('accounts.ai_providers.time.sleep'):
+            with self.assertRaises(openai.RateLimitError):
+                call_with_retry(self.breaker, 'test', failing)
+        self.assertEqual(self.breaker.state(), 'open')
+
+        # Appels refusés sans contacter le fournisseur
+        func = mock.Mock(return_value='ok')
+        with self.assertRaises(CircuitOpenError):
+            call_with_retry(self.breaker, 'test', func)
+        func.assert_not_called()
+
+        # Après le refroidissement, un appel d'essai réussi referme le disjoncteur
+        with mock.patch('accounts.ai_providers.time.time', return_value=time.time() + 31):
+            self.assertEqual(call_with_retry(self.breaker, 'test', func), 'ok')
+        self.assertEqual(self.breaker.state(), 'closed')
+
+    def test_retried_upload_sends_whole_file_again(self):
+        handle, path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(b'%PDF-1.4 ' + b'x' * 1000)
+        self.addCleanup(os.remove, path)
+        files = FakeFilesAPI()
+        sizes = []
+        create = files.create
+
+        def flaky_create(file, purpose):
+            uploaded = create(file=file, purpose=purpose)
+            sizes.append(uploaded.size)
+            if len(sizes) == 1:
+                # Coupure après lecture complète du fichier
+                raise rate_limit_error()
+            return uploaded
+
+        files.create = flaky_create
+        client = SimpleNamespace(files=ai_providers.ResilientProxy(files, self.breaker, 'test.files'))
+
+        with mock.patch('accounts.ai_providers.time.sleep'):
+            file_id = ProviderFileCache(ttl_seconds=3600, max_entries=10).acquire(client, path, 'a' * 64)
+
+        self.assertEqual(sizes, [os.path.getsize(path)] * 2)
+        self.assertEqual(files.files[file_id].size, os.path.getsize(path))
+
+    def test_non_rewindable_stream_is_not_retried(self):
+        func = mock.Mock(side_effect=rate_limit_error())
+        pipe = ChunkPipe('blob.bin', buffer_bytes=1024)
+
+        with mock.patch('accounts.ai_providers.time.sleep'):
+            with self.assertRaises(openai.RateLimitError):
+                call_with_retry(self.breaker, 'test', func, file=pipe, purpose='assistants')
+        self.assertEqual(func.call_count, 1)
+
+    @override_settings(AI_REPLAY_DIR='', AI_REPLAY_LATENCY_MS=0)
+    def test_replay_provider_is_deterministic(self):
+        handle, path = tempfile.mkstemp(suffix='.txt')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        results = []
+        for _ in range(2):
+            service = OpenAIService(provider=ReplayProvider())
+            results.append(service.generate_questions_from_document(path, 'Cours', question_count=4, document_text='Texte'))
+
+        self.assertEqual(len(results[0]), 4)
+        self.assertEqual(results[0], results[1])
+
+
+class SharedProviderTests(TestCase):
+    def setUp(self):
+        ai_providers.reset_ai_providers()
+        self.addCleanup(ai_providers.reset_ai_providers)
+
+    def test_provider_is_shared_within_process(self):
+        self.assertIs(get_ai_provider('replay'), get_ai_provider('replay'))
+        self.assertIs(OpenAIService().client, OpenAIService().client)
+
+    def test_child_process_gets_its_own_provider(self):
+        parent = get_ai_provider('replay')
+
+        ai_providers._reset_after_fork()
+
+        self.assertIsNot(get_ai_provider('replay'), parent)
+
+
+class ParaphraseCompletions(FakeChatCompletions):
+    """Première réponse : une paraphrase d'une question existante ; compléments : une nouvelle question"""
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        texts = ["Dans quel organite se déroule la photosynthèse ?", "Quel est le rôle des mitochondries ?"]
+        if len(self.calls) > 1:
+            texts = ["Quel gaz la photosynthèse libère-t-elle ?"]
+        questions = [
+            {"question_text": text, "difficulty": "medium", "answers": [{"text": "Oui", "is_correct": True}, {"text": "Non", "is_correct": False}]}
+            for text in texts
+        ]
+        message = SimpleNamespace(content=json.dumps({"questions": questions}))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason='stop')])
+
+
+@override_settings(QUESTION_DUPLICATE_THRESHOLD=0.45)
+class NearDuplicateTests(TestCase):
+    def test_paraphrases_are_detected_but_not_distinct_questions(self):
+        index = SimilarityIndex()
+        index.add("Quel est le rôle des chloroplastes dans la cellule végétale ?")
+        index.add("Combien font 12 + 7 ?")
+
+        self.assertIsNotNone(index.find_duplicate("Quel rôle jouent les chloroplastes dans une cellule végétale ?"))
+        self.assertIsNone(index.find_duplicate("Quel est le rôle des mitochondries dans la cellule ?"))
+        self.assertIsNone(index.find_duplicate("Combien font 12 + 8 ?"))
+
+    def test_duplicate_of_existing_question_is_replaced(self):
+        index = SimilarityIndex()
+        index.add("Quel organite réalise la photosynthèse ?", unpack_signature(pack_signature(compute_signature("Quel organite réalise la photosynthèse ?"))))
+        completions = ParaphraseCompletions()
+        service = OpenAIService(provider=FakeClient(completions))
+
+        questions = service.generate_questions_from_document('cours.txt', 'Cours', question_count=2, document_text='Texte', duplicate_index=index)
+
+        self.assertEqual([question['question_text'] for question in questions], ["Quel est le rôle des mitochondries ?", "Quel gaz la photosynthèse libère-t-elle ?"])
+        self.assertEqual(len(completions.calls), 2)
+        top_up_prompt = completions.calls[1]['messages'][1]['content'][-1]['text']
+        self.assertIn('Génère exactement 1 questions', top_up_prompt)
+        self.assertIn("Quel organite réalise la photosynthèse ?", top_up_prompt)
+
+
+@override_settings(AI_CONCURRENCY_LIMIT=2, AI_CONCURRENCY_FREE_MAX=2, AI_CONCURRENCY_GUEST_MAX=1, AI_CONCURRENCY_POLL_SECONDS=0)
+class AIConcurrencyLimiterTests(TestCase):
+    def test_premium_is_admitted_first_and_guest_lane_is_capped(self):
+        running_guest = AISlot('guest').__enter__()
+        free, guest, premium = AISlot('free'), AISlot('guest'), AISlot('premium')
+        for slot in (free, guest, premium):
+            slot._request()
+
+        self.assertEqual([premium.position(), free.position(), guest.position()], [1, 2, 3])
+        # Une seule place libre : elle revient au premium arrivé en dernier
+        self.assertFalse(free._try_admit())
+        self.assertTrue(premium._try_admit())
+        running_guest.release()
+        # Place libérée : la voie gratuite passe avant l'invité
+        self.assertFalse(guest._try_admit())
+        self.assertTrue(free._try_admit())
+        self.assertEqual(AIConcurrencyTicket.objects.filter(status='active').count(), 2)
+
+    @override_settings(AI_CONCURRENCY_MAX_WAIT_SECONDS=0)
+    def test_waiting_gives_up_after_max_wait(self):
+        AISlot('premium').__enter__()
+        AISlot('premium').__enter__()
+
+        with self.assertRaises(AIQueueTimeoutError):
+            list(AISlot('guest').wait())
+        self.assertFalse(AIConcurrencyTicket.objects.filter(status='waiting').exists())
+
+    def test_worker_claims_premium_jobs_first(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        with override_settings(MEDIA_ROOT=media_root.name):
+            document = Document.objects.create(title='Cours', file=SimpleUploadedFile('cours.txt', b'Texte'), file_type='.txt')
+        premium_user = User.objects.create_user(username='prof', email='prof@example.com', password='secret', first_name='A', last_name='B', is_premium=True)
+        guest_job = enqueue_generation_job(document, 'Cours')
+        premium_job = enqueue_generation_job(document, 'Cours', user=premium_user)
+
+        self.assertEqual([get_job_queue_position(premium_job), get_job_queue_position(guest_job)], [1, 2])
+        self.assertEqual(claim_next_job('worker-1').id, premium_job.id)
+        self.assertEqual(get_job_queue_position(GenerationJob.objects.get(id=guest_job.id)), 1)
+
+
+@override_settings(AI_CONCURRENCY_LIMIT=1, AI_CONCURRENCY_LEASE_SECONDS=2, AI_CONCURRENCY_POLL_SECONDS=0)
+class AIConcurrencyLeaseTests(TransactionTestCase):
+    def test_active_slot_lease_is_renewed_until_release(self):
+        with AISlot('premium') as slot:
+            # Appel plus long que le bail : la place reste occupée
+            time.sleep(2.5)
+            ticket = AIConcurrencyTicket.objects.get(id=slot.ticket.id)
+            self.assertGreater(ticket.expires_at, timezone.now())
+            # Les places expirées sont purgées à chaque admission : celle-ci ne l'est pas
+            other = AISlot('premium')
+            other._request()
+            self.assertFalse(other._try_admit())
+            other.release()
+
+        self.assertFalse(AIConcurrencyTicket.objects.exists())
+
+
+def build_blank_pdf(pages):
+    """PDF de `pages` pages vides"""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=595, height=842)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+@override_settings(AI_PDF_MAX_PAGES=10)
+class PdfPageSelectionTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user(username='eleve', email='eleve@example.com', password='secret', first_name='A', last_name='B')
+
+    def test_long_pdf_is_sampled_or_cut_to_requested_pages(self):
+        document = Document.objects.create(user=self.user, title='Manuel', file=SimpleUploadedFile('manuel.pdf', build_blank_pdf(100)), file_type='.pdf')
+
+        sample_path, sample_hash = get_provider_file(document, document.content_hash)
+        self.assertEqual(len(PdfReader(sample_path).pages), 10)
+
+        document.page_start, document.page_end = 3, 5
+        range_hash = get_source_hash(document, document.content_hash)
+        range_path, provider_hash = get_provider_file(document, range_hash)
+
+        self.assertEqual(len(PdfReader(range_path).pages), 3)
+        self.assertEqual(len({document.content_hash, sample_hash, range_hash, provider_hash}), 4)
+
+    def test_invalid_page_range_is_rejected(self):
+        api = APIClient()
+        api.force_authenticate(self.user)
+
+        reversed_range = api.post(reverse('upload_document'), {'file': SimpleUploadedFile('manuel.pdf', build_blank_pdf(3)), 'page_start': 5, 'page_end': 2}, format='multipart')
+        out_of_document = api.post(reverse('upload_document'), {'file': SimpleUploadedFile('manuel.pdf', build_blank_pdf(3)), 'page_start': 4}, format='multipart')
+        not_a_pdf = api.post(reverse('upload_document'), {'file': SimpleUploadedFile('cours.txt', b'Texte'), 'page_start': 1}, format='multipart')
+
+        self.assertEqual([reversed_range.status_code, out_of_document.status_code, not_a_pdf.status_code], [400, 400, 400])
+        self.assertFalse(Document.objects.exists())
+
+
+class UploadPreflightTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user(username='eleve', email='eleve@example.com', password='secret', first_name='A', last_name='B')
+
+    def test_bad_files_are_rejected_before_storage(self):
+        writer = PdfWriter()
+        writer.add_blank_page(width=595, height=842)
+        writer.encrypt(user_password='secret', owner_password='owner', algorithm='RC4-128')
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        api = APIClient()
+        api.force_authenticate(self.user)
+
+        uploads = {
+            'encrypted_pdf': SimpleUploadedFile('cours.pdf', buffer.getvalue()),
+            'type_mismatch': SimpleUploadedFile('cours.pdf', b'MZ\x90\x00\x03\x00\x00\x00'),
+            'no_extractable_text': SimpleUploadedFile('notes.txt', b'  \n\t\n'),
+            'empty_file': SimpleUploadedFile('vide.pdf', b''),
+        }
+        for code, file in uploads.items():
+            with self.subTest(code=code):
+                response = api.post(reverse('upload_document'), {'file': file}, format='multipart')
+                self.assertEqual(response.status_code, 415 if code == 'type_mismatch' else 400)
+                self.assertEqual(response.data['code'], code)
+        self.assertFalse(Document.objects.exists())
+
+    def test_mislabeled_file_is_renamed_after_its_content(self):
+        image = io.BytesIO()
+        Image.new('RGB', (40, 30), (200, 30, 30)).save(image, 'PNG')
+        file = SimpleUploadedFile('schema.jpg', image.getvalue())
+
+        result = inspect_upload(file)
+
+        self.assertEqual((result['extension'], result['mime_type'], file.name), ('.png', 'image/png', 'schema.png'))
+        with self.assertRaises(PreflightError) as error:
+            inspect_upload(SimpleUploadedFile('archive.zip', b'PK\x03\x04' + b'\x00' * 40))
+        self.assertEqual(error.exception.code, 'unsupported_type')
+
+
+@override_settings(AI_PDF_MAX_PAGES=0, AI_SCANNED_PAGE_TOKENS=800, DOCUMENT_MAX_PROMPT_TOKENS_FREE=24000, AI_LARGE_PROMPT_TOKENS=15000, AI_SHARD_SIZE=10, AI_LARGE_PROMPT_SHARD_SIZE=20, AI_LARGE_PROMPT_MODEL='gpt-4o', AI_MODEL_ROUTES='')
+class DocumentProfileTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user(username='eleve', email='eleve@example.com', password='secret', first_name='A', last_name='B')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_scanned_pdf_profile_limits_free_accounts(self):
+        # 40 pages sans texte : lues comme des images, 800 tokens chacune
+        too_large = self.api.post(reverse('upload_document'), {'file': SimpleUploadedFile('scan.pdf', build_blank_pdf(40))}, format='multipart')
+        self.assertEqual((too_large.status_code, too_large.data['code']), (413, 'document_too_large'))
+        self.assertEqual(too_large.data['estimated_tokens'], 32000)
+
+        response = self.api.post(reverse('upload_document'), {'file': SimpleUploadedFile('scan.pdf', build_blank_pdf(40)), 'page_start': 1, 'page_end': 10}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+
+        profile = self.api.get(reverse('get_documents')).data[0]
+        self.assertEqual(
+            (profile['page_count'], profile['has_text'], profile['image_count'], profile['estimated_tokens']),
+            (40, False, 0, 32000)
+        )
+        self.assertEqual(profile['size_bytes'], len(build_blank_pdf(40)))
+        self.assertEqual(get_prompt_tokens(Document.objects.get(), 5), 8000)
+
+    def test_large_prompts_get_bigger_shards_and_dedicated_model(self):
+        small, large = route_generation(8000, 5, 'free'), route_generation(20000, 5, 'free')
+
+        self.assertEqual((small.shard_size, small.model), (None, settings.AI_MODEL))
+        self.assertEqual((large.shard_size, large.model), (20, 'gpt-4o'))
+
+
+MODEL_ROUTES = json.dumps([
+    {"name": "invite", "roles": ["guest"], "model": "petit-modele", "temperature": 0.3},
+    {"name": "gros_premium", "roles": ["premium"], "min_prompt_tokens": 15000, "model": "grand-modele", "fallback": "modele-moyen", "max_latency_ms": 20000, "shard_size": 25},
+    {"name": "defaut", "model": "modele-moyen"},
+])
+
+
+@override_settings(AI_MODEL_ROUTES=MODEL_ROUTES, AI_ROUTING_MIN_CALLS=4, AI_ROUTING_MAX_ERROR_RATE=0.5)
+class ModelRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_rules_pick_model_and_parameters_by_role_and_size(self):
+        guest = route_generation(2000, 5, 'guest')
+        premium = route_generation(30000, 40, 'premium')
+        small_premium = route_generation(2000, 40, 'premium')
+
+        self.assertEqual((guest.label, guest.model, guest.temperature), ('invite', 'petit-modele', 0.3))
+        self.assertEqual((premium.label, premium.model, premium.shard_size), ('gros_premium', 'grand-modele', 25))
+        self.assertEqual((small_premium.label, small_premium.model), ('defaut', 'modele-moyen'))
+
+    def test_slow_or_failing_model_falls_back(self):
+        for _ in range(4):
+            record_model_call('grand-modele', 30)
+        self.assertEqual(get_model_stats('grand-modele')['avg_latency_ms'], 30000)
+        slow = route_generation(30000, 40, 'premium')
+        self.assertEqual((slow.label, slow.model), ('gros_premium:repli_latence', 'modele-moyen'))
+
+        cache.clear()
+        for failed in (True, True, True, False):
+            record_model_call('grand-modele', 1, failed=failed)
+        failing = route_generation(30000, 40, 'premium')
+        self.assertEqual((failing.label, failing.model), ('gros_premium:repli_erreurs', 'modele-moyen'))
+
+
+@override_settings(AI_UPLOAD_PIPELINE_ENABLED=True, AI_PROVIDER='replay', AI_REPLAY_DIR='', AI_REPLAY_LATENCY_MS=0)
+class PipelinedUploadTests(TransactionTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        ai_providers.reset_ai_providers()
+        self.addCleanup(ai_providers.reset_ai_providers)
+
+    def test_provider_receives_file_while_it_is_stored(self):
+        content = ''.join(f'{number};cellule;{number * 7}\n' for number in range(20000)).encode('utf-8')
+        file = SimpleUploadedFile('notes.csv', content)
+
+        pipeline = start_pipelined_upload(file)
+        document = Document.objects.create(title='Notes', file=pipeline.wrap(file), file_type='.csv')
+        pipeline.finish(document)
+        file_id = pipeline.future.result(timeout=10)
+
+        # Le fournisseur de rejeu nomme le fichier d'après le hash de ce qu'il a reçu
+        self.assertEqual(file_id, f'file-replay-{compute_file_hash(document.file.path)[:24]}')
+        entry = ProviderFile.objects.get(content_hash=document.content_hash)
+        self.assertEqual((entry.status, entry.file_id, entry.size_bytes), ('ready', file_id, len(content)))
+        # La génération réutilise ce fichier sans nouvel upload
+        client = FakeClient(FakeChatCompletions())
+        self.assertEqual(ProviderFileCache().acquire(client, document.file.path, document.content_hash), file_id)
+        self.assertEqual(client.files.created, 0)
+
+    @override_settings(AI_TEXT_EXTRACTION_ENABLED=True, AI_PDF_MAX_PAGES=10)
+    def test_scanned_pdf_is_pipelined_but_text_is_extracted(self):
+        scan = SimpleUploadedFile('scan.pdf', build_blank_pdf(3))
+        notes = SimpleUploadedFile('notes.txt', 'La mitochondrie produit l\'énergie de la cellule.'.encode('utf-8'))
+        # Un fichier texte est extrait localement : rien à envoyer pendant l'enregistrement
+        self.assertIsNone(start_pipelined_upload(notes, profile=build_profile(notes, inspect_upload(notes))))
+
+        # PDF sans texte : envoyé tel quel au fournisseur, donc dès sa réception
+        profile = build_profile(scan, inspect_upload(scan))
+        self.assertIs(profile['has_text'], False)
+        pipeline = start_pipelined_upload(scan, profile=profile)
+        self.assertIsNotNone(pipeline)
+        document = Document.objects.create(title='Scan', file=pipeline.wrap(scan), file_type='.pdf', **profile)
+        pipeline.finish(document)
+        file_id = pipeline.future.result(timeout=10)
+
+        self.assertEqual(ProviderFile.objects.get(content_hash=document.content_hash).file_id, file_id)
+        self.assertIsNone(start_pipelined_upload(scan, page_start=1, page_end=2, profile=profile))
+
+    def test_overflow_is_read_back_from_stored_file(self):
+        content = os.urandom(100 * 1024)
+        handle, path = tempfile.mkstemp()
+        with os.fdopen(handle, 'wb') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+
+        pipe = ChunkPipe('blob.bin', buffer_bytes=32 * 1024)
+        for start in range(0, len(content), 10 * 1024):
+            pipe.feed(content[start:start + 10 * 1024])
+        pipe.finish_writing(path)
+
+        self.assertEqual(pipe.read(), content)
+        self.assertEqual(pipe.sent_bytes, len(content))
+
+
+@override_settings(AI_IMAGE_PREPROCESSING_ENABLED=True, AI_IMAGE_MAX_LONG_SIDE=2048, AI_IMAGE_MAX_SHORT_SIDE=768)
+class ImagePreparationTests(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        # Photo de téléphone en portrait : pixels stockés en paysage + tag Orientation et position GPS
+        self.path = os.path.join(tmp_dir.name, 'photo.jpg')
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x8825] = {1: 'N', 2: (48.0, 51.0, 24.0)}
+        Image.effect_noise((3000, 2000), 40).convert('RGB').save(self.path, 'JPEG', quality=95, exif=exif)
+
+    def test_image_is_rotated_downsized_and_stripped(self):
+        prepared_path = prepare_image(self.path)
+
+        with Image.open(prepared_path) as prepared:
+            self.assertEqual(prepared.format, 'JPEG')
+            self.assertEqual(prepared.size, (768, 1152))
+            self.assertEqual(len(prepared.getexif()), 0)
+        self.assertLess(os.path.getsize(prepared_path), os.path.getsize(self.path))
+
+    def test_large_lossless_png_is_downsized(self):
+        # Capture d'écran 2560x1440 très compressible (1 bit) : l'original est plus léger que la version réduite
+        path = os.path.join(os.path.dirname(self.path), 'capture.png')
+        stripes = bytes(255 * ((x // 3) % 2) for x in range(2560)) * 1440
+        Image.frombytes('L', (2560, 1440), stripes).convert('1').save(path, 'PNG', optimize=True)
+
+        prepared_path = prepare_image(path)
+
+        with Image.open(prepared_path) as prepared:
+            self.assertEqual(prepared.format, 'PNG')
+            self.assertEqual(prepared.size, (1365, 768))
+            self.assertLessEqual(max(prepared.size), settings.AI_IMAGE_MAX_LONG_SIDE)
+            self.assertLessEqual(min(prepared.size), settings.AI_IMAGE_MAX_SHORT_SIDE)
+
+    def test_compact_png_without_metadata_keeps_original(self):
+        path = os.path.join(os.path.dirname(self.path), 'schema.png')
+        Image.new('P', (400, 300)).save(path, 'PNG', optimize=True)
+
+        prepared_path = prepare_image(path)
+
+        with open(path, 'rb') as original, open(prepared_path, 'rb') as prepared:
+            self.assertEqual(prepared.read(), original.read())
+
+    def test_vision_call_sends_prepared_image(self):
+        schedule_image_preparation(self.path).result()
+        service = OpenAIService(provider=FakeClient())
+
+        attachment, file_id = service._prepare_attachment(self.path)
+
+        self.assertIsNone(file_id)
+        self.assertEqual(attachment['image_url']['url'], build_image_data_url(get_vision_image(self.path, 'image/jpeg')[0], 'image/jpeg'))
+        self.assertLess(len(attachment['image_url']['url']), os.path.getsize(self.path))
+
+
+class PromptPrefixCachingTests(TestCase):
+    def test_variable_parameters_come_after_static_prefix(self):
+        service = OpenAIService(provider=FakeClient())
+        attachment = {"type": "text", "text": "CONTENU DU DOCUMENT (extraits) :\nTexte"}
+        first = service._build_completion_kwargs(attachment, 'Cours A', 5, 'easy', service._build_education_context('6ème'), '')
+        second = service._build_completion_kwargs(attachment, 'Cours B', 12, 'hard', service._build_education_context(''), 'Insiste sur les dates', 2, 3)
+
+        self.assertEqual(first['messages'][0], second['messages'][0])
+        self.assertEqual(first['messages'][1]['content'][0], second['messages'][1]['content'][0])
+        self.assertIn('Génère exactement 12 questions', second['messages'][1]['content'][-1]['text'])
+
+    def test_cached_tokens_are_reported(self):
+        client = FakeClient(FakeChatCompletionsWithUsage({'prompt_tokens': 3000, 'cached_tokens': 2048, 'completion_tokens': 700}))
+        handle, path = tempfile.mkstemp(suffix='.txt')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        service = OpenAIService(provider=client)
+        service.generate_questions_from_document(path, 'Cours', question_count=5, document_text='Texte')
+
+        self.assertEqual(service.usage['calls'], 1)
+        self.assertEqual(service.usage['prompt_tokens'], 3000)
+        self.assertEqual(service.usage['cached_tokens'], 2048)
+
+
+class GenerationRunTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        user = User.objects.create_user(username='eleve', email='eleve@example.com', password='secret', first_name='A', last_name='B')
+        self.document = Document.objects.create(
+            user=user,
+            title='Cours',
+            file=SimpleUploadedFile('cours.txt', 'La photosynthèse produit du glucose.'.encode('utf-8')),
+            file_type='txt',
+        )
+
+    def generate(self, completions):
+        client = FakeClient(completions)
+        with mock.patch('accounts.generation.OpenAIService', lambda **kwargs: OpenAIService(provider=client, **kwargs)):
+            create_ai_questions(self.document, question_count=5)
+
+    def test_run_records_tokens_cost_and_role(self):
+        self.generate(FakeChatCompletionsWithUsage({'prompt_tokens': 3000, 'cached_tokens': 2048, 'completion_tokens': 700}))
+
+        run = GenerationRun.objects.get()
+        self.assertEqual((run.user_role, run.outcome, run.questions_generated), ('free', 'success', 5))
+        self.assertEqual((run.prompt_tokens, run.cached_tokens, run.completion_tokens), (3000, 2048, 700))
+        self.assertGreater(run.cost_eur, 0)
+        self.assertEqual(run.document, self.document)
+
+    @override_settings(
+        AI_MODEL_ROUTES=MODEL_ROUTES,
+        AI_MODEL_PRICES=json.dumps({'modele-moyen': {'input': 10, 'cached_input': 2.5, 'output': 40}}),
+        AI_PRICE_INPUT_EUR_PER_MTOK=0.14, AI_PRICE_CACHED_INPUT_EUR_PER_MTOK=0.07, AI_PRICE_OUTPUT_EUR_PER_MTOK=0.55,
+    )
+    def test_routed_run_is_priced_at_its_model_tariff(self):
+        cache.clear()
+        self.generate(FakeChatCompletionsWithUsage({'prompt_tokens': 3000, 'cached_tokens': 2048, 'completion_tokens': 700}))
+
+        run = GenerationRun.objects.get()
+        self.assertEqual((run.route, run.model), ('defaut', 'modele-moyen'))
+        # (952 × 10 + 2048 × 2,5 + 700 × 40) / 1 000 000
+        self.assertEqual(run.cost_eur, Decimal('0.042640'))
+        # Modèle sans tarif dédié : tarifs AI_PRICE_*
+        self.assertEqual(estimate_cost(3000, 2048, 700, 'petit-modele'), Decimal('0.000662'))
+
+    def test_failed_run_keeps_original_error_class(self):
+        completions = FakeChatCompletions()
+        completions.create = mock.Mock(side_effect=ValueError('réponse inattendue'))
+
+        with self.assertRaises(Exception):
+            self.generate(completions)
+
+        run = GenerationRun.objects.get()
+        self.assertEqual((run.outcome, run.error_class, run.questions_generated), ('failed', 'ValueError', 0))
+        self.assertEqual(summarize_generation_runs(GenerationRun.objects.all(), 'user_role')[0]['failures'], 1)
+
+
+BIOLOGY_COURSE = """La photosynthèse est un processus par lequel les plantes produisent du glucose à partir de lumière. Elle se déroule dans les chloroplastes des cellules végétales.
+La chlorophylle est un pigment vert qui absorbe la lumière rouge et bleue. Les chloroplastes contiennent de la chlorophylle en grande quantité.
+La respiration cellulaire est un ensemble de réactions qui dégradent le glucose pour produire de l'énergie. Elle a lieu dans les mitochondries.
+Le glucose est une molécule de sucre à six atomes de carbone. Les mitochondries sont les centrales énergétiques de la cellule.
+En 1779, Jan Ingenhousz montra que la lumière est nécessaire à la photosynthèse. Le dioxyde de carbone est absorbé par les stomates des feuilles.
+L'ATP est une molécule qui stocke l'énergie chimique dans la cellule. Les stomates se ferment lorsque la plante manque d'eau.
+Le cycle de Calvin fixe le dioxyde de carbone pour former du glucose dans le stroma des chloroplastes."""
+
+
+class DegradedModeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(cache.clear)
+        user = User.objects.create_user(username='eleve', email='eleve@example.com', password='secret', first_name='A', last_name='B')
+        self.document = Document.objects.create(
+            user=user,
+            title='Cours',
+            file=SimpleUploadedFile('cours.txt', BIOLOGY_COURSE.encode('utf-8')),
+            file_type='txt',
+        )
+
+    def test_offline_questions_are_built_from_document_text(self):
+        started = time.monotonic()
+        questions = generate_offline_questions(self.document, 6)
+
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(len(questions), 6)
+        self.assertTrue(any(question['question_text'].startswith('Quelle définition') for question in questions))
+        self.assertTrue(any('_____' in question['question_text'] for question in questions))
+        for question in questions:
+            answers = [answer['text'] for answer in question['answers']]
+            self.assertEqual(len(set(answers)), 4)
+            self.assertEqual(sum(answer['is_correct'] for answer in question['answers']), 1)
+
+    def test_open_circuit_serves_offline_quiz_without_calling_model(self):
+        get_ai_provider().breaker._open()
+
+        with mock.patch('accounts.generation.OpenAIService') as service:
+            create_ai_questions(self.document, question_count=4)
+
+        service.assert_not_called()
+        self.assertEqual(self.document.questions.count(), 4)
+        self.assertEqual(GenerationRun.objects.get().outcome, 'degraded')
+
+
+class QuestionPoolTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user(username='eleve', email='eleve@example.com', password='secret', first_name='A', last_name='B')
+        self.document = Document.objects.create(
+            user=self.user,
+            title='Cours',
+            file=SimpleUploadedFile('cours.txt', 'La photosynthèse produit du glucose.'.encode('utf-8')),
+            file_type='txt',
+        )
+        client = FakeClient()
+        patcher = mock.patch('accounts.generation.OpenAIService', lambda **kwargs: OpenAIService(provider=client, **kwargs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(QUESTION_POOL_FACTOR=2.5)
+    def test_surplus_goes_to_pool_and_serves_new_questions(self):
+        job = enqueue_generation_job(self.document, 'Cours', user=self.user, question_count=2, pool_extra=get_pool_extra(2, self.user))
+        run_generation_job(job)
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.lesson.questions.count(), 2)
+        self.assertEqual(get_pool_size(self.document), 3)
+        seen = set(job.lesson.questions.values_list('id', flat=True))
+
+        api = APIClient()
+        api.force_authenticate(self.user)
+        response = api.post(reverse('reset_lesson', args=[job.lesson.id]), {'new_questions': True}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        drawn = set(job.lesson.questions.values_list('id', flat=True))
+        self.assertEqual(len(drawn), 2)
+        self.assertFalse(drawn & seen)
+        self.assertEqual(get_pool_size(self.document), 1)
+        # Réserve sous le seuil : un remplissage est mis en file
+        self.assertTrue(GenerationJob.objects.filter(document=self.document, kind='pool_refill', status='queued').exists())
+
+        # Les questions retirées ne sont plus rattachées à une nouvelle leçon
+        legacy = api.post(reverse('create_lesson'), {'document_id': self.document.id}, format='json')
+        self.assertEqual(legacy.status_code, 201)
+        self.assertFalse(set(Lesson.objects.get(id=legacy.data['id']).questions.values_list('id', flat=True)) & seen)
+        self.assertEqual(Question.objects.filter(id__in=seen, lesson__isnull=True, retired=True).count(), 2)
+
+    @override_settings(QUESTION_POOL_FACTOR=2.5)
+    def test_short_pool_draw_is_rolled_back(self):
+        job = enqueue_generation_job(self.document, 'Cours', user=self.user, question_count=2, pool_extra=get_pool_extra(2, self.user))
+        run_generation_job(job)
+        self.user.is_premium = True
+        self.user.save()
+        api = APIClient()
+        api.force_authenticate(self.user)
+
+        # 3 questions en réserve pour 4 demandées : rien n'est tiré, aucune leçon créée
+        response = api.post(reverse('create_lesson'), {'document_id': self.document.id, 'question_count': 4}, format='json')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['pool_size'], 3)
+        self.assertEqual(get_pool_size(self.document), 3)
+        self.assertEqual(Lesson.objects.filter(document=self.document).count(), 1)
+
+        # Reprise impossible : la leçon garde ses questions
+        job.lesson.total_questions = 4
+        job.lesson.save()
+        response = api.post(reverse('reset_lesson', args=[job.lesson.id]), {'new_questions': True}, format='json')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(job.lesson.questions.count(), 2)
+        self.assertEqual(get_pool_size(self.document), 3)
+
+    def test_refill_keeps_only_unseen_questions_in_pool(self):
+        job = enqueue_generation_job(self.document, 'Cours', user=self.user, question_count=5)
+        run_generation_job(job)
+        refill = enqueue_generation_job(self.document, 'Cours', user=self.user, question_count=5, kind='pool_refill')
+
+        run_generation_job(refill)
+
+        # Le faux modèle renvoie toujours les mêmes questions : rien de nouveau pour la réserve
+        self.assertEqual(GenerationJob.objects.get(id=refill.id).status, 'done')
+        self.assertEqual(get_pool_size(self.document), 0)
+        self.assertEqual(self.document.questions.count(), 5)
+
+
+@override_settings(GENERATION_JOB_MAX_ATTEMPTS=1, QUESTION_POOL_FACTOR=1)
+class BulkUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user(username='prof', email='prof@example.com', password='secret', first_name='A', last_name='B', is_premium=True)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_files_are_queued_for_the_worker(self):
+        completions = FakeChatCompletions()
+        create = completions.create
+
+        def fail_on_second_chapter(**kwargs):
+            if 'chapitre-2' in json.dumps(kwargs['messages'], ensure_ascii=False):
+                raise ValueError('réponse illisible')
+            return create(**kwargs)
+
+        completions.create = fail_on_second_chapter
+        client = FakeClient(completions)
+        files = [
+            SimpleUploadedFile(f'chapitre-{number}.txt', f'Chapitre {number} : la cellule.'.encode('utf-8'))
+            for number in (1, 2)
+        ]
+
+        with mock.patch('accounts.generation.OpenAIService', lambda **kwargs: OpenAIService(provider=client, **kwargs)):
+            response = self.api.post(reverse('upload_documents_bulk'), {'files': files, 'question_count': 5}, format='multipart')
+            # Rien n'est généré dans la requête
+            self.assertEqual(completions.calls, [])
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual([result['status'] for result in response.data['results']], ['queued', 'queued'])
+            self.assertEqual(response.data['job_ids'], [result['job_id'] for result in response.data['results']])
+
+            while process_next_job('test-worker'):
+                pass
+
+        statuses = [GenerationJob.objects.get(id=job_id).status for job_id in response.data['job_ids']]
+        self.assertEqual(statuses, ['done', 'failed'])
+        self.assertEqual(self.user.lessons.get().total_questions, 5)
+
+    def test_each_file_is_validated_like_a_single_upload(self):
+        files = [
+            SimpleUploadedFile('chapitre-1.txt', 'Chapitre 1 : la cellule.'.encode('utf-8')),
+            SimpleUploadedFile('chapitre-2.txt', 'Chapitre 2 : la mitose.'.encode('utf-8')),
+        ]
+
+        # Une plage de pages n'a de sens que pour un PDF : refusée pour chaque fichier texte
+        response = self.api.post(reverse('upload_documents_bulk'), {'files': files, 'page_start': 2}, format='multipart')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.data['results']], ['rejected', 'rejected'])
+        self.assertFalse(GenerationJob.objects.exists())
+
+    def test_document_over_budget_is_rejected(self):
+        files = [
+            SimpleUploadedFile('court.txt', 'Chapitre 1 : la cellule.'.encode('utf-8')),
+            SimpleUploadedFile('long.txt', ('La cellule est l\'unité du vivant. ' * 2000).encode('utf-8')),
+        ]
+
+        with override_settings(DOCUMENT_MAX_PROMPT_TOKENS_PREMIUM=1000):
+            response = self.api.post(reverse('upload_documents_bulk'), {'files': files}, format='multipart')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([result['status'] for result in response.data['results']], ['queued', 'rejected'])
+        self.assertEqual(response.data['results'][1]['code'], 'document_too_large')
+        self.assertEqual(GenerationJob.objects.count(), 1)
+
+    def test_bulk_upload_requires_premium(self):
+        self.user.is_premium = False
+        self.user.save()
+
+        response = self.api.post(reverse('upload_documents_bulk'), {}, format='multipart')
+
+        self.assertEqual(response.status_code, 403)
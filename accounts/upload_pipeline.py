@@ -0,0 +1,252 @@
+"""
+Upload en pipeline : pendant que le stockage écrit le fichier reçu et calcule son
+hash, les mêmes blocs partent chez le fournisseur IA depuis un thread, au lieu
+d'être relus sur disque puis uploadés au moment de la génération. Seuls les
+fichiers qui seront transmis tels quels sont concernés (pas de texte extractible
+localement, pas de réduction à certaines pages) ; le file_id obtenu est enregistré
+dans le cache des fichiers (ProviderFile) sous le hash du contenu.
+"""
+import io
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from .models import ProviderFile
+from .ingestion import DOCUMENT_EXTENSIONS
+from .extraction import can_extract_text
+from .pdf_pages import PdfWriter, get_pdf_page_count, is_pdf
+from .provider_files import ProviderFileCache, delete_remote_file, get_upload_name
+from .ai_providers import get_ai_provider
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+class UploadAborted(IOError):
+    """Upload en pipeline abandonné (contenu déjà chez le fournisseur, échec de l'enregistrement)"""
+
+class ChunkPipe(io.RawIOBase):
+    """
+    Flux lu par le client du fournisseur pendant que le stockage écrit les mêmes
+    blocs. Au-delà de `buffer_bytes` en attente (réseau plus lent que le disque),
+    les blocs ne sont plus gardés en mémoire : la suite est relue dans le fichier
+    enregistré, à partir de la position atteinte.
+    """
+
+    def __init__(self, name, buffer_bytes):
+        super().__init__()
+        self.name = name
+        self.buffer_bytes = buffer_bytes
+        self.sent_bytes = 0
+        self._chunks = deque()
+        self._buffered = 0
+        self._buffered_total = 0
+        self._condition = threading.Condition()
+        self._writing_done = False
+        self._overflowed = False
+        self._aborted = False
+        self._source_path = None
+        self._source_file = None
+
+    @property
+    def aborted(self):
+        return self._aborted
+
+    def readable(self):
+        return True
+
+    def feed(self, chunk):
+        """Bloc écrit par le stockage ; ne bloque jamais la requête"""
+        with self._condition:
+            if self._overflowed or self._aborted or self._writing_done:
+                return
+            if self._buffered + len(chunk) > self.buffer_bytes:
+                self._overflowed = True
+            else:
+                self._chunks.append(bytes(chunk))
+                self._buffered += len(chunk)
+                self._buffered_total += len(chunk)
+            self._condition.notify_all()
+
+    def finish_writing(self, source_path):
+        """Fin de l'écriture : `source_path` est le fichier enregistré (lu en cas de débordement)"""
+        with self._condition:
+            self._writing_done = True
+            self._source_path = source_path
+            self._condition.notify_all()
+
+    def abort(self):
+        with self._condition:
+            self._aborted = True
+            self._condition.notify_all()
+
+    def readinto(self, buffer):
+        data = self._next_data(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self._source_file is not None:
+            self._source_file.close()
+            self._source_file = None
+        super().close()
+
+    def _next_data(self, size):
+        with self._condition:
+            while not (self._aborted or self._chunks or self._writing_done):
+                self._condition.wait()
+            if self._aborted:
+                raise UploadAborted("Upload en pipeline abandonné")
+            if self._chunks:
+                chunk = self._chunks.popleft()
+                if len(chunk) > size:
+                    self._chunks.appendleft(chunk[size:])
+                    chunk = chunk[:size]
+                self._buffered -= len(chunk)
+                self.sent_bytes += len(chunk)
+                return chunk
+            if not self._overflowed:
+                return b''
+
+        # Suite relue sur disque, après les blocs déjà transmis depuis la mémoire
+        if self._source_file is None:
+            self._source_file = open(self._source_path, 'rb')
+            self._source_file.seek(self._buffered_total)
+        data = self._source_file.read(size)
+        self.sent_bytes += len(data)
+        return data
+
+class TeeFile(File):
+    """Fichier uploadé dont chaque bloc lu par le stockage est aussi transmis au pipe"""
+
+    def __init__(self, file, pipe):
+        super().__init__(file, getattr(file, 'name', None))
+        self.pipe = pipe
+
+    def chunks(self, chunk_size=None):
+        for chunk in super().chunks(chunk_size):
+            self.pipe.feed(chunk)
+            yield chunk
+
+class PipelinedUpload:
+    """
+    Upload chez le fournisseur lancé avant l'enregistrement du document.
+    `wrap()` donne le fichier à enregistrer, `finish()` est appelé une fois le
+    document créé (le hash du contenu est alors connu), `cancel()` en cas d'échec.
+    """
+
+    def __init__(self, file):
+        self.pipe = ChunkPipe(os.path.basename(file.name), settings.AI_UPLOAD_PIPELINE_BUFFER_BYTES)
+        self.content_hash = ''
+        self._decided = threading.Event()
+        self.future = _get_executor().submit(self._upload)
+
+    def wrap(self, file):
+        return TeeFile(file, self.pipe)
+
+    def finish(self, document):
+        self.pipe.finish_writing(document.file.path)
+        if reserve_upload(document.content_hash):
+            self.content_hash = document.content_hash
+        else:
+            # Contenu déjà chez le fournisseur (ou en cours d'upload ailleurs)
+            logger.info(f"♻️ Fichier déjà connu du fournisseur, upload en pipeline abandonné: {document.content_hash[:12]}")
+            self.pipe.abort()
+        self._decided.set()
+
+    def cancel(self):
+        self.pipe.abort()
+        self._decided.set()
+
+    def _upload(self):
+        started = time.monotonic()
+        client = get_ai_provider()
+        try:
+            try:
+                # Un seul essai (le flux ne peut pas être relu, voir call_with_retry) : la
+                # génération refera un upload classique depuis le disque en cas d'échec
+                uploaded_file = client.files.create(file=(get_upload_name(self.pipe.name), self.pipe), purpose='assistants')
+            except Exception as e:
+                self._decided.wait(settings.AI_UPLOAD_PIPELINE_WAIT_SECONDS)
+                if self.content_hash:
+                    ProviderFile.objects.filter(content_hash=self.content_hash, status='uploading', file_id='').delete()
+                if not self.pipe.aborted:
+                    logger.warning(f"⚠️ Upload en pipeline échoué, le fichier sera uploadé à la génération: {e}")
+                return None
+            finally:
+                self.pipe.close()
+
+            self._decided.wait(settings.AI_UPLOAD_PIPELINE_WAIT_SECONDS)
+            if not self.content_hash:
+                delete_remote_file(client, uploaded_file.id)
+                return None
+            complete_upload(self.content_hash, uploaded_file.id, self.pipe.sent_bytes)
+            ProviderFileCache().evict(client)
+            logger.info(f"🚀 Fichier uploadé pendant son enregistrement ({self.pipe.sent_bytes} octets, {time.monotonic() - started:.2f}s): {uploaded_file.id}")
+            return uploaded_file.id
+        finally:
+            # Chaque thread du pool ouvre sa propre connexion
+            connection.close()
+
+def is_enabled():
+    return settings.AI_UPLOAD_PIPELINE_ENABLED
+
+def will_send_original(file, page_start=None, page_end=None, profile=None):
+    """
+    Vrai si le fichier sera envoyé tel quel au fournisseur à la génération :
+    document (pas image) dont le texte ne sera pas extrait localement (extraction
+    désactivée, format non pris en charge, ou PDF scanné d'après le `profile` du
+    contrôle préalable), sans plage de pages et sans échantillonnage des pages d'un PDF long
+    """
+    if os.path.splitext(file.name)[1].lower() not in DOCUMENT_EXTENSIONS:
+        return False
+    if page_start is not None or page_end is not None:
+        return False
+    has_text = (profile or {}).get('has_text')
+    if settings.AI_TEXT_EXTRACTION_ENABLED and can_extract_text(file.name) and has_text is not False:
+        return False
+    if is_pdf(file.name) and PdfWriter is not None and settings.AI_PDF_MAX_PAGES:
+        page_count = (profile or {}).get('page_count') or get_pdf_page_count(file)
+        return page_count is not None and page_count <= settings.AI_PDF_MAX_PAGES
+    return True
+
+def start_pipelined_upload(file, page_start=None, page_end=None, profile=None):
+    """Lance l'upload en pipeline du fichier reçu s'il sera envoyé tel quel, sinon None"""
+    if not is_enabled() or not will_send_original(file, page_start, page_end, profile):
+        return None
+    return PipelinedUpload(file)
+
+def reserve_upload(content_hash):
+    """Réserve l'entrée du cache des fichiers ; False si le contenu y est déjà"""
+    try:
+        with transaction.atomic():
+            ProviderFile.objects.create(content_hash=content_hash, status='uploading', file_id='')
+    except IntegrityError:
+        return False
+    return True
+
+def complete_upload(content_hash, file_id, size_bytes):
+    now = timezone.now()
+    ProviderFile.objects.filter(content_hash=content_hash).update(
+        file_id=file_id,
+        status='ready',
+        size_bytes=size_bytes,
+        last_used_at=now,
+        expires_at=now + ProviderFileCache().ttl,
+    )
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=settings.AI_UPLOAD_PIPELINE_WORKERS, thread_name_prefix='upload-pipeline')
+            _executor_pid = os.getpid()
+        return _executor
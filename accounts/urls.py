@@ -12,7 +12,10 @@ urlpatterns = [
     path('subscription/cancel/', views.cancel_subscription, name='cancel_subscription'),
     path('role-info/', views.user_role_info, name='user_role_info'),
     path('documents/upload/', views.upload_document, name='upload_document'),
+    path('documents/upload/stream/', views.upload_document_stream, name='upload_document_stream'),
+    path('documents/upload/bulk/', views.upload_documents_bulk, name='upload_documents_bulk'),
     path('documents/', views.get_documents, name='get_documents'),
+    path('generation-jobs/<int:job_id>/', views.get_generation_job, name='get_generation_job'),
     path('documents/<int:document_id>/questions/', views.get_questions, name='get_questions'),
     path('lessons/', views.get_lessons, name='get_lessons'),
     path('lessons/create/', views.create_lesson, name='create_lesson'),
@@ -8,8 +8,9 @@ from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.utils import timezone
 from django.conf import settings
+from django.db import transaction
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 import os
 import uuid
 import logging
@@ -24,8 +25,18 @@ from .serializers import (
     DocumentSerializer, QuestionSerializer, LessonSerializer, 
     UserAnswerSerializer, LessonStatsSerializer, LessonAttemptSerializer
 )
-from .models import User, Document, Question, Answer, Lesson, UserAnswer, LessonAttempt, GuestSession, StripePayment
-from ai_service import OpenAIService
+from .models import User, Document, Question, Answer, Lesson, UserAnswer, LessonAttempt, GuestSession, StripePayment, GenerationJob
+from .generation_jobs import STREAM_WORKER_ID, enqueue_generation_job, record_heartbeat
+from .ai_limiter import AIQueueTimeoutError, AISlot, get_job_queue_position, get_lane
+from .offline_questions import can_generate_offline, get_degraded_reason
+from .images import schedule_image_preparation
+from .ingestion import is_image
+from .pdf_pages import get_pdf_page_count, is_pdf
+from .upload_pipeline import start_pipelined_upload
+from .preflight import PreflightError, inspect_upload
+from .document_profile import build_profile, get_prompt_tokens, get_role_token_limit
+from .question_pool import get_pool_extra, get_pool_size, draw_pool_questions, schedule_pool_refill
+from .generation import stream_ai_questions, increment_generation_quota
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -377,8 +388,213 @@ def logout(request):
 @api_view(['POST'])
 @permission_classes([AllowAny])  # Permet aux guests
 def upload_document(request):
+    params, error_response = validate_upload_request(request)
+    if error_response is not None:
+        return error_response
+    
+    document = create_uploaded_document(params)
+    
+    # Mettre la génération en file : un worker (manage.py run_generation_worker) s'en charge
+    job = enqueue_generation_job(
+        document,
+        params['title'],
+        user=params['user'],
+        guest_session=params['guest_session'],
+        question_count=params['question_count'],
+        difficulty=params['difficulty'],
+        question_types=params['question_types'],
+        education_level=params['education_level'],
+        instructions=params['instructions'],
+        pool_extra=get_pool_extra(params['question_count'], params['user'])
+    )
+    
+    # Préparer la réponse
+    response_data = {
+        'job_id': job.id,
+        'status': job.status,
+        'queue_position': get_job_queue_position(job),
+        'document_id': document.id,
+        'title': document.title,
+        'message': 'Document uploadé, génération des questions en cours'
+    }
+    
+    # Ajouter l'ID de session pour les invités
+    if params['user_role'] == 'guest':
+        response_data['session_id'] = params['guest_session'].session_id
+        response_data['message'] = 'Document uploadé avec succès ! Inscrivez-vous pour sauvegarder vos résultats et créer plus de quiz.'
+    
+    return Response(response_data, status=status.HTTP_202_ACCEPTED)
+
+@api_view(['POST'])
+@permission_classes([AllowAny])  # Permet aux guests
+def upload_document_stream(request):
+    """
+    Variante de l'upload qui génère les questions dans la requête et les envoie
+    au client au fil de l'eau (Server-Sent Events) : événements `lesson`,
+    `question` (une par question), puis `done` ou `error`
+    """
+    params, error_response = validate_upload_request(request)
+    if error_response is not None:
+        return error_response
+    
+    document = create_uploaded_document(params)
+    lesson = Lesson.objects.create(
+        user=params['user'],
+        document=document,
+        title=params['title'],
+        difficulty='medium'
+    )
+    job = GenerationJob.objects.create(
+        document=document,
+        user=params['user'],
+        guest_session=params['guest_session'],
+        lesson=lesson,
+        title=params['title'],
+        question_count=params['question_count'],
+        difficulty=params['difficulty'],
+        question_types=params['question_types'],
+        education_level=params['education_level'],
+        instructions=params['instructions'],
+        status='running',
+        attempts=1,
+        worker_id=STREAM_WORKER_ID,
+        started_at=timezone.now(),
+        heartbeat_at=timezone.now()
+    )
+    
+    response = StreamingHttpResponse(
+        stream_question_events(job, lesson, params['guest_session']),
+        content_type='text/event-stream'
+    )
+    # Empêcher la mise en tampon par les proxys pour que chaque événement parte immédiatement
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def format_sse_event(event, data):
+    """Sérialise un événement au format Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def stream_question_events(job, lesson, guest_session=None):
+    """Génère les événements SSE d'une génération en streaming"""
+    question_count = 0
+    questions = None
+    slot = AISlot(get_lane(job.user), job=job)
+    try:
+        yield format_sse_event('lesson', {
+            'job_id': job.id,
+            'lesson_id': lesson.id,
+            'document_id': job.document_id,
+            'title': lesson.title,
+            'session_id': guest_session.session_id if guest_session else None,
+        })
+        
+        # Mode dégradé (fournisseur indisponible, file trop longue) : pas d'attente, questions construites localement
+        degraded = get_degraded_reason(slot.lane, job.document)
+        if degraded is None:
+            try:
+                # Attente d'une place dans le limiteur global des appels IA : position envoyée au client
+                for position in slot.wait():
+                    # Signe de vie pendant l'attente : le job ne doit pas passer pour abandonné
+                    record_heartbeat(job=job)
+                    yield format_sse_event('queue', {'position': position})
+            except AIQueueTimeoutError:
+                if not can_generate_offline(job.document):
+                    raise
+                degraded = 'queue_timeout'
+        
+        record_heartbeat(job=job)
+        questions = stream_ai_questions(job, lesson, slot=slot, degraded=degraded)
+        for question in questions:
+            question_count += 1
+            record_heartbeat(job=job)
+            yield format_sse_event('question', QuestionSerializer(question).data)
+        
+        if question_count == 0:
+            raise Exception("Aucune question n'a pu être générée")
+    
+    except GeneratorExit:
+        # Client déconnecté : arrêter la génération puis clore le job tout de suite, sans
+        # attendre qu'il soit jugé abandonné (il compterait d'ici là dans le quota)
+        if questions is not None:
+            questions.close()
+            questions = None
+        logger.info(f"🔌 Client déconnecté, génération en streaming interrompue (job {job.id}, {question_count} question(s) envoyée(s))")
+        end_stream_job(job, lesson, "Génération interrompue (client déconnecté)", question_count)
+        raise
+    
+    except Exception as e:
+        logger.error(f"❌ Génération en streaming échouée (job {job.id}): {e}")
+        end_stream_job(job, lesson, str(e), question_count)
+        yield format_sse_event('error', {'error': str(e), 'questions_received': question_count})
+        return
+    
+    finally:
+        # Client déconnecté : interrompre la génération avant de libérer la place
+        if questions is not None:
+            questions.close()
+        slot.release()
+    
+    increment_generation_quota(job.user, job.guest_session)
+    
+    job.status = 'done'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+    
+    yield format_sse_event('done', {'lesson_id': lesson.id, 'total_questions': question_count})
+    
+    # Le streaming ne génère que les questions demandées : préparer la réserve en arrière-plan
+    schedule_pool_refill(job.document)
+
+def end_stream_job(job, lesson, error, question_count):
+    """Marque en échec un job en streaming interrompu ; sans question envoyée, la leçon et le document sont supprimés"""
+    job.status = 'failed'
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    
+    # Garder les questions déjà reçues, sinon ne rien laisser derrière
+    if question_count == 0:
+        document = job.document
+        lesson.delete()
+        document.delete()
+
+def create_uploaded_document(params):
+    """
+    Enregistre le document uploadé. Un fichier qui sera transmis tel quel au
+    fournisseur lui est envoyé pendant son enregistrement (upload en pipeline) ;
+    la préparation des images pour le modèle de vision est lancée en arrière-plan.
+    """
+    file = params['file']
+    pipeline = start_pipelined_upload(file, params.get('page_start'), params.get('page_end'), params.get('profile'))
+    try:
+        document = Document.objects.create(
+            user=params['user'],
+            guest_session=params['guest_session'],
+            title=params['title'],
+            file=pipeline.wrap(file) if pipeline else file,
+            file_type=os.path.splitext(file.name)[1],
+            page_start=params.get('page_start'),
+            page_end=params.get('page_end'),
+            **params.get('profile', {})
+        )
+    except Exception:
+        if pipeline:
+            pipeline.cancel()
+        raise
+    if pipeline:
+        pipeline.finish(document)
+    if is_image(document.file.name):
+        schedule_image_preparation(document.file.path)
+    return document
+
+def validate_upload_request(request):
+    """
+    Valide le fichier et les paramètres d'upload selon le rôle du demandeur.
+    Retourne (paramètres, None) ou (None, Response d'erreur).
+    """
     if 'file' not in request.FILES:
-        return Response({'error': 'Aucun fichier fourni'}, status=status.HTTP_400_BAD_REQUEST)
+        return None, Response({'error': 'Aucun fichier fourni'}, status=status.HTTP_400_BAD_REQUEST)
     
     file = request.FILES['file']
     title = request.data.get('title', file.name)
@@ -392,27 +608,15 @@ def upload_document(request):
     session_id = request.data.get('session_id')  # ID de session pour les invités
     
     # Vérifier les limites selon le rôle utilisateur
+    guest_session = None
     user = request.user if request.user.is_authenticated else None
     user_role = user.get_user_role() if user else 'guest'
     
-    # Vérifier la taille du fichier selon le rôle utilisateur
-    file_size_mb = file.size / (1024 * 1024)  # Convertir en MB
-    
-    if user_role == 'guest' and file_size_mb > 2:
-        return Response({
-            'error': 'Fichier trop volumineux',
-            'details': f'Limite pour les invités : 2 MB. Taille actuelle : {file_size_mb:.1f} MB. Inscrivez-vous pour uploader des fichiers jusqu\'à 5 MB.'
-        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
-    elif user_role == 'free' and file_size_mb > 5:
-        return Response({
-            'error': 'Fichier trop volumineux',
-            'details': f'Limite pour les comptes gratuits : 5 MB. Taille actuelle : {file_size_mb:.1f} MB. Passez à Premium pour uploader des fichiers jusqu\'à 50 MB.'
-        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
-    elif user_role == 'premium' and file_size_mb > 50:
-        return Response({
-            'error': 'Fichier trop volumineux',
-            'details': f'Limite pour les comptes Premium : 50 MB. Taille actuelle : {file_size_mb:.1f} MB.'
-        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    # Taille, contenu, plage de pages et poids du document, avant tout enregistrement
+    # et avant de consommer le quota des invités
+    file_params, file_error = validate_upload_file(file, request.data, question_count, user_role)
+    if file_error is not None:
+        return None, file_error
     
     # Vérifications spécifiques pour les invités
     if user_role == 'guest':
@@ -421,7 +625,7 @@ def upload_document(request):
         # Vérifier le rate limiting par IP (1 requête par session/IP)
         is_rate_allowed, remaining_requests = rate_limit_check(request, max_requests=1, window_minutes=60)
         if not is_rate_allowed:
-            return Response({
+            return None, Response({
                 'error': 'Trop de requêtes',
                 'details': 'Vous avez dépassé la limite de requêtes. Veuillez attendre avant de réessayer.',
                 'action': 'rate_limit_exceeded'
@@ -430,11 +634,11 @@ def upload_document(request):
         # Vérifier les limites de session invité
         is_allowed, guest_session, error_msg = check_guest_limits(request, session_id)
         if not is_allowed:
-            return Response(error_msg, status=status.HTTP_403_FORBIDDEN)
+            return None, Response(error_msg, status=status.HTTP_403_FORBIDDEN)
         
         # Vérifier les limites de questions pour les invités
         if question_count > 5:
-            return Response({
+            return None, Response({
                 'error': 'Limite atteinte. Les utilisateurs non connectés sont limités à 5 questions maximum.',
                 'details': 'Inscrivez-vous gratuitement pour créer des quiz avec plus de questions et sauvegarder vos résultats.',
                 'action': 'signup_required'
@@ -442,12 +646,12 @@ def upload_document(request):
     
     # Vérifications pour les utilisateurs connectés
     elif user_role == 'free' and question_count > 6:
-        return Response({
+        return None, Response({
             'error': 'Limite atteinte. Les comptes gratuits sont limités à 6 questions maximum.',
             'details': 'Passez à Premium pour créer des quiz avec jusqu\'à 50 questions.'
         }, status=status.HTTP_403_FORBIDDEN)
     elif user_role == 'premium' and question_count > 50:
-        return Response({
+        return None, Response({
             'error': 'Limite atteinte. Les comptes premium sont limités à 50 questions maximum par quiz.',
             'details': 'Cette limite permet d\'assurer la qualité et la performance des quiz.'
         }, status=status.HTTP_403_FORBIDDEN)
@@ -455,259 +659,233 @@ def upload_document(request):
     # Vérifier les limites de quiz par jour pour les utilisateurs connectés
     if user and not user.can_create_quiz_today():
         if user_role == 'free':
-            return Response({
+            return None, Response({
                 'error': 'Limite de quiz quotidienne atteinte. Vous avez utilisé votre quota gratuit du jour.',
                 'details': 'Passez à Premium pour un accès illimité et débloquer toutes les fonctionnalités.'
             }, status=status.HTTP_403_FORBIDDEN)
         else:
-            return Response({'error': 'Limite de quiz quotidienne atteinte. Passez à Premium pour un accès illimité.'}, status=status.HTTP_403_FORBIDDEN)
+            return None, Response({'error': 'Limite de quiz quotidienne atteinte. Passez à Premium pour un accès illimité.'}, status=status.HTTP_403_FORBIDDEN)
     
-    # Sauvegarder le fichier
-    file_extension = os.path.splitext(file.name)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
+    return {
+        'file': file,
+        'title': title,
+        'question_count': question_count,
+        'difficulty': difficulty,
+        'question_types': question_types,
+        'education_level': education_level,
+        'instructions': instructions,
+        **file_params,
+        'user': user,
+        'user_role': user_role,
+        'guest_session': guest_session if user_role == 'guest' else None,
+    }, None
+
+def validate_upload_file(file, data, question_count, user_role):
+    """
+    Contrôles d'un fichier uploadé selon le rôle : taille, contenu, plage de pages
+    (`page_start` / `page_end` de `data`) et poids du document pour le modèle.
+    Retourne ({'profile', 'page_start', 'page_end'}, None) ou (None, Response d'erreur).
+    """
+    # Vérifier la taille du fichier selon le rôle utilisateur
+    size_error = check_file_size(file, user_role)
+    if size_error is not None:
+        return None, size_error
     
-    # Pour les guests, créer un utilisateur temporaire ou utiliser None
-    document_user = user if user else None
+    # Contrôles rapides du contenu (type réel, PDF protégé ou corrompu, texte)
+    profile, preflight_error = check_file_content(file)
+    if preflight_error is not None:
+        return None, preflight_error
     
-    document = Document.objects.create(
-        user=document_user,
-        guest_session=guest_session if user_role == 'guest' else None,
-        title=title,
-        file=file,
-        file_type=file_extension
-    )
+    # Plage de pages optionnelle (PDF) : seules ces pages servent à la génération
+    page_start, page_end, page_error = parse_page_range(data, file)
+    if page_error is not None:
+        return None, page_error
     
-    # Générer des questions avec l'IA
-    try:
-        create_ai_questions(document, question_count, difficulty, question_types, education_level, instructions)
-    except Exception as e:
-        # Supprimer le document en cas d'erreur
-        document.delete()
-        logger.error(f"❌ Erreur lors de la génération des questions: {e}")
-        return Response({
-            'error': str(e),
-            'details': 'Erreur lors de la génération des questions. Veuillez réessayer.'
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    # Document trop lourd pour le rôle (d'après son profil, pages retenues comprises)
+    budget_error = check_document_budget(file, profile, page_start, page_end, question_count, user_role)
+    if budget_error is not None:
+        return None, budget_error
     
-    # Créer automatiquement une leçon
-    lesson = Lesson.objects.create(
-        user=document_user,
-        document=document,
-        title=title,
-        difficulty='medium'
-    )
+    return {'profile': profile, 'page_start': page_start, 'page_end': page_end}, None
+
+def check_file_size(file, user_role):
+    """Vérifie la taille du fichier selon le rôle utilisateur. Retourne None ou une Response d'erreur."""
+    file_size_mb = file.size / (1024 * 1024)  # Convertir en MB
     
-    # Incrémenter le compteur de quiz pour les utilisateurs connectés
-    if user:
-        user.increment_quiz_count()
-    else:
-        # Incrémenter l'utilisation pour les invités
-        from .guest_utils import increment_guest_usage
-        increment_guest_usage(guest_session)
+    if user_role == 'guest' and file_size_mb > 2:
+        return Response({
+            'error': 'Fichier trop volumineux',
+            'details': f'Limite pour les invités : 2 MB. Taille actuelle : {file_size_mb:.1f} MB. Inscrivez-vous pour uploader des fichiers jusqu\'à 5 MB.'
+        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    elif user_role == 'free' and file_size_mb > 5:
+        return Response({
+            'error': 'Fichier trop volumineux',
+            'details': f'Limite pour les comptes gratuits : 5 MB. Taille actuelle : {file_size_mb:.1f} MB. Passez à Premium pour uploader des fichiers jusqu\'à 50 MB.'
+        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    elif user_role == 'premium' and file_size_mb > 50:
+        return Response({
+            'error': 'Fichier trop volumineux',
+            'details': f'Limite pour les comptes Premium : 50 MB. Taille actuelle : {file_size_mb:.1f} MB.'
+        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    return None
+
+def check_file_content(file):
+    """
+    Contrôles préalables du fichier (voir accounts.preflight).
+    Retourne (profil du document, None) ou (None, Response d'erreur).
+    """
+    try:
+        return build_profile(file, inspect_upload(file)), None
+    except PreflightError as e:
+        logger.info(f"🚫 Fichier refusé avant enregistrement ({e.code}): {file.name}")
+        return None, Response(e.to_dict(), status=e.status_code)
+
+def check_document_budget(file, profile, page_start, page_end, question_count, user_role):
+    """Vérifie la taille du document lu par le modèle selon le rôle. Retourne None ou une Response d'erreur."""
+    limit = get_role_token_limit(user_role)
+    if not limit:
+        return None
+    prompt_tokens = get_prompt_tokens(Document(file=file, page_start=page_start, page_end=page_end, **profile), question_count)
+    if prompt_tokens <= limit:
+        return None
+    return Response({
+        'error': 'Document trop volumineux pour votre compte',
+        'code': 'document_too_large',
+        'details': f'Ce document représente environ {prompt_tokens} tokens à analyser (limite : {limit}). Sélectionnez une plage de pages plus courte ou passez à un compte supérieur.',
+        'estimated_tokens': prompt_tokens,
+    }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+def parse_page_range(data, file):
+    """
+    Lit `page_start` / `page_end` (numéros de pages à partir de 1, bornes incluses).
+    Retourne (début, fin, None) ou (None, None, Response d'erreur). Une fin au-delà
+    de la dernière page est ramenée à celle-ci.
+    """
+    raw_start, raw_end = data.get('page_start'), data.get('page_end')
+    if raw_start in (None, '') and raw_end in (None, ''):
+        return None, None, None
     
-    # Associer les questions du document à la leçon
-    questions = Question.objects.filter(document=document)
-    lesson.total_questions = questions.count()
-    lesson.save()
+    try:
+        page_start = int(raw_start) if raw_start not in (None, '') else None
+        page_end = int(raw_end) if raw_end not in (None, '') else None
+    except (TypeError, ValueError):
+        return None, None, Response({'error': 'Plage de pages invalide : page_start et page_end doivent être des nombres.'}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Mettre à jour les questions pour les associer à la leçon
-    questions.update(lesson=lesson)
+    if (page_start is not None and page_start < 1) or (page_end is not None and page_end < 1):
+        return None, None, Response({'error': 'Plage de pages invalide : les pages sont numérotées à partir de 1.'}, status=status.HTTP_400_BAD_REQUEST)
+    if page_start is not None and page_end is not None and page_start > page_end:
+        return None, None, Response({'error': 'Plage de pages invalide : page_start doit être inférieure ou égale à page_end.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not is_pdf(file.name):
+        return None, None, Response({'error': 'La sélection de pages n\'est possible que pour les fichiers PDF.'}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Préparer la réponse
-    response_data = {
-        'document_id': document.id,
-        'lesson_id': lesson.id,
-        'title': document.title,
-        'questions_count': questions.count(),
-        'message': 'Document uploadé et questions générées avec succès'
-    }
+    page_count = get_pdf_page_count(file)
+    if page_count is not None:
+        if page_start is not None and page_start > page_count:
+            return None, None, Response({
+                'error': f'Plage de pages invalide : le document ne compte que {page_count} page(s).'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if page_end is not None:
+            page_end = min(page_end, page_count)
+    return page_start, page_end, None
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def upload_documents_bulk(request):
+    """
+    Upload groupé (Premium) : plusieurs fichiers `files` dans une requête, un quiz
+    par fichier. Chaque fichier passe les mêmes contrôles qu'un upload simple, puis
+    sa génération est mise en file pour le worker. La réponse (202) donne un
+    résultat par fichier : job en file, ou fichier refusé avec son erreur.
+    """
+    user = request.user
+    if user.get_user_role() != 'premium':
+        return Response({
+            'error': 'L\'upload de plusieurs fichiers est réservé aux comptes Premium.',
+            'details': 'Passez à Premium pour importer un cours complet en une seule fois.'
+        }, status=status.HTTP_403_FORBIDDEN)
     
-    # Ajouter l'ID de session pour les invités
-    if user_role == 'guest':
-        response_data['session_id'] = guest_session.session_id
-        response_data['remaining_uses'] = 0  # Plus d'utilisations disponibles
-        response_data['message'] = 'Document uploadé avec succès ! Inscrivez-vous pour sauvegarder vos résultats et créer plus de quiz.'
+    files = request.FILES.getlist('files')
+    if not files:
+        return Response({'error': 'Aucun fichier fourni'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(files) > settings.BULK_UPLOAD_MAX_FILES:
+        return Response({
+            'error': f'Trop de fichiers : {settings.BULK_UPLOAD_MAX_FILES} maximum par envoi.'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    return Response(response_data, status=status.HTTP_201_CREATED)
-
-def create_ai_questions(document, question_count=5, difficulty='medium', question_types='["qcm"]', education_level='', instructions=''):
-    """Crée des questions avec l'IA OpenAI"""
+    question_count = int(request.data.get('question_count', 5))
+    if question_count > 50:
+        return Response({
+            'error': 'Limite atteinte. Les comptes premium sont limités à 50 questions maximum par quiz.',
+            'details': 'Cette limite permet d\'assurer la qualité et la performance des quiz.'
+        }, status=status.HTTP_403_FORBIDDEN)
     
-    try:
-        # Vérifier que le fichier existe
-        if not document.file or not os.path.exists(document.file.path):
-            raise Exception(f"Fichier non trouvé: {document.file.path if document.file else 'Aucun fichier'}")
-        
-        # Utiliser le service OpenAI avec le chemin du fichier
-        ai_service = OpenAIService()
-        questions_data = ai_service.generate_questions_from_document(
-            file_path=document.file.path,
-            document_title=document.title,
+    # Valider tous les fichiers avant de mettre la moindre génération en file
+    results = [None] * len(files)
+    accepted = []
+    for index, file in enumerate(files):
+        file_params, file_error = validate_upload_file(file, request.data, question_count, 'premium')
+        if file_error is not None:
+            results[index] = {'index': index, 'filename': file.name, 'status': 'rejected', **file_error.data}
+        else:
+            accepted.append((index, file_params))
+    
+    for index, file_params in accepted:
+        file = files[index]
+        document = create_uploaded_document({
+            'file': file,
+            'title': os.path.splitext(file.name)[0],
+            **file_params,
+            'user': user,
+            'guest_session': None,
+        })
+        job = enqueue_generation_job(
+            document,
+            document.title,
+            user=user,
             question_count=question_count,
-            difficulty=difficulty,
-            education_level=education_level,
-            instructions=instructions
+            difficulty=request.data.get('difficulty', 'medium'),
+            question_types=request.data.get('question_types', '["qcm"]'),
+            education_level=request.data.get('education_level', ''),
+            instructions=request.data.get('instructions', ''),
+            pool_extra=get_pool_extra(question_count, user)
         )
-        
-        # Créer les questions et réponses
-        for q_data in questions_data:
-            question = Question.objects.create(
-                document=document,
-                question_text=q_data['question_text'],
-                question_type='qcm',
-                difficulty=q_data['difficulty']
-            )
-            
-            # Créer les réponses
-            for answer_data in q_data['answers']:
-                Answer.objects.create(
-                    question=question,
-                    answer_text=answer_data['text'],
-                    is_correct=answer_data['is_correct']
-                )
-        
-        return True
-        
-    except Exception as e:
-        print(f"Erreur lors de la génération IA: {e}")
-        raise Exception(f"Impossible de générer les questions avec l'IA: {e}")
-
-def create_mock_questions(document, question_count=5, difficulty='medium', question_types='["qcm"]'):
-    """Crée des questions mockées pour le document - Fallback"""
+        results[index] = {
+            'index': index,
+            'filename': file.name,
+            'job_id': job.id,
+            'status': job.status,
+            'document_id': document.id,
+        }
     
-    # Simuler un délai de traitement IA
-    import time
-    import json
-    time.sleep(1)  # Simulation du temps de traitement
+    logger.info(f"📚 Upload groupé: {len(accepted)} fichier(s) mis en file, {len(files) - len(accepted)} refusé(s)")
     
-    # Parser les types de questions
+    return Response({
+        'results': results,
+        'job_ids': [results[index]['job_id'] for index, _ in accepted],
+        'queued': len(accepted),
+        'rejected': len(files) - len(accepted),
+    }, status=status.HTTP_202_ACCEPTED if accepted else status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def get_generation_job(request, job_id):
+    """Retourne le statut d'un job de génération (queued/running/done/failed)"""
     try:
-        types_list = json.loads(question_types)
-    except:
-        types_list = ['qcm']
-    
-    # Questions générées "par l'IA" basées sur le type de fichier
-    file_type = document.file_type.lower()
-    
-    # Templates de questions selon le type de fichier
-    if 'pdf' in file_type or 'doc' in file_type:
-        # Questions pour documents textuels
-        question_templates = [
-            {
-                'text': f"Quel est le sujet principal abordé dans le document '{document.title}' ?",
-                'answers': [
-                    {'text': 'Les concepts fondamentaux', 'correct': True},
-                    {'text': 'Les détails techniques', 'correct': False},
-                    {'text': 'Les exemples pratiques', 'correct': False},
-                    {'text': 'Les conclusions', 'correct': False}
-                ]
-            },
-            {
-                'text': "Quelle méthode est recommandée dans ce document ?",
-                'answers': [
-                    {'text': 'La méthode traditionnelle', 'correct': False},
-                    {'text': 'La méthode progressive', 'correct': True},
-                    {'text': 'La méthode rapide', 'correct': False},
-                    {'text': 'La méthode alternative', 'correct': False}
-                ]
-            },
-            {
-                'text': "Selon le document, quel est le point le plus important à retenir ?",
-                'answers': [
-                    {'text': 'Les détails techniques', 'correct': False},
-                    {'text': "L'approche globale", 'correct': True},
-                    {'text': 'Les exemples concrets', 'correct': False},
-                    {'text': 'Les limitations', 'correct': False}
-                ]
-            },
-            {
-                'text': "Quelle est la structure principale de ce document ?",
-                'answers': [
-                    {'text': 'Introduction, développement, conclusion', 'correct': True},
-                    {'text': 'Problème, solution, évaluation', 'correct': False},
-                    {'text': 'Thèse, arguments, réfutation', 'correct': False},
-                    {'text': 'Contexte, analyse, recommandations', 'correct': False}
-                ]
-            },
-            {
-                'text': "Quel est l'objectif principal de ce document ?",
-                'answers': [
-                    {'text': 'Informer le lecteur', 'correct': True},
-                    {'text': 'Persuader le lecteur', 'correct': False},
-                    {'text': 'Divertir le lecteur', 'correct': False},
-                    {'text': 'Critiquer une théorie', 'correct': False}
-                ]
-            }
-        ]
-    else:
-        # Questions pour images/photos
-        question_templates = [
-            {
-                'text': f"Que représente l'image '{document.title}' ?",
-                'answers': [
-                    {'text': 'Un diagramme explicatif', 'correct': True},
-                    {'text': 'Une photographie', 'correct': False},
-                    {'text': 'Un graphique', 'correct': False},
-                    {'text': 'Un schéma technique', 'correct': False}
-                ]
-            },
-            {
-                'text': "Quel élément est le plus visible dans cette image ?",
-                'answers': [
-                    {'text': 'Le texte principal', 'correct': True},
-                    {'text': 'Les détails secondaires', 'correct': False},
-                    {'text': "L'arrière-plan", 'correct': False},
-                    {'text': 'Les annotations', 'correct': False}
-                ]
-            },
-            {
-                'text': "Quelle est la fonction principale de cette image ?",
-                'answers': [
-                    {'text': 'Illustrer un concept', 'correct': True},
-                    {'text': 'Décorer le document', 'correct': False},
-                    {'text': 'Montrer un exemple', 'correct': False},
-                    {'text': 'Expliquer un processus', 'correct': False}
-                ]
-            },
-            {
-                'text': "Quel type de contenu cette image présente-t-elle ?",
-                'answers': [
-                    {'text': 'Du contenu éducatif', 'correct': True},
-                    {'text': 'Du contenu publicitaire', 'correct': False},
-                    {'text': 'Du contenu artistique', 'correct': False},
-                    {'text': 'Du contenu technique', 'correct': False}
-                ]
-            },
-            {
-                'text': "Dans quel contexte cette image est-elle utilisée ?",
-                'answers': [
-                    {'text': 'Dans un contexte pédagogique', 'correct': True},
-                    {'text': 'Dans un contexte commercial', 'correct': False},
-                    {'text': 'Dans un contexte scientifique', 'correct': False},
-                    {'text': 'Dans un contexte artistique', 'correct': False}
-                ]
-            }
-        ]
+        job = GenerationJob.objects.get(id=job_id)
+    except GenerationJob.DoesNotExist:
+        return Response({'error': 'Génération non trouvée'}, status=status.HTTP_404_NOT_FOUND)
     
-    # Sélectionner le nombre de questions demandé
-    selected_questions = question_templates[:question_count]
+    if request.user.is_authenticated:
+        if job.user_id != request.user.id:
+            return Response({'error': 'Accès refusé'}, status=status.HTTP_403_FORBIDDEN)
+    else:
+        # Invité - vérifier la session
+        from .guest_utils import get_or_create_guest_session
+        guest_session = get_or_create_guest_session(request, request.GET.get('session_id'))
+        if job.user_id is not None or job.guest_session_id != guest_session.id:
+            return Response({'error': 'Accès refusé'}, status=status.HTTP_403_FORBIDDEN)
     
-    # Créer les questions et réponses
-    for q_data in selected_questions:
-        question = Question.objects.create(
-            document=document,
-            question_text=q_data['text'],
-            question_type='qcm',  # Seulement QCM
-            difficulty=difficulty
-        )
-        
-        # Ajouter les réponses pour les QCM
-        for answer_data in q_data['answers']:
-            Answer.objects.create(
-                question=question,
-                answer_text=answer_data['text'],
-                is_correct=answer_data['correct']
-            )
+    return Response({**job.to_status_dict(), 'queue_position': get_job_queue_position(job)})
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -721,7 +899,7 @@ def get_documents(request):
 def get_questions(request, document_id):
     try:
         document = Document.objects.get(id=document_id, user=request.user)
-        questions = Question.objects.filter(document=document).order_by('created_at')
+        questions = Question.objects.filter(document=document, in_pool=False).order_by('created_at')
         serializer = QuestionSerializer(questions, many=True)
         return Response(serializer.data)
     except Document.DoesNotExist:
@@ -743,6 +921,10 @@ def create_lesson(request):
         document_id = request.data.get('document_id')
         document = Document.objects.get(id=document_id, user=request.user)
         
+        # Nouvelle leçon servie instantanément par la réserve de questions du document
+        if request.data.get('question_count'):
+            return create_lesson_from_pool(request, document)
+        
         # Créer la leçon
         lesson = Lesson.objects.create(
             user=request.user,
@@ -752,7 +934,7 @@ def create_lesson(request):
         )
         
         # Associer les questions du document à la leçon
-        questions = Question.objects.filter(document=document)
+        questions = Question.objects.filter(document=document, in_pool=False, retired=False)
         lesson.total_questions = questions.count()
         lesson.save()
         
@@ -767,6 +949,52 @@ def create_lesson(request):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+def pool_shortage_response(document):
+    """Réserve insuffisante : un remplissage est mis en file et le client est invité à réessayer"""
+    schedule_pool_refill(document)
+    return Response({
+        'error': 'Pas encore assez de nouvelles questions pour ce cours.',
+        'details': 'De nouvelles questions sont en préparation, réessayez dans quelques instants.',
+        'pool_size': get_pool_size(document)
+    }, status=status.HTTP_409_CONFLICT)
+
+def create_lesson_from_pool(request, document):
+    """Crée une leçon avec des questions jamais montrées tirées de la réserve du document"""
+    question_count = int(request.data.get('question_count'))
+    difficulty = request.data.get('difficulty', 'medium')
+    max_questions = 50 if request.user.get_user_role() == 'premium' else 6
+    if question_count < 1 or question_count > max_questions:
+        return Response({'error': f'Le nombre de questions doit être compris entre 1 et {max_questions}.'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not request.user.can_create_quiz_today():
+        return Response({
+            'error': 'Limite de quiz quotidienne atteinte. Vous avez utilisé votre quota gratuit du jour.',
+            'details': 'Passez à Premium pour un accès illimité et débloquer toutes les fonctionnalités.'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    # Tirer d'abord puis vérifier : deux requêtes concurrentes ne peuvent pas créer une leçon incomplète
+    with transaction.atomic():
+        lesson = Lesson.objects.create(
+            user=request.user,
+            document=document,
+            title=request.data.get('title', document.title),
+            difficulty=difficulty
+        )
+        drawn = draw_pool_questions(document, lesson, question_count, difficulty)
+        if drawn < question_count:
+            transaction.set_rollback(True)
+        else:
+            lesson.total_questions = drawn
+            lesson.save(update_fields=['total_questions'])
+    if drawn < question_count:
+        return pool_shortage_response(document)
+    
+    increment_generation_quota(request.user)
+    schedule_pool_refill(document)
+    
+    serializer = LessonSerializer(lesson)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_lesson(request, lesson_id):
@@ -1059,17 +1287,39 @@ def reset_lesson(request, lesson_id):
     try:
         lesson = Lesson.objects.get(id=lesson_id, user=request.user)
         
-        # Supprimer toutes les réponses de l'utilisateur pour cette leçon
-        UserAnswer.objects.filter(user=request.user, lesson=lesson).delete()
+        # Reprise avec des questions jamais montrées, tirées de la réserve du document
+        new_questions = str(request.data.get('new_questions', '')).lower() in ('true', '1', 'yes')
+        question_count = lesson.total_questions or 5
         
-        # Réinitialiser seulement les champs nécessaires pour relancer le quiz
-        lesson.completed_questions = 0
-        lesson.score = 0
-        lesson.status = 'en_cours'
-        # NE PAS réinitialiser last_score, total_attempts, average_score
-        lesson.save()
+        # Tout-ou-rien : si un tirage concurrent a vidé la réserve, la leçon reste intacte
+        with transaction.atomic():
+            # Supprimer toutes les réponses de l'utilisateur pour cette leçon
+            UserAnswer.objects.filter(user=request.user, lesson=lesson).delete()
+            
+            drawn = question_count
+            if new_questions:
+                # Les questions déjà vues restent rattachées au document (historique des tentatives),
+                # marquées retirées pour qu'aucune autre leçon ne les reprenne
+                Question.objects.filter(lesson=lesson).update(lesson=None, retired=True)
+                drawn = draw_pool_questions(lesson.document, lesson, question_count, lesson.difficulty)
+                lesson.total_questions = drawn
+            
+            if drawn < question_count:
+                transaction.set_rollback(True)
+            else:
+                # Réinitialiser seulement les champs nécessaires pour relancer le quiz
+                lesson.completed_questions = 0
+                lesson.score = 0
+                lesson.status = 'en_cours'
+                # NE PAS réinitialiser last_score, total_attempts, average_score
+                lesson.save()
+        if drawn < question_count:
+            return pool_shortage_response(lesson.document)
         
-        return Response({'message': 'Leçon réinitialisée avec succès'})
+        if new_questions:
+            schedule_pool_refill(lesson.document)
+        
+        return Response({'message': 'Leçon réinitialisée avec succès', 'total_questions': lesson.total_questions})
         
     except Lesson.DoesNotExist:
         return Response({'error': 'Leçon non trouvée'}, status=status.HTTP_404_NOT_FOUND)
@@ -1140,18 +1390,12 @@ def delete_lesson(request, lesson_id):
         # 4. Supprimer toutes les questions associées au document
         Question.objects.filter(document=document).delete()
         
-        # 5. Supprimer le document (fichier physique)
-        if document.file:
-            try:
-                if os.path.isfile(document.file.path):
-                    os.remove(document.file.path)
-            except Exception as e:
-                logger.warning(f"⚠️ Impossible de supprimer le fichier physique: {e}")
-        
-        # 6. Supprimer le document de la base de données
+        # 5. Supprimer le document de la base de données
+        # (le fichier physique est supprimé par le signal post_delete
+        # seulement si aucun autre document ne partage le même contenu)
         document.delete()
         
-        # 7. Supprimer la leçon
+        # 6. Supprimer la leçon
         lesson.delete()
         
         logger.info(f"✅ Leçon {lesson_id} supprimée avec succès par l'utilisateur {request.user.id}")
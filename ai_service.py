@@ -4,90 +4,85 @@ Service pour l'intégration avec l'API OpenAI
 import os
 import openai
 from django.conf import settings
-import json
+import re
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from accounts.ingestion import DOCUMENT_EXTENSIONS, get_mime_type, build_image_data_url
+from accounts.images import get_vision_image
+from accounts.provider_files import get_upload_name
+from accounts.quiz_parser import IncrementalQuestionParser, parse_questions
+from accounts.ai_providers import CircuitOpenError, get_ai_provider
+from accounts.model_routing import record_model_call
+from accounts.similarity import SimilarityIndex
 
 logger = logging.getLogger(__name__)
 
-class OpenAIService:
-    def __init__(self):
-        self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-    
-    def generate_questions_from_document(self, file_path, document_title, question_count=5, difficulty='medium', education_level='', instructions=''):
-        """
-        Génère des questions QCM à partir d'un fichier directement transmis à l'IA
-        """
-        try:
-            import base64
-            
-            logger.info(f"🚀 Début de génération IA pour le document: {document_title}")
-            logger.info(f"📁 Chemin du fichier: {file_path}")
-            logger.info(f"📊 Paramètres: {question_count} questions, difficulté {difficulty}, niveau {education_level}")
-            logger.info(f"📝 Instructions personnalisées: {instructions[:100] if instructions else 'Aucune'}...")
-            
-            # Vérifier la clé API
-            if not settings.OPENAI_API_KEY:
-                logger.error("❌ Clé API OpenAI manquante dans les paramètres")
-                raise Exception("Configuration OpenAI manquante")
-            
-            logger.info(f"🔑 Clé API OpenAI configurée: {settings.OPENAI_API_KEY[:10]}...")
-            
-            # Construire le contexte éducatif détaillé
-            education_context = self._build_education_context(education_level)
-            
-            # Lire le fichier et l'encoder en base64
-            logger.info(f"📖 Lecture du fichier: {file_path}")
-            with open(file_path, 'rb') as f:
-                file_data = f.read()
-                file_base64 = base64.b64encode(file_data).decode('utf-8')
-            
-            logger.info(f"📏 Taille du fichier: {len(file_data)} bytes")
-            logger.info(f"📏 Taille base64: {len(file_base64)} caractères")
-            
-            # Déterminer le type MIME du fichier
-            file_extension = os.path.splitext(file_path)[1].lower()
-            mime_types = {
-                '.pdf': 'application/pdf',
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.png': 'image/png',
-                '.gif': 'image/gif',
-                '.webp': 'image/webp',
-                '.txt': 'text/plain',
-                '.md': 'text/markdown',
-                '.json': 'application/json',
-                '.csv': 'text/csv',
-                '.xml': 'application/xml',
-                '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-                '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            }
-            
-            mime_type = mime_types.get(file_extension, 'application/octet-stream')
-            logger.info(f"🏷️ Extension: {file_extension}, Type MIME: {mime_type}")
-            
-            # Construire les instructions personnalisées
-            custom_instructions = ""
-            if instructions and instructions.strip():
-                custom_instructions = f"""
+# Numérotation en tête de question ("1. ", "Question 3 :", "Q4)") propre à chaque lot
+QUESTION_NUMBERING_PATTERN = re.compile(r'^\s*(?:question\s*|q)?\d{1,2}\s*[\.\):\-–]\s*', re.IGNORECASE)
 
-Instructions personnalisées de l'utilisateur:
-{instructions.strip()}
+# Questions existantes rappelées au modèle lors d'un complément après des quasi-doublons
+TOP_UP_AVOID_LIMIT = 30
 
-IMPORTANT: Respecte ces instructions personnalisées lors de la génération des questions. Elles ont la priorité sur les instructions générales ci-dessous.
-"""
+def question_key(question_text):
+    """Clé de comparaison des questions (sans numérotation, casse ni espaces multiples)"""
+    text = QUESTION_NUMBERING_PATTERN.sub('', question_text).strip()
+    return ' '.join(text.lower().split())
 
-            # Prompt pour générer des questions QCM
-            prompt = f"""
-Tu es un expert en pédagogie et en didactique. Génère {question_count} questions à choix multiples (QCM) de haute qualité basées sur le document suivant.
+# Contextes éducatifs par niveau, insérés dans la partie variable du prompt
+DEFAULT_EDUCATION_CONTEXT = "Niveau d'éducation: Non spécifié - Adapte le contenu à un niveau général."
+EDUCATION_CONTEXTS = {
+    # Collège
+    "6ème": "Niveau: 6ème (11-12 ans) - Utilise un vocabulaire simple, des concepts concrets, évite le jargon technique. Questions basées sur la mémorisation et la compréhension de base.",
+    "5ème": "Niveau: 5ème (12-13 ans) - Vocabulaire accessible, concepts progressivement plus abstraits. Mélange mémorisation et compréhension.",
+    "4ème": "Niveau: 4ème (13-14 ans) - Vocabulaire de niveau collège, introduction de concepts plus complexes. Questions de compréhension et d'application basique.",
+    "3ème": "Niveau: 3ème (14-15 ans) - Vocabulaire de fin de collège, concepts abstraits maîtrisés. Questions d'application et d'analyse simple.",
 
-Titre du document: {document_title}
+    # Lycée
+    "2nde": "Niveau: 2nde (15-16 ans) - Vocabulaire lycéen, concepts abstraits. Questions de compréhension, application et analyse.",
+    "1ère": "Niveau: 1ère (16-17 ans) - Vocabulaire spécialisé selon la matière, concepts avancés. Questions d'analyse et de synthèse.",
+    "Terminale": "Niveau: Terminale (17-18 ans) - Vocabulaire expert, concepts complexes. Questions d'analyse, synthèse et évaluation.",
+    "Bac Pro": "Niveau: Bac Pro - Vocabulaire professionnel, applications concrètes. Questions pratiques et techniques.",
+    "Bac Techno": "Niveau: Bac Techno - Vocabulaire technique spécialisé, applications sectorielles. Questions techniques et appliquées.",
+    "CAP": "Niveau: CAP - Vocabulaire professionnel de base, applications pratiques. Questions concrètes et opérationnelles.",
 
-{education_context}{custom_instructions}
+    # Supérieur
+    "BTS": "Niveau: BTS - Vocabulaire professionnel avancé, applications sectorielles. Questions techniques et professionnelles.",
+    "DUT": "Niveau: DUT - Vocabulaire technique spécialisé, applications industrielles. Questions techniques et méthodologiques.",
+    "BUT": "Niveau: BUT - Vocabulaire technique expert, applications professionnelles. Questions techniques avancées et méthodologiques.",
+    "Licence": "Niveau: Licence - Vocabulaire académique, concepts théoriques. Questions d'analyse, synthèse et critique.",
+    "Licence Pro": "Niveau: Licence Pro - Vocabulaire professionnel expert, applications avancées. Questions techniques et managériales.",
+    "Master": "Niveau: Master - Vocabulaire académique expert, concepts avancés. Questions de recherche, analyse critique et innovation.",
+    "Master Pro": "Niveau: Master Pro - Vocabulaire professionnel expert, applications stratégiques. Questions de management et d'innovation.",
+    "Doctorat": "Niveau: Doctorat - Vocabulaire scientifique expert, concepts de pointe. Questions de recherche, innovation et contribution au savoir.",
+    "École d'ingénieur": "Niveau: École d'ingénieur - Vocabulaire technique expert, applications industrielles. Questions techniques, méthodologiques et d'innovation.",
+    "École de commerce": "Niveau: École de commerce - Vocabulaire business expert, applications stratégiques. Questions de management, stratégie et leadership.",
+    "École spécialisée": "Niveau: École spécialisée - Vocabulaire expert du domaine, applications professionnelles. Questions spécialisées et pratiques.",
+    "Formation continue": "Niveau: Formation continue - Vocabulaire professionnel adapté, applications pratiques. Questions opérationnelles et d'amélioration.",
+
+    # Professionnel
+    "En activité": "Niveau: Professionnel en activité - Vocabulaire professionnel, applications pratiques. Questions opérationnelles et d'efficacité.",
+    "En recherche d'emploi": "Niveau: Professionnel en recherche - Vocabulaire professionnel, applications pratiques. Questions de compétences et d'adaptation.",
+    "Retraité": "Niveau: Retraité - Vocabulaire accessible, applications concrètes. Questions de compréhension et d'application basique.",
+
+    # Autre
+    "Autre": "Niveau: Autre - Adapte le contenu à un niveau général accessible. Questions de compréhension et d'application."
+}
+
+# Température par défaut des générations (une règle de routage peut la changer)
+DEFAULT_TEMPERATURE = 0.6
+
+# Partie fixe du prompt, identique pour toutes les générations : placée en tête
+# des messages pour profiter du cache de préfixe du fournisseur. Tout ce qui
+# varie (document, titre, nombre, difficulté, instructions) vient après.
+SYSTEM_PROMPT = """Tu es un expert en pédagogie, didactique et évaluation. Tu génères des questions de quiz de haute qualité, adaptées au niveau d'éducation de l'utilisateur. Tu maîtrises les principes de la taxonomie de Bloom et adaptes le vocabulaire et la complexité selon le public cible. IMPORTANT: Tu dois toujours retourner un JSON valide et complet, même si tu dois réduire le nombre de questions pour respecter les limites de tokens.
+
+Tu génères des questions à choix multiples (QCM) de haute qualité basées sur le document fourni par l'utilisateur. Les paramètres de la demande (titre, niveau, nombre de questions, difficulté, instructions personnalisées) sont donnés à la fin du message de l'utilisateur, après le document.
 
 Instructions détaillées:
-- Génère exactement {question_count} questions QCM
-- Niveau de difficulté demandé: {difficulty}
+- Génère exactement le nombre de questions QCM demandé
+- Respecte le niveau de difficulté demandé
 - Chaque question doit avoir 4 options (A, B, C, D)
 - Une seule réponse correcte par question
 - Les questions doivent tester différents niveaux de compréhension :
@@ -103,257 +98,507 @@ Qualité des questions:
 - Varie les types de questions (définition, application, calcul, etc.)
 - Assure-toi que la réponse correcte est clairement la meilleure
 
+Instructions personnalisées: si l'utilisateur en donne, respecte-les lors de la génération des questions. Elles ont la priorité sur les instructions générales ci-dessus.
+
 Format de réponse: JSON avec la structure suivante:
-{{
+{
     "questions": [
-        {{
+        {
             "question_text": "Texte de la question claire et précise",
-            "difficulty": "{difficulty}",
+            "difficulty": "difficulté demandée (easy, medium ou hard)",
             "answers": [
-                {{"text": "Option A - réponse plausible", "is_correct": true}},
-                {{"text": "Option B - distracteur plausible", "is_correct": false}},
-                {{"text": "Option C - distracteur plausible", "is_correct": false}},
-                {{"text": "Option D - distracteur plausible", "is_correct": false}}
+                {"text": "Option A - réponse plausible", "is_correct": true},
+                {"text": "Option B - distracteur plausible", "is_correct": false},
+                {"text": "Option C - distracteur plausible", "is_correct": false},
+                {"text": "Option D - distracteur plausible", "is_correct": false}
             ]
-        }}
+        }
     ]
-}}
+}
 
-Réponds UNIQUEMENT avec le JSON, sans texte supplémentaire.
-"""
+Réponds UNIQUEMENT avec le JSON, sans texte supplémentaire."""
 
-            # Uploader le fichier d'abord
-            logger.info(f"📤 Upload du fichier vers OpenAI...")
-            uploaded_file = self.client.files.create(
-                file=open(file_path, 'rb'),
-                purpose='assistants'
-            )
-            logger.info(f"✅ Fichier uploadé avec l'ID: {uploaded_file.id}")
-            
-            # Construire le message avec le fichier
-            message_content = [
-                {"type": "text", "text": prompt}
-            ]
-            
-            # Ajouter le fichier selon son type
-            if file_extension in ['.pdf', '.txt', '.md', '.json', '.csv', '.xml', '.docx', '.pptx', '.xlsx']:
-                # Pour les documents, utiliser le type "file"
-                logger.info(f"📄 Ajout du document de type: {mime_type}")
-                message_content.append({
-                    "type": "file",
-                    "file": {
-                        "file_id": uploaded_file.id
-                    }
-                })
-            else:
-                # Pour les images, utiliser le type "image_url"
-                logger.info(f"🖼️ Ajout de l'image de type: {mime_type}")
-                message_content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{mime_type};base64,{file_base64}"
-                    }
-                })
-
-            logger.info(f"🤖 Envoi de la requête à OpenAI avec le modèle gpt-4o-mini")
-            logger.info(f"📝 Contenu du message: {len(message_content)} éléments")
-            
-            # Calculer max_tokens de manière très généreuse pour éviter les coupures
-            # Estimation large : 150 tokens par question + 1000 tokens de marge
-            estimated_tokens = (question_count * 150) + 1000
-            max_tokens = min(max(estimated_tokens, 2000), 8000)  # Entre 2000 et 8000 tokens
-            
-            logger.info(f"🎯 Max tokens généreux: {max_tokens} pour {question_count} questions (estimation: {estimated_tokens})")
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "Tu es un expert en pédagogie, didactique et évaluation. Tu génères des questions de quiz de haute qualité, adaptées au niveau d'éducation de l'utilisateur. Tu maîtrises les principes de la taxonomie de Bloom et adaptes le vocabulaire et la complexité selon le public cible. IMPORTANT: Tu dois toujours retourner un JSON valide et complet, même si tu dois réduire le nombre de questions pour respecter les limites de tokens."},
-                    {"role": "user", "content": message_content}
-                ],
-                max_tokens=max_tokens,
-                temperature=0.6
-            )
-            
-            logger.info(f"✅ Réponse reçue d'OpenAI")
-            
-            # Extraire le contenu de la réponse
-            content = response.choices[0].message.content.strip()
-            logger.info(f"📄 Contenu brut reçu: {content[:200]}...")
-            
-            # Nettoyer le contenu (enlever les markdown si présent)
-            if content.startswith('```json'):
-                content = content[7:]
-            if content.endswith('```'):
-                content = content[:-3]
-            if content.startswith('```'):
-                content = content[3:]
-            
-            # Nettoyer les espaces et caractères indésirables
-            content = content.strip()
-            
-            logger.info(f"🧹 Contenu nettoyé: {content[:200]}...")
-            
-            # Vérifier si le JSON semble complet
-            if not content.endswith('}'):
-                logger.warning("⚠️ Le JSON semble incomplet (ne se termine pas par '}')")
-                # Essayer de compléter le JSON
-                if content.count('{') > content.count('}'):
-                    missing_braces = content.count('{') - content.count('}')
-                    content += '}' * missing_braces
-                    logger.info(f"🔧 Ajout de {missing_braces} accolades fermantes")
-            
-            # Parser le JSON avec gestion d'erreur améliorée
-            try:
-                questions_data = json.loads(content)
-            except json.JSONDecodeError as json_error:
-                logger.error(f"❌ Erreur de parsing JSON: {json_error}")
-                logger.error(f"📍 Position de l'erreur: ligne {json_error.lineno}, colonne {json_error.colno}")
-                logger.error(f"📄 Contenu autour de l'erreur: {content[max(0, json_error.pos-50):json_error.pos+50]}")
-                
-                # Essayer de réparer le JSON
-                try:
-                    # Supprimer les caractères problématiques
-                    import re
-                    # Remplacer les guillemets simples par des guillemets doubles
-                    content = re.sub(r"'([^']*)':", r'"\1":', content)
-                    # Remplacer les guillemets simples dans les valeurs
-                    content = re.sub(r':\s*\'([^\']*)\'', r': "\1"', content)
-                    
-                    logger.info("🔧 Tentative de réparation du JSON...")
-                    questions_data = json.loads(content)
-                    logger.info("✅ JSON réparé avec succès!")
-                except:
-                    logger.error("❌ Impossible de réparer le JSON")
-                    raise Exception(f"Erreur de parsing JSON de la réponse IA: {json_error}")
-            
-            # Vérifier la structure du JSON
-            if 'questions' not in questions_data:
-                logger.error("❌ Structure JSON invalide: clé 'questions' manquante")
-                raise Exception("Structure JSON invalide: clé 'questions' manquante")
-            
-            if not isinstance(questions_data['questions'], list):
-                logger.error("❌ Structure JSON invalide: 'questions' n'est pas une liste")
-                raise Exception("Structure JSON invalide: 'questions' n'est pas une liste")
+class OpenAIService:
+    def __init__(self, file_cache=None, provider=None, model=None, temperature=None):
+        # Fournisseur IA (AI_PROVIDER) : même interface que le client OpenAI, avec
+        # reprise sur erreur et disjoncteur (voir accounts.ai_providers)
+        self.client = provider or get_ai_provider()
+        # Modèle et température choisis par le routage (voir accounts.model_routing)
+        self.model = model or settings.AI_MODEL
+        self.temperature = temperature if temperature is not None else DEFAULT_TEMPERATURE
+        # Cache optionnel des fichiers déjà uploadés (voir accounts.provider_files)
+        self.file_cache = file_cache
+        # Usage cumulé de la dernière génération (tokens, dont ceux servis par le cache de préfixe)
+        self._usage_lock = threading.Lock()
+        self._reset_usage()
+    
+    def generate_questions_from_document(self, file_path, document_title, question_count=5, difficulty='medium', education_level='', instructions='', content_hash='', document_text=None, duplicate_index=None, shard_size=None):
+        """
+        Génère des questions QCM à partir d'un fichier directement transmis à l'IA.
+        Les demandes importantes sont découpées en lots générés en parallèle
+        (`shard_size`, AI_SHARD_SIZE par défaut), puis fusionnées et dédoublonnées. Les quasi-doublons
+        (entre elles ou des questions de `duplicate_index`) sont écartés puis remplacés.
+        """
+        duplicate_index = SimilarityIndex() if duplicate_index is None else duplicate_index
+        # ID du fichier distant uploadé pour cet appel seulement (à supprimer à la fin)
+        owned_file_id = None
+        self._reset_usage()
+        try:
+            logger.info(f"🚀 Début de génération IA pour le document: {document_title}")
+            self._log_generation_parameters(file_path, question_count, difficulty, education_level, instructions)
             
-            logger.info(f"✅ JSON parsé avec succès, {len(questions_data['questions'])} questions générées")
+            # Construire le contexte éducatif détaillé
+            education_context = self._build_education_context(education_level)
             
-            # Nettoyer le fichier uploadé
-            try:
-                self.client.files.delete(uploaded_file.id)
-                logger.info(f"🗑️ Fichier temporaire supprimé: {uploaded_file.id}")
-            except Exception as cleanup_error:
-                logger.warning(f"⚠️ Impossible de supprimer le fichier temporaire: {cleanup_error}")
+            # Un seul upload partagé par tous les lots
+            attachment, owned_file_id = self._timed_prepare_attachment(file_path, content_hash, document_text)
             
-            return questions_data['questions']
+            shard_sizes = self._split_into_shards(question_count, shard_size)
             
-        except openai.AuthenticationError as e:
-            logger.error(f"❌ Erreur d'authentification OpenAI: {e}")
-            raise Exception("Erreur d'authentification avec l'API OpenAI. Vérifiez la configuration de la clé API.")
+            if len(shard_sizes) == 1:
+                questions = self._generate_shard(attachment, document_title, question_count, difficulty, education_context, instructions)
+            else:
+                logger.info(f"🧩 Génération découpée en {len(shard_sizes)} lots parallèles: {shard_sizes}")
+                questions = self._generate_shards_in_parallel(shard_sizes, attachment, document_title, difficulty, education_context, instructions)
+            questions = self._merge_questions(questions, question_count, duplicate_index)
             
-        except openai.RateLimitError as e:
-            logger.error(f"⏰ Limite de taux OpenAI atteinte: {e}")
-            raise Exception("Limite de requêtes atteinte. Veuillez réessayer dans quelques minutes.")
+            # Redemander seulement les questions perdues (sortie tronquée, questions écartées, doublons)
+            if len(questions) < question_count:
+                questions += self._top_up_questions(attachment, document_title, questions, question_count, difficulty, education_context, instructions, duplicate_index)
             
-        except openai.APIError as e:
-            logger.error(f"🔌 Erreur API OpenAI: {e}")
-            raise Exception("Erreur temporaire de l'API OpenAI. Veuillez réessayer.")
+            logger.info(f"✅ JSON parsé avec succès, {len(questions)} questions générées")
+            return questions
             
         except Exception as e:
-            logger.error(f"❌ Erreur inattendue lors de la génération IA: {e}")
-            logger.error(f"📋 Type d'erreur: {type(e).__name__}")
-            logger.error(f"📋 Détails: {str(e)}")
-            
-            # Nettoyer le fichier uploadé en cas d'erreur
-            try:
-                if 'uploaded_file' in locals():
-                    self.client.files.delete(uploaded_file.id)
-                    logger.info(f"🗑️ Fichier temporaire supprimé après erreur: {uploaded_file.id}")
-            except Exception as cleanup_error:
-                logger.error(f"❌ Erreur lors du nettoyage: {cleanup_error}")
-                
-            # Messages d'erreur plus spécifiques
-            if "API key" in str(e).lower():
-                raise Exception("Clé API OpenAI manquante ou invalide. Contactez l'administrateur.")
-            elif "quota" in str(e).lower() or "limit" in str(e).lower():
-                raise Exception("Quota OpenAI dépassé. Veuillez réessayer plus tard.")
-            elif "timeout" in str(e).lower():
-                raise Exception("Délai d'attente dépassé. Le document est peut-être trop volumineux.")
-            else:
-                raise Exception(f"Erreur lors de la génération des questions: {str(e)}")
+            raise self._friendly_error(e)
+        
+        finally:
+            # Nettoyer le fichier uploadé (les fichiers en cache sont conservés pour les prochaines générations)
+            if owned_file_id:
+                self._delete_uploaded_file(owned_file_id)
     
-    def _build_education_context(self, education_level):
-        """Construit un contexte éducatif détaillé basé sur le niveau d'éducation"""
-        if not education_level:
-            return "Niveau d'éducation: Non spécifié - Adapte le contenu à un niveau général."
-        
-        # Mapping des niveaux vers des contextes détaillés
-        education_contexts = {
-            # Collège
-            "6ème": "Niveau: 6ème (11-12 ans) - Utilise un vocabulaire simple, des concepts concrets, évite le jargon technique. Questions basées sur la mémorisation et la compréhension de base.",
-            "5ème": "Niveau: 5ème (12-13 ans) - Vocabulaire accessible, concepts progressivement plus abstraits. Mélange mémorisation et compréhension.",
-            "4ème": "Niveau: 4ème (13-14 ans) - Vocabulaire de niveau collège, introduction de concepts plus complexes. Questions de compréhension et d'application basique.",
-            "3ème": "Niveau: 3ème (14-15 ans) - Vocabulaire de fin de collège, concepts abstraits maîtrisés. Questions d'application et d'analyse simple.",
-            
-            # Lycée
-            "2nde": "Niveau: 2nde (15-16 ans) - Vocabulaire lycéen, concepts abstraits. Questions de compréhension, application et analyse.",
-            "1ère": "Niveau: 1ère (16-17 ans) - Vocabulaire spécialisé selon la matière, concepts avancés. Questions d'analyse et de synthèse.",
-            "Terminale": "Niveau: Terminale (17-18 ans) - Vocabulaire expert, concepts complexes. Questions d'analyse, synthèse et évaluation.",
-            "Bac Pro": "Niveau: Bac Pro - Vocabulaire professionnel, applications concrètes. Questions pratiques et techniques.",
-            "Bac Techno": "Niveau: Bac Techno - Vocabulaire technique spécialisé, applications sectorielles. Questions techniques et appliquées.",
-            "CAP": "Niveau: CAP - Vocabulaire professionnel de base, applications pratiques. Questions concrètes et opérationnelles.",
-            
-            # Supérieur
-            "BTS": "Niveau: BTS - Vocabulaire professionnel avancé, applications sectorielles. Questions techniques et professionnelles.",
-            "DUT": "Niveau: DUT - Vocabulaire technique spécialisé, applications industrielles. Questions techniques et méthodologiques.",
-            "BUT": "Niveau: BUT - Vocabulaire technique expert, applications professionnelles. Questions techniques avancées et méthodologiques.",
-            "Licence": "Niveau: Licence - Vocabulaire académique, concepts théoriques. Questions d'analyse, synthèse et critique.",
-            "Licence Pro": "Niveau: Licence Pro - Vocabulaire professionnel expert, applications avancées. Questions techniques et managériales.",
-            "Master": "Niveau: Master - Vocabulaire académique expert, concepts avancés. Questions de recherche, analyse critique et innovation.",
-            "Master Pro": "Niveau: Master Pro - Vocabulaire professionnel expert, applications stratégiques. Questions de management et d'innovation.",
-            "Doctorat": "Niveau: Doctorat - Vocabulaire scientifique expert, concepts de pointe. Questions de recherche, innovation et contribution au savoir.",
-            "École d'ingénieur": "Niveau: École d'ingénieur - Vocabulaire technique expert, applications industrielles. Questions techniques, méthodologiques et d'innovation.",
-            "École de commerce": "Niveau: École de commerce - Vocabulaire business expert, applications stratégiques. Questions de management, stratégie et leadership.",
-            "École spécialisée": "Niveau: École spécialisée - Vocabulaire expert du domaine, applications professionnelles. Questions spécialisées et pratiques.",
-            "Formation continue": "Niveau: Formation continue - Vocabulaire professionnel adapté, applications pratiques. Questions opérationnelles et d'amélioration.",
+    def stream_questions_from_document(self, file_path, document_title, question_count=5, difficulty='medium', education_level='', instructions='', content_hash='', document_text=None, duplicate_index=None):
+        """
+        Variante en streaming : générateur qui produit chaque question dès que
+        son objet JSON est complet dans la sortie du modèle (quasi-doublons écartés)
+        """
+        duplicate_index = SimilarityIndex() if duplicate_index is None else duplicate_index
+        owned_file_id = None
+        stream = None
+        self._reset_usage()
+        try:
+            logger.info(f"🚀 Début de génération IA en streaming pour le document: {document_title}")
+            self._log_generation_parameters(file_path, question_count, difficulty, education_level, instructions)
             
-            # Professionnel
-            "En activité": "Niveau: Professionnel en activité - Vocabulaire professionnel, applications pratiques. Questions opérationnelles et d'efficacité.",
-            "En recherche d'emploi": "Niveau: Professionnel en recherche - Vocabulaire professionnel, applications pratiques. Questions de compétences et d'adaptation.",
-            "Retraité": "Niveau: Retraité - Vocabulaire accessible, applications concrètes. Questions de compréhension et d'application basique.",
+            education_context = self._build_education_context(education_level)
+            attachment, owned_file_id = self._timed_prepare_attachment(file_path, content_hash, document_text)
+            
+            started = time.monotonic()
+            stream = self._create_completion(
+                **self._build_completion_kwargs(attachment, document_title, question_count, difficulty, education_context, instructions),
+                stream=True,
+                # Dernier morceau sans choix portant l'usage (dont les tokens en cache)
+                stream_options={"include_usage": True}
+            )
             
-            # Autre
-            "Autre": "Niveau: Autre - Adapte le contenu à un niveau général accessible. Questions de compréhension et d'application."
+            parser = IncrementalQuestionParser()
+            produced = []
+            first_token_seconds = None
+            usage = None
+            for chunk in stream:
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices or parser.finished:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta and first_token_seconds is None:
+                    first_token_seconds = time.monotonic() - started
+                for question in parser.feed(delta):
+                    if not duplicate_index.add_if_new(question['question_text']):
+                        logger.info(f"🧹 Quasi-doublon écarté: {question['question_text'][:80]}")
+                        continue
+                    produced.append(question)
+                    yield question
+            
+            self._record_usage(usage, time.monotonic() - started, first_token_seconds)
+            logger.info(f"✅ Streaming terminé, {len(produced)} questions produites ({parser.rejected} ignorée(s))")
+            
+            if len(produced) < question_count:
+                for question in self._top_up_questions(attachment, document_title, produced, question_count, difficulty, education_context, instructions, duplicate_index):
+                    yield question
+            
+        except GeneratorExit:
+            # Le client a fermé la connexion : fermer aussi la réponse du modèle
+            if stream is not None and hasattr(stream, 'close'):
+                stream.close()
+            raise
+        
+        except Exception as e:
+            raise self._friendly_error(e)
+        
+        finally:
+            if owned_file_id:
+                self._delete_uploaded_file(owned_file_id)
+    
+    def _reset_usage(self):
+        self.usage = {
+            'model': self.model,
+            'calls': 0,
+            'prompt_tokens': 0,
+            'cached_tokens': 0,
+            'completion_tokens': 0,
+            'latency_seconds': 0.0,
+            'first_token_seconds': None,
+            'upload_seconds': 0.0,
         }
+    
+    def _record_usage(self, usage, latency_seconds, first_token_seconds=None):
+        """
+        Cumule l'usage rapporté par l'API pour un appel. `cached_tokens` compte les
+        tokens du prompt servis par le cache de préfixe du fournisseur.
+        """
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        if not isinstance(prompt_tokens, int):
+            prompt_tokens = 0
+        cached_tokens = getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', None)
+        if not isinstance(cached_tokens, int):
+            cached_tokens = 0
+        completion_tokens = getattr(usage, 'completion_tokens', None)
+        if not isinstance(completion_tokens, int):
+            completion_tokens = 0
+        
+        record_model_call(self.model, latency_seconds)
+        with self._usage_lock:
+            self.usage['calls'] += 1
+            self.usage['prompt_tokens'] += prompt_tokens
+            self.usage['cached_tokens'] += cached_tokens
+            self.usage['completion_tokens'] += completion_tokens
+            self.usage['latency_seconds'] += latency_seconds
+            if first_token_seconds is not None and self.usage['first_token_seconds'] is None:
+                self.usage['first_token_seconds'] = first_token_seconds
+        
+        cached_ratio = cached_tokens / prompt_tokens if prompt_tokens else 0
+        first_token = f", premier token {first_token_seconds * 1000:.0f} ms" if first_token_seconds is not None else ""
+        logger.info(f"💾 Tokens: {prompt_tokens} en entrée dont {cached_tokens} en cache ({cached_ratio:.0%}), {completion_tokens} en sortie, {latency_seconds * 1000:.0f} ms{first_token}")
+    
+    def _log_generation_parameters(self, file_path, question_count, difficulty, education_level, instructions):
+        """Journalise les paramètres et vérifie la configuration"""
+        logger.info(f"📁 Chemin du fichier: {file_path}")
+        logger.info(f"📊 Paramètres: {question_count} questions, difficulté {difficulty}, niveau {education_level}")
+        logger.info(f"📝 Instructions personnalisées: {instructions[:100] if instructions else 'Aucune'}...")
+        
+        # Vérifier la clé API
+        if not settings.OPENAI_API_KEY:
+            logger.error("❌ Clé API OpenAI manquante dans les paramètres")
+            raise Exception("Configuration OpenAI manquante")
+        
+        logger.info(f"🔑 Clé API OpenAI configurée: {settings.OPENAI_API_KEY[:10]}...")
+    
+    def _timed_prepare_attachment(self, file_path, content_hash='', document_text=None):
+        started = time.monotonic()
+        try:
+            return self._prepare_attachment(file_path, content_hash, document_text)
+        finally:
+            self.usage['upload_seconds'] += time.monotonic() - started
+    
+    def _prepare_attachment(self, file_path, content_hash='', document_text=None):
+        """
+        Construit la partie du message contenant le fichier selon son type.
+        Retourne (attachment, file_id à supprimer après la génération ou None).
+        """
+        # Texte extrait localement (voir accounts.extraction) : envoyé à la place du fichier
+        if document_text:
+            logger.info(f"📑 Envoi du texte extrait ({len(document_text)} caractères) à la place du fichier")
+            return {
+                "type": "text",
+                "text": f"CONTENU DU DOCUMENT (extraits) :\n\n{document_text}"
+            }, None
+        
+        # Déterminer le type MIME du fichier (aucune lecture complète du fichier ici)
+        file_extension = os.path.splitext(file_path)[1].lower()
+        mime_type = get_mime_type(file_path)
+        logger.info(f"📏 Taille du fichier: {os.path.getsize(file_path)} bytes")
+        logger.info(f"🏷️ Extension: {file_extension}, Type MIME: {mime_type}")
+        
+        if file_extension not in DOCUMENT_EXTENSIONS:
+            # Pour les images, utiliser le type "image_url" (pas d'upload de fichier),
+            # avec la version réduite et recompressée préparée à l'upload
+            image_path, mime_type = get_vision_image(file_path, mime_type)
+            logger.info(f"🖼️ Ajout de l'image de type: {mime_type} ({os.path.getsize(image_path)} bytes)")
+            return {
+                "type": "image_url",
+                "image_url": {
+                    "url": build_image_data_url(image_path, mime_type)
+                }
+            }, None
+        
+        # Pour les documents, uploader le fichier en streaming (ou réutiliser
+        # l'upload d'un contenu identique) et utiliser le type "file"
+        owned_file_id = None
+        if self.file_cache is not None and content_hash:
+            file_id = self.file_cache.acquire(self.client, file_path, content_hash)
+        else:
+            logger.info(f"📤 Upload du fichier vers OpenAI...")
+            with open(file_path, 'rb') as upload_handle:
+                uploaded_file = self.client.files.create(
+                    file=(get_upload_name(file_path), upload_handle),
+                    purpose='assistants'
+                )
+            file_id = owned_file_id = uploaded_file.id
+            logger.info(f"✅ Fichier uploadé avec l'ID: {file_id}")
         
-        return education_contexts.get(education_level, f"Niveau: {education_level} - Adapte le contenu à ce niveau spécifique.")
+        logger.info(f"📄 Ajout du document de type: {mime_type}")
+        return {
+            "type": "file",
+            "file": {
+                "file_id": file_id
+            }
+        }, owned_file_id
     
-    def _get_fallback_questions(self, document_title, question_count, difficulty):
+    def _delete_uploaded_file(self, file_id):
+        """Supprime un fichier temporaire uploadé chez OpenAI"""
+        try:
+            self.client.files.delete(file_id)
+            logger.info(f"🗑️ Fichier temporaire supprimé: {file_id}")
+        except Exception as cleanup_error:
+            logger.warning(f"⚠️ Impossible de supprimer le fichier temporaire: {cleanup_error}")
+    
+    def _friendly_error(self, e):
+        """Traduit une erreur de génération en exception au message compréhensible par l'utilisateur"""
+        if isinstance(e, CircuitOpenError):
+            logger.error(f"🚨 Appel refusé, disjoncteur ouvert: {e}")
+            return Exception("Le service de génération est momentanément indisponible. Veuillez réessayer dans quelques minutes.")
+        
+        if isinstance(e, openai.AuthenticationError):
+            logger.error(f"❌ Erreur d'authentification OpenAI: {e}")
+            return Exception("Erreur d'authentification avec l'API OpenAI. Vérifiez la configuration de la clé API.")
+        
+        if isinstance(e, openai.RateLimitError):
+            logger.error(f"⏰ Limite de taux OpenAI atteinte: {e}")
+            return Exception("Limite de requêtes atteinte. Veuillez réessayer dans quelques minutes.")
+        
+        if isinstance(e, openai.APIError):
+            logger.error(f"🔌 Erreur API OpenAI: {e}")
+            return Exception("Erreur temporaire de l'API OpenAI. Veuillez réessayer.")
+        
+        logger.error(f"❌ Erreur inattendue lors de la génération IA: {e}")
+        logger.error(f"📋 Type d'erreur: {type(e).__name__}")
+        logger.error(f"📋 Détails: {str(e)}")
+        
+        # Messages d'erreur plus spécifiques
+        if "API key" in str(e).lower():
+            return Exception("Clé API OpenAI manquante ou invalide. Contactez l'administrateur.")
+        elif "quota" in str(e).lower() or "limit" in str(e).lower():
+            return Exception("Quota OpenAI dépassé. Veuillez réessayer plus tard.")
+        elif "timeout" in str(e).lower():
+            return Exception("Délai d'attente dépassé. Le document est peut-être trop volumineux.")
+        else:
+            return Exception(f"Erreur lors de la génération des questions: {str(e)}")
+    
+    def _split_into_shards(self, question_count, shard_size=None):
+        """Découpe le nombre de questions en lots d'au plus `shard_size` (AI_SHARD_SIZE par défaut, ex: 25 -> [9, 8, 8])"""
+        shard_size = max(1, shard_size or settings.AI_SHARD_SIZE)
+        shard_total = -(-question_count // shard_size)
+        if shard_total <= 1:
+            return [question_count]
+        base, remainder = divmod(question_count, shard_total)
+        return [base + (1 if index < remainder else 0) for index in range(shard_total)]
+    
+    def _generate_shards_in_parallel(self, shard_sizes, attachment, document_title, difficulty, education_context, instructions):
         """
-        Questions de secours en cas d'erreur avec l'API
+        Génère chaque lot dans un thread ; un lot en échec n'interrompt pas les autres
+        (les erreurs transitoires sont déjà retentées par le fournisseur, voir call_with_retry)
         """
-        fallback_questions = [
-            {
-                "question_text": f"Quel est le sujet principal du document '{document_title}' ?",
-                "difficulty": difficulty,
-                "answers": [
-                    {"text": "Le sujet principal du document", "is_correct": True},
-                    {"text": "Un sujet secondaire", "is_correct": False},
-                    {"text": "Une information accessoire", "is_correct": False},
-                    {"text": "Une conclusion", "is_correct": False}
-                ]
-            },
-            {
-                "question_text": f"Le document '{document_title}' contient-il des informations importantes ?",
-                "difficulty": difficulty,
-                "answers": [
-                    {"text": "Oui, des informations importantes", "is_correct": True},
-                    {"text": "Non, aucune information", "is_correct": False},
-                    {"text": "Seulement des détails", "is_correct": False},
-                    {"text": "Des informations obsolètes", "is_correct": False}
-                ]
+        results = [None] * len(shard_sizes)
+        errors = []
+        max_workers = min(len(shard_sizes), max(1, settings.AI_MAX_PARALLEL_SHARDS))
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    self._generate_shard,
+                    attachment, document_title, count, difficulty, education_context, instructions,
+                    index + 1, len(shard_sizes)
+                ): index
+                for index, count in enumerate(shard_sizes)
             }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    logger.error(f"❌ Lot {index + 1}/{len(shard_sizes)} abandonné: {e}")
+                    errors.append(e)
+        
+        questions = [question for shard in results if shard for question in shard]
+        if not questions:
+            # Aucun lot n'a abouti : remonter la première erreur
+            raise errors[0]
+        if errors:
+            logger.warning(f"⚠️ {len(errors)} lot(s) en échec, {len(questions)} questions conservées")
+        return questions
+    
+    def _generate_shard(self, attachment, document_title, question_count, difficulty, education_context, instructions, shard_index=None, shard_total=None):
+        """Envoie une requête de génération pour `question_count` questions et retourne la liste parsée"""
+        started = time.monotonic()
+        response = self._create_completion(
+            **self._build_completion_kwargs(attachment, document_title, question_count, difficulty, education_context, instructions, shard_index, shard_total)
+        )
+        
+        logger.info(f"✅ Réponse reçue d'OpenAI")
+        self._record_usage(getattr(response, 'usage', None), time.monotonic() - started)
+        
+        if response.choices[0].finish_reason == 'length':
+            logger.warning(f"✂️ Réponse coupée par la limite de tokens ({question_count} questions demandées)")
+        
+        # Extraire le contenu de la réponse
+        content = response.choices[0].message.content.strip()
+        return self._parse_questions_content(content)
+    
+    def _create_completion(self, **kwargs):
+        """Appel chat.completions ; les échecs sont comptés dans les mesures du modèle (routage)"""
+        started = time.monotonic()
+        try:
+            return self.client.chat.completions.create(**kwargs)
+        except CircuitOpenError:
+            # Appel refusé sans contacter le fournisseur : rien à mesurer
+            raise
+        except Exception:
+            record_model_call(self.model, time.monotonic() - started, failed=True)
+            raise
+    
+    def _build_completion_kwargs(self, attachment, document_title, question_count, difficulty, education_context, instructions, shard_index=None, shard_total=None):
+        """
+        Paramètres de l'appel chat.completions pour un lot de `question_count` questions.
+        Ordre des messages du plus stable au plus variable : prompt système fixe,
+        document (commun aux lots et compléments d'une même génération), puis
+        les paramètres de la demande.
+        """
+        prompt = self._build_prompt(document_title, question_count, difficulty, education_context, instructions, shard_index, shard_total)
+        
+        # Construire le message avec le fichier
+        message_content = [
+            attachment,
+            {"type": "text", "text": prompt}
         ]
         
-        # Retourner le nombre demandé de questions
-        return fallback_questions[:question_count]
+        logger.info(f"🤖 Envoi de la requête à OpenAI avec le modèle {self.model}")
+        logger.info(f"📝 Contenu du message: {len(message_content)} éléments")
+        
+        # Calculer max_tokens de manière très généreuse pour éviter les coupures
+        # Estimation large : 150 tokens par question + 1000 tokens de marge
+        estimated_tokens = (question_count * 150) + 1000
+        max_tokens = min(max(estimated_tokens, 2000), 8000)  # Entre 2000 et 8000 tokens
+        
+        logger.info(f"🎯 Max tokens généreux: {max_tokens} pour {question_count} questions (estimation: {estimated_tokens})")
+        
+        return {
+            'model': self.model,
+            'messages': [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": message_content}
+            ],
+            'max_tokens': max_tokens,
+            'temperature': self.temperature,
+        }
+    
+    def _build_prompt(self, document_title, question_count, difficulty, education_context, instructions, shard_index=None, shard_total=None):
+        """Partie variable du prompt (après le document) pour un lot de questions"""
+        lines = [
+            f"Titre du document: {document_title}",
+            education_context,
+            f"Génère exactement {question_count} questions QCM",
+            f"Niveau de difficulté demandé: {difficulty}",
+        ]
+        
+        # Répartir les lots sur le document pour limiter les doublons entre requêtes parallèles
+        if shard_total and shard_total > 1:
+            lines.append(f"Ce quiz est généré en {shard_total} parties. Tu génères la partie {shard_index}/{shard_total} : concentre-toi en priorité sur la {shard_index}e portion du document (découpé en {shard_total} portions de taille égale) pour éviter les questions en double avec les autres parties.")
+        
+        if instructions and instructions.strip():
+            lines.append(f"Instructions personnalisées de l'utilisateur:\n{instructions.strip()}")
+        
+        return '\n\n'.join(lines)
+    
+    def _parse_questions_content(self, content):
+        """
+        Parse la réponse du modèle et retourne les questions bien formées.
+        Une sortie tronquée ou partiellement invalide n'est pas rejetée : seules
+        les questions incomplètes ou illisibles sont écartées.
+        """
+        logger.info(f"📄 Contenu brut reçu: {content[:200]}...")
+        
+        questions, parser = parse_questions(content)
+        
+        if not parser.finished:
+            logger.warning(f"⚠️ Réponse JSON incomplète, {len(questions)} question(s) récupérée(s)")
+        if parser.rejected:
+            logger.warning(f"⚠️ {parser.rejected} question(s) incomplète(s) ou illisible(s) écartée(s)")
+        
+        if not questions:
+            logger.error("❌ Aucune question exploitable dans la réponse")
+            raise Exception("Erreur de parsing JSON de la réponse IA: aucune question exploitable")
+        
+        return questions
+    
+    def _top_up_questions(self, attachment, document_title, questions, question_count, difficulty, education_context, instructions, duplicate_index):
+        """
+        Complète une génération incomplète (réponse tronquée, questions écartées
+        ou doublons) en ne redemandant que les questions manquantes.
+        Retourne uniquement les nouvelles questions.
+        """
+        added = []
+        for attempt in range(1, max(0, settings.AI_TOP_UP_MAX_ATTEMPTS) + 1):
+            missing = question_count - len(questions) - len(added)
+            if missing <= 0:
+                break
+            
+            logger.info(f"➕ Complément de {missing} question(s) manquante(s) (tentative {attempt})")
+            # Questions produites et questions existantes dont des paraphrases ont été écartées
+            existing = [question['question_text'] for question in questions + added] + duplicate_index.rejected[-TOP_UP_AVOID_LIMIT:]
+            top_up_instructions = '\n'.join(filter(None, [
+                instructions,
+                "Ne reprends aucune de ces questions déjà posées :",
+                *(f"- {text}" for text in existing)
+            ]))
+            try:
+                extra = self._generate_shard(attachment, document_title, missing, difficulty, education_context, top_up_instructions)
+            except (openai.AuthenticationError, CircuitOpenError):
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Complément impossible, {len(questions) + len(added)} question(s) conservée(s): {e}")
+                break
+            
+            added += self._merge_questions(extra, missing, duplicate_index)
+        
+        return added
+    
+    def _merge_questions(self, questions, question_count, duplicate_index):
+        """
+        Fusionne les questions des différents lots : supprime la numérotation
+        propre à chaque lot, élimine les quasi-doublons (entre elles et avec les
+        questions de `duplicate_index`, complété au passage) et tronque au nombre demandé
+        """
+        merged = []
+        duplicates = 0
+        for question in questions:
+            if len(merged) >= question_count:
+                break
+            text = QUESTION_NUMBERING_PATTERN.sub('', question.get('question_text', '')).strip()
+            if not self._question_key(text) or not duplicate_index.add_if_new(text):
+                duplicates += 1
+                continue
+            merged.append({**question, 'question_text': text})
+        
+        if duplicates:
+            logger.info(f"🧹 {duplicates} question(s) en double ou quasi-doublon(s) supprimée(s) à la fusion")
+        return merged
+    
+    def _question_key(self, question_text):
+        return question_key(question_text)
+    
+    def _build_education_context(self, education_level):
+        """Contexte éducatif détaillé du niveau d'éducation (textes précalculés, voir EDUCATION_CONTEXTS)"""
+        if not education_level:
+            return DEFAULT_EDUCATION_CONTEXT
+        return EDUCATION_CONTEXTS.get(education_level, f"Niveau: {education_level} - Adapte le contenu à ce niveau spécifique.")
@@ -91,6 +91,16 @@ DATABASES = {
     )
 }
 
+# Cache partagé entre les processus web et worker (disjoncteur IA, compteurs, rate limiting)
+# Table créée par `python manage.py createcachetable` ; en DEBUG, cache mémoire par
+# processus par défaut pour qu'un poste de dev n'ayant lancé que `migrate` fonctionne
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache' if DEBUG else 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'django_cache'),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -172,6 +182,8 @@ CORS_ALLOW_CREDENTIALS = True
 
 # OpenAI API Key
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', 'your-openai-api-key-here')
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', '')
+AI_MODEL = os.environ.get('AI_MODEL', 'gpt-4o-mini')
 
 # Stripe Configuration
 STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY')
@@ -180,4 +192,152 @@ STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
 
 # Stripe Price IDs pour les abonnements
 STRIPE_PRICE_MONTHLY = os.environ.get('STRIPE_PRICE_MONTHLY', 'price_1SEWOrDrRzoIRADbmlBpSSRg')
-STRIPE_PRICE_YEARLY = os.environ.get('STRIPE_PRICE_YEARLY', 'price_1SEWPXDrRzoIRADbbsqZ3XkH')
\ No newline at end of file
+STRIPE_PRICE_YEARLY = os.environ.get('STRIPE_PRICE_YEARLY', 'price_1SEWPXDrRzoIRADbbsqZ3XkH')
+
+# File d'attente des générations IA (python manage.py run_generation_worker)
+GENERATION_WORKER_CONCURRENCY = int(os.environ.get('GENERATION_WORKER_CONCURRENCY', '4'))
+GENERATION_JOB_MAX_ATTEMPTS = int(os.environ.get('GENERATION_JOB_MAX_ATTEMPTS', '2'))
+# Attente avant de retenter un job échoué, doublée à chaque tentative
+GENERATION_JOB_RETRY_DELAY_SECONDS = int(os.environ.get('GENERATION_JOB_RETRY_DELAY_SECONDS', '30'))
+# Un job sans signe de vie de son worker (toutes les GENERATION_JOB_HEARTBEAT_SECONDS)
+# depuis GENERATION_JOB_STALE_SECONDS est remis en file, ou en échec après MAX_ATTEMPTS
+GENERATION_JOB_HEARTBEAT_SECONDS = int(os.environ.get('GENERATION_JOB_HEARTBEAT_SECONDS', '30'))
+GENERATION_JOB_STALE_SECONDS = int(os.environ.get('GENERATION_JOB_STALE_SECONDS', '600'))
+
+# Limiteur global des générations IA (partagé via la base entre processus et hôtes) :
+# places simultanées, plafonds des voies gratuite et invitée, attente maximale
+AI_CONCURRENCY_LIMIT = int(os.environ.get('AI_CONCURRENCY_LIMIT', '8'))
+AI_CONCURRENCY_FREE_MAX = int(os.environ.get('AI_CONCURRENCY_FREE_MAX', '6'))
+AI_CONCURRENCY_GUEST_MAX = int(os.environ.get('AI_CONCURRENCY_GUEST_MAX', '3'))
+AI_CONCURRENCY_MAX_WAIT_SECONDS = int(os.environ.get('AI_CONCURRENCY_MAX_WAIT_SECONDS', '300'))
+AI_CONCURRENCY_POLL_SECONDS = float(os.environ.get('AI_CONCURRENCY_POLL_SECONDS', '0.5'))
+# Bail d'une place, prolongé tant que la génération tourne : une place n'expire que si
+# son processus est tué
+AI_CONCURRENCY_LEASE_SECONDS = int(os.environ.get('AI_CONCURRENCY_LEASE_SECONDS', '120'))
+
+# Mode dégradé : questions construites localement à partir du texte du document quand le
+# disjoncteur est ouvert, quand AI_DEGRADED_BACKLOG générations attendent le modèle, ou
+# pour les invités quand AI_DEGRADED_GUEST_BACKLOG invités attendent déjà (0 = jamais)
+AI_DEGRADED_MODE_ENABLED = os.environ.get('AI_DEGRADED_MODE_ENABLED', 'True').lower() in ('true', '1', 'yes')
+AI_DEGRADED_BACKLOG = int(os.environ.get('AI_DEGRADED_BACKLOG', '30'))
+AI_DEGRADED_GUEST_BACKLOG = int(os.environ.get('AI_DEGRADED_GUEST_BACKLOG', '3'))
+
+# Upload groupé (Premium) : fichiers par requête, chacun mis en file pour le worker
+BULK_UPLOAD_MAX_FILES = int(os.environ.get('BULK_UPLOAD_MAX_FILES', '20'))
+
+# Cache des quiz générés (clé : SHA-256 du fichier + paramètres de génération)
+QUIZ_CACHE_MAX_ENTRIES = int(os.environ.get('QUIZ_CACHE_MAX_ENTRIES', '5000'))
+QUIZ_CACHE_MAX_BYTES = int(os.environ.get('QUIZ_CACHE_MAX_BYTES', str(100 * 1024 * 1024)))
+QUIZ_CACHE_MAX_AGE_DAYS = int(os.environ.get('QUIZ_CACHE_MAX_AGE_DAYS', '30'))
+
+# Cache des fichiers uploadés chez OpenAI (python manage.py sweep_provider_files)
+AI_FILE_CACHE_TTL_SECONDS = int(os.environ.get('AI_FILE_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+AI_FILE_CACHE_MAX_ENTRIES = int(os.environ.get('AI_FILE_CACHE_MAX_ENTRIES', '500'))
+AI_FILE_SWEEP_GRACE_SECONDS = int(os.environ.get('AI_FILE_SWEEP_GRACE_SECONDS', '3600'))
+# Préfixe des noms de fichiers uploadés : seuls ces fichiers peuvent être balayés comme orphelins
+AI_FILE_NAME_PREFIX = os.environ.get('AI_FILE_NAME_PREFIX', 'revisia-')
+
+# Upload en pipeline : les fichiers transmis tels quels au fournisseur lui sont envoyés
+# pendant leur enregistrement (tampon mémoire par upload, au-delà la suite est relue sur disque)
+AI_UPLOAD_PIPELINE_ENABLED = os.environ.get('AI_UPLOAD_PIPELINE_ENABLED', 'True').lower() in ('true', '1', 'yes')
+AI_UPLOAD_PIPELINE_WORKERS = int(os.environ.get('AI_UPLOAD_PIPELINE_WORKERS', '4'))
+AI_UPLOAD_PIPELINE_BUFFER_BYTES = int(os.environ.get('AI_UPLOAD_PIPELINE_BUFFER_BYTES', str(8 * 1024 * 1024)))
+# Attente maximale, à la génération, d'un upload du même contenu déjà en cours
+AI_UPLOAD_PIPELINE_WAIT_SECONDS = int(os.environ.get('AI_UPLOAD_PIPELINE_WAIT_SECONDS', '120'))
+
+# Découpage des grosses générations en lots parallèles
+AI_SHARD_SIZE = int(os.environ.get('AI_SHARD_SIZE', '10'))
+AI_MAX_PARALLEL_SHARDS = int(os.environ.get('AI_MAX_PARALLEL_SHARDS', '5'))
+# Appels complémentaires pour les questions manquantes d'une réponse tronquée
+AI_TOP_UP_MAX_ATTEMPTS = int(os.environ.get('AI_TOP_UP_MAX_ATTEMPTS', '1'))
+
+# Réserve de questions par document (utilisateurs connectés) : la génération produit
+# FACTOR fois le nombre demandé, le surplus sert les nouvelles leçons et reprises
+QUESTION_POOL_FACTOR = float(os.environ.get('QUESTION_POOL_FACTOR', '2'))
+QUESTION_POOL_MAX_GENERATION = int(os.environ.get('QUESTION_POOL_MAX_GENERATION', '50'))
+# Remplissage en arrière-plan quand la réserve passe sous le seuil
+QUESTION_POOL_REFILL_THRESHOLD = int(os.environ.get('QUESTION_POOL_REFILL_THRESHOLD', '5'))
+QUESTION_POOL_REFILL_SIZE = int(os.environ.get('QUESTION_POOL_REFILL_SIZE', '10'))
+
+# Quasi-doublons (MinHash) : similarité à partir de laquelle une question est remplacée,
+# et nombre de questions récentes des autres documents de l'utilisateur comparées
+QUESTION_DUPLICATE_THRESHOLD = float(os.environ.get('QUESTION_DUPLICATE_THRESHOLD', '0.45'))
+QUESTION_DUPLICATE_USER_LIMIT = int(os.environ.get('QUESTION_DUPLICATE_USER_LIMIT', '1000'))
+
+# Extraction locale du texte : seuls des extraits répartis sur le document, dans
+# un budget de tokens proportionnel au nombre de questions, sont envoyés au modèle
+AI_TEXT_EXTRACTION_ENABLED = os.environ.get('AI_TEXT_EXTRACTION_ENABLED', 'True').lower() in ('true', '1', 'yes')
+AI_TEXT_TOKENS_PER_QUESTION = int(os.environ.get('AI_TEXT_TOKENS_PER_QUESTION', '500'))
+AI_TEXT_MIN_TOKENS = int(os.environ.get('AI_TEXT_MIN_TOKENS', '4000'))
+AI_TEXT_MAX_TOKENS = int(os.environ.get('AI_TEXT_MAX_TOKENS', '40000'))
+
+# Instructions personnalisées : recherche BM25 des extraits visés ; ceux dont le score
+# est sous AI_RETRIEVAL_MIN_SCORE_RATIO fois le meilleur sont écartés, sauf pour
+# atteindre AI_RETRIEVAL_MIN_TOKENS tokens
+AI_RETRIEVAL_ENABLED = os.environ.get('AI_RETRIEVAL_ENABLED', 'True').lower() in ('true', '1', 'yes')
+AI_RETRIEVAL_MIN_SCORE_RATIO = float(os.environ.get('AI_RETRIEVAL_MIN_SCORE_RATIO', '0.3'))
+AI_RETRIEVAL_MIN_TOKENS = int(os.environ.get('AI_RETRIEVAL_MIN_TOKENS', '1500'))
+
+# PDF longs sans plage de pages demandée : au-delà de ce nombre de pages, seules des
+# pages réparties sur le document sont envoyées au fournisseur (0 = document complet)
+AI_PDF_MAX_PAGES = int(os.environ.get('AI_PDF_MAX_PAGES', '30'))
+
+# Profil des documents (calculé à l'upload) : tokens lus par page de PDF scanné, et
+# au-delà de AI_LARGE_PROMPT_TOKENS, lots plus gros et modèle dédié (vide = AI_MODEL)
+AI_SCANNED_PAGE_TOKENS = int(os.environ.get('AI_SCANNED_PAGE_TOKENS', '800'))
+AI_LARGE_PROMPT_TOKENS = int(os.environ.get('AI_LARGE_PROMPT_TOKENS', '15000'))
+AI_LARGE_PROMPT_SHARD_SIZE = int(os.environ.get('AI_LARGE_PROMPT_SHARD_SIZE', '20'))
+AI_LARGE_PROMPT_MODEL = os.environ.get('AI_LARGE_PROMPT_MODEL', '')
+# Tokens de document au plus par génération selon le rôle (0 = sans limite)
+DOCUMENT_MAX_PROMPT_TOKENS_GUEST = int(os.environ.get('DOCUMENT_MAX_PROMPT_TOKENS_GUEST', '12000'))
+DOCUMENT_MAX_PROMPT_TOKENS_FREE = int(os.environ.get('DOCUMENT_MAX_PROMPT_TOKENS_FREE', '24000'))
+DOCUMENT_MAX_PROMPT_TOKENS_PREMIUM = int(os.environ.get('DOCUMENT_MAX_PROMPT_TOKENS_PREMIUM', '0'))
+
+# Routage des modèles : table de règles JSON (voir accounts.model_routing ; vide = AI_MODEL,
+# et AI_LARGE_PROMPT_MODEL pour les gros documents). Sur les AI_ROUTING_WINDOW_SECONDS
+# dernières secondes et au-delà de AI_ROUTING_MIN_CALLS appels, un modèle dont le taux
+# d'erreur atteint AI_ROUTING_MAX_ERROR_RATE cède la place au modèle de repli de sa règle
+AI_MODEL_ROUTES = os.environ.get('AI_MODEL_ROUTES', '')
+AI_ROUTING_WINDOW_SECONDS = int(os.environ.get('AI_ROUTING_WINDOW_SECONDS', '600'))
+AI_ROUTING_MIN_CALLS = int(os.environ.get('AI_ROUTING_MIN_CALLS', '5'))
+AI_ROUTING_MAX_ERROR_RATE = float(os.environ.get('AI_ROUTING_MAX_ERROR_RATE', '0.3'))
+
+# Préparation des images pour le modèle de vision (orientation, réduction, recompression JPEG)
+AI_IMAGE_PREPROCESSING_ENABLED = os.environ.get('AI_IMAGE_PREPROCESSING_ENABLED', 'True').lower() in ('true', '1', 'yes')
+AI_IMAGE_MAX_LONG_SIDE = int(os.environ.get('AI_IMAGE_MAX_LONG_SIDE', '2048'))
+AI_IMAGE_MAX_SHORT_SIDE = int(os.environ.get('AI_IMAGE_MAX_SHORT_SIDE', '768'))
+AI_IMAGE_JPEG_QUALITY = int(os.environ.get('AI_IMAGE_JPEG_QUALITY', '85'))
+AI_IMAGE_WORKERS = int(os.environ.get('AI_IMAGE_WORKERS', '2'))
+
+# Fournisseur IA : 'openai' ou 'replay' (rejeu local déterministe, sans réseau)
+AI_PROVIDER = os.environ.get('AI_PROVIDER', 'openai')
+AI_REPLAY_DIR = os.environ.get('AI_REPLAY_DIR', '')
+AI_REPLAY_LATENCY_MS = int(os.environ.get('AI_REPLAY_LATENCY_MS', '0'))
+# Dossier où enregistrer les réponses OpenAI pour les rejouer ensuite (vide = désactivé)
+AI_RECORD_DIR = os.environ.get('AI_RECORD_DIR', '')
+
+# Reprise sur erreur des appels IA (backoff exponentiel avec jitter, Retry-After respecté)
+AI_RETRY_MAX_ATTEMPTS = int(os.environ.get('AI_RETRY_MAX_ATTEMPTS', '3'))
+AI_RETRY_BASE_DELAY = float(os.environ.get('AI_RETRY_BASE_DELAY', '1.0'))
+AI_RETRY_MAX_DELAY = float(os.environ.get('AI_RETRY_MAX_DELAY', '30'))
+
+# Disjoncteur partagé (via le cache Django) : ouvert après N échecs transitoires sur la fenêtre
+AI_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('AI_CIRCUIT_FAILURE_THRESHOLD', '5'))
+AI_CIRCUIT_WINDOW_SECONDS = int(os.environ.get('AI_CIRCUIT_WINDOW_SECONDS', '60'))
+AI_CIRCUIT_COOLDOWN_SECONDS = int(os.environ.get('AI_CIRCUIT_COOLDOWN_SECONDS', '30'))
+
+# Pool de connexions HTTP du client IA partagé par processus
+AI_HTTP_MAX_CONNECTIONS = int(os.environ.get('AI_HTTP_MAX_CONNECTIONS', '20'))
+AI_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('AI_HTTP_MAX_KEEPALIVE_CONNECTIONS', '10'))
+AI_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('AI_HTTP_KEEPALIVE_EXPIRY', '60'))
+AI_HTTP_TIMEOUT = float(os.environ.get('AI_HTTP_TIMEOUT', '300'))
+AI_HTTP_CONNECT_TIMEOUT = float(os.environ.get('AI_HTTP_CONNECT_TIMEOUT', '10'))
+
+# Tarifs du modèle (euros par million de tokens) pour le coût estimé des GenerationRun
+AI_PRICE_INPUT_EUR_PER_MTOK = float(os.environ.get('AI_PRICE_INPUT_EUR_PER_MTOK', '0.14'))
+AI_PRICE_CACHED_INPUT_EUR_PER_MTOK = float(os.environ.get('AI_PRICE_CACHED_INPUT_EUR_PER_MTOK', '0.07'))
+AI_PRICE_OUTPUT_EUR_PER_MTOK = float(os.environ.get('AI_PRICE_OUTPUT_EUR_PER_MTOK', '0.55'))
+# Tarifs par modèle (JSON) pour les modèles choisis par le routage, ex.
+# {"gpt-4.1": {"input": 1.85, "cached_input": 0.46, "output": 7.4}} ; un modèle absent
+# de la table est compté aux tarifs AI_PRICE_* ci-dessus
+AI_MODEL_PRICES = os.environ.get('AI_MODEL_PRICES', '')